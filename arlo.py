@@ -1,18 +1,37 @@
 #!/usr/bin/env python3
 
-import datetime, io, math, os, pickle, queue, sys, threading, tkinter
+import asyncio, bisect, collections, datetime, hashlib, heapq, http.client
+import http.server, io, json, math, multiprocessing, os, pickle, queue, random
+import re, shlex, signal, sqlite3, string, struct, sys, threading, time
+import tkinter, urllib.error, urllib.request, concurrent.futures
+import multiprocessing.connection
+from multiprocessing import shared_memory
 from tkinter import simpledialog
 from dataclasses import dataclass
-from urllib.parse import urljoin
-from urllib.request import pathname2url
+from urllib.parse import urljoin, urlparse
+from urllib.request import pathname2url, url2pathname
 
-import cv2 # install with "pip install opencv-python"; on Ubuntu install with "sudo apt install -y python3-opencv"
+STARTED = time.monotonic() # for startup time measurements
+
+import numpy # installed along with opencv-python
 from PIL import Image, ImageTk # install with "pip install Pillow"; on Ubuntu install with "sudo apt install -y python3-pil python3-pil.imagetk"
 
-import pyaarlo # install with "pip install git+https://github.com/twrecked/pyaarlo"
+# OpenCV and pyaarlo take a while to import and are not needed to paint the
+# window; cv2 is imported by opencv() when the first stream starts, pyaarlo by
+# ArloCore when it connects. These are the values of pyaarlo.constant.
+cv2 = None
+TFA_EMAIL_TYPE      = 'EMAIL'
+TFA_SMS_TYPE        = 'SMS'
+BATTERY_KEY         = 'batteryLevel'
+LAST_IMAGE_DATA_KEY = 'presignedLastImageData'
+MOTION_DETECTED_KEY = 'motionDetected'
 
-from pyaarlo.constant import (TFA_SMS_TYPE, TFA_EMAIL_TYPE,
-                              LAST_IMAGE_DATA_KEY, MOTION_DETECTED_KEY)
+# Import OpenCV on first use.
+def opencv():
+    global cv2
+    if cv2 is None:
+        import cv2 # install with "pip install opencv-python"; on Ubuntu install with "sudo apt install -y python3-opencv"
+    return cv2
 
 #
 # pyaarlo saves session in BASE_DIRECTORY.
@@ -33,89 +52,981 @@ else:
 VIDEO_DIRECTORY = os.path.expanduser('~/Videos/Arlo')
 HTML_EXPIRATION = 3 * 24 * 3600  # 3 days in seconds
 
+# Videos recorded on local motion detection are written here.
+LOCAL_VIDEO_DIRECTORY = os.path.join(VIDEO_DIRECTORY, 'Local')
+
+# Thumbnails, contact strips, and timelapses of archived videos.
+THUMBNAIL_DIRECTORY = os.path.join(VIDEO_DIRECTORY, 'Thumbnails')
+
 if not os.path.exists(VIDEO_DIRECTORY):
     os.makedirs(VIDEO_DIRECTORY)
 
 #
-# Platform-specific Notifications.
+# Metrics in Prometheus text format, served on localhost by enable() and
+# summarized in a periodic log line. Hot paths count and time events with
+# observe() only while metrics are enabled. Values that components keep anyway,
+# such as frame rates and download statistics, are read by collector functions
+# when metrics are scraped or logged, so they cost nothing otherwise.
 #
-@dataclass
+class Metrics:
+
+    # Upper bounds of histogram buckets in seconds.
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+               2.5, 5.0, 10.0, 30.0)
+
+    # Type and help text of each metric.
+    METRICS = {
+        'arlo_stream_fps'                 : ('gauge', 'Frame rate of live '
+                                             'stream.'),
+        'arlo_stream_frames_total'        : ('counter', 'Frames decoded from '
+                                             'live stream.'),
+        'arlo_stream_dropped_frames_total': ('counter', 'Frames replaced '
+                                             'before they were displayed.'),
+        'arlo_stream_queue_depth'         : ('gauge', 'Decoded frames '
+                                             'waiting for display.'),
+        'arlo_stream_reconnects_total'    : ('counter', 'Reconnects of live '
+                                             'stream.'),
+        'arlo_frame_latency_seconds'      : ('histogram', 'Time from frame '
+                                             'capture to display.'),
+        'arlo_tk_queue_depth'             : ('gauge', 'Calls waiting for the '
+                                             'Tk thread.'),
+        'arlo_tk_callback_seconds'        : ('histogram', 'Duration of calls '
+                                             'on the Tk thread.'),
+        'arlo_event_lag_seconds'          : ('histogram', 'Time from pyaarlo '
+                                             'event callback until the event '
+                                             'is handled.'),
+        'arlo_snapshot_decode_seconds'    : ('histogram', 'Time to decode and '
+                                             'scale a snapshot.'),
+        'arlo_snapshots_decoded_total'    : ('counter', 'Snapshots decoded.'),
+        'arlo_snapshot_cache_hits_total'  : ('counter', 'Snapshots found in '
+                                             'decoder cache.'),
+        'arlo_ml_update_seconds'          : ('histogram', 'Duration of media '
+                                             'library updates.'),
+        'arlo_media_refreshes_total'      : ('counter', 'Media library '
+                                             'refreshes.'),
+        'arlo_media_waiting'              : ('gauge', 'Cameras waiting for '
+                                             'motion videos.'),
+        'arlo_download_bytes_total'       : ('counter', 'Bytes downloaded.'),
+        'arlo_download_rate_bytes'        : ('gauge', 'Download throughput in '
+                                             'bytes per second.'),
+        'arlo_downloads_active'           : ('gauge', 'Downloads running.'),
+        'arlo_downloads_queued'           : ('gauge', 'Downloads waiting.'),
+        'arlo_downloads_total'            : ('counter', 'Downloads finished '
+                                             'by result.'),
+        'arlo_index_queue_depth'          : ('gauge', 'Archived videos '
+                                             'waiting to be indexed.'),
+        'arlo_videos_indexed_total'       : ('counter', 'Archived videos '
+                                             'indexed by result.'),
+        'arlo_battery_level'              : ('gauge', 'Battery level of '
+                                             'camera in percent.'),
+        'arlo_battery_low_seconds'        : ('gauge', 'Predicted time until '
+                                             'camera battery is low.'),
+        'arlo_signal_strength'            : ('gauge', 'WiFi signal strength '
+                                             'of camera, 0 to 5.'),
+        'arlo_notifications_total'        : ('counter', 'Notification events '
+                                             'by outcome.'),
+        'arlo_notifications_pending'      : ('gauge', 'Notifications waiting '
+                                             'to be shown.'),
+        'arlo_notification_latency_seconds': ('histogram', 'Time from posting '
+                                              'to showing a notification.')
+    }
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.histograms = {} # (name, labels) -> [bucket counts, sum]
+        self.collectors = [] # functions returning (name, labels, value)
+        self.logged = {}     # histogram name -> (count, sum) at last log
+        self.server = None
+
+    # Enable metrics; serve them on localhost at given port and print a summary
+    # every log_interval seconds if given.
+    def enable(self, port: int = None, log_interval: float = None) -> None:
+        self.enabled = True
+        if port is not None:
+            try:
+                self.server = http.server.ThreadingHTTPServer(
+                                  ('127.0.0.1', port), MetricsHandler)
+            except OSError as e:
+                print(f"Cannot serve metrics on port {port}: {e}.")
+            else:
+                self.server.metrics = self
+                threading.Thread(target=self.server.serve_forever,
+                                 daemon=True).start()
+                print(f"Metrics at http://127.0.0.1:{port}/metrics.")
+        if log_interval:
+            threading.Thread(target=self.logThread, args=[log_interval],
+                             daemon=True).start()
+
+    # Add function that returns a list of (name, labels, value) tuples when
+    # metrics are collected; labels is a dict.
+    def addCollector(self, collector) -> None:
+        with self.lock:
+            self.collectors.append(collector)
+
+    # Record value in seconds in histogram name; a no-op while disabled.
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        idx = bisect.bisect_left(self.BUCKETS, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = \
+                    [[0] * (len(self.BUCKETS) + 1), 0.0]
+            histogram[0][idx] += 1
+            histogram[1] += value
+
+    # Values of all collectors as (name, labels, value) tuples.
+    def collect(self) -> list:
+        with self.lock:
+            collectors = list(self.collectors)
+        values = []
+        for collector in collectors:
+            try:
+                values.extend(collector())
+            except Exception as e: # skip collector, keep serving the others
+                print(f"Cannot collect metrics: {e}.")
+        return values
+
+    # All metrics in Prometheus text exposition format.
+    def render(self) -> str:
+        samples = collections.defaultdict(list) # name -> lines
+        for name, labels, value in self.collect():
+            samples[name].append(f"{name}{self.labelText(labels)} {value}")
+        with self.lock:
+            histograms = [(key, list(counts), total) for key, (counts, total)
+                          in self.histograms.items()]
+        for (name, labels), counts, total in sorted(histograms):
+            labels = dict(labels)
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                samples[name].append(f"{name}_bucket"
+                    f"{self.labelText({**labels, 'le': bound})} {cumulative}")
+            samples[name].append(f"{name}_sum{self.labelText(labels)} {total}")
+            samples[name].append(f"{name}_count{self.labelText(labels)} "
+                                 f"{cumulative}")
+        lines = []
+        for name in sorted(samples):
+            kind, text = self.METRICS.get(name, ('untyped', ''))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples[name])
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def labelText(labels: dict) -> str:
+        if not labels:
+            return ''
+        escape = lambda value: str(value).replace('\\', '\\\\') \
+                                         .replace('"', '\\"') \
+                                         .replace('\n', '\\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"'
+                              for key, value in labels.items()) + '}'
+
+    # One line with live stream frame rates, queue depths, download rate, and
+    # count and average of each histogram since the previous summary.
+    def summary(self) -> str:
+        parts = []
+        values = self.collect()
+        for name, labels, value in values:
+            if name == 'arlo_stream_fps':
+                dropped = next((v for n, l, v in values if l == labels and
+                                n == 'arlo_stream_dropped_frames_total'), 0)
+                parts.append(f"{labels['camera']} {value:.1f} fps "
+                             f"{dropped} dropped")
+            elif name == 'arlo_tk_queue_depth':
+                parts.append(f"tk queue {value}")
+            elif name == 'arlo_download_rate_bytes' and value:
+                parts.append(f"downloads {value / 1e6:.1f} MB/s")
+        totals = {}
+        with self.lock:
+            for (name, _), (counts, total) in self.histograms.items():
+                count, seconds = totals.get(name, (0, 0.0))
+                totals[name] = (count + sum(counts), seconds + total)
+        for name, (count, seconds) in sorted(totals.items()):
+            last_count, last_seconds = self.logged.get(name, (0, 0.0))
+            self.logged[name] = (count, seconds)
+            if count > last_count:
+                short = name[len('arlo_'):-len('_seconds')].replace('_', ' ')
+                average = (seconds - last_seconds) / (count - last_count)
+                parts.append(f"{short} {count - last_count} avg "
+                             f"{1000 * average:.1f} ms")
+        return 'Metrics: ' + ('; '.join(parts) if parts else 'idle')
+
+    def logThread(self, interval: float):
+        while True:
+            time.sleep(interval)
+            print(self.summary())
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_metrics = Metrics()
+
+# Return the metrics registry; disabled unless enable() has been called.
+def metrics() -> Metrics:
+    return _metrics
+
+#
+# Notifications. NotificationDispatcher shows them on a thread of its own, so
+# notify() and update_notification() never block their caller. Notifications
+# with the same key posted within COALESCE_WINDOW seconds are merged into one
+# notification that counts the events, and each key is shown at most once
+# every MIN_INTERVAL seconds.
+#
+@dataclass(eq=False)
 class Notification:
     id               : object
     notification     : str
     notification_body: str
+    key              : str   = None # notifications with same key coalesce
+    count            : int   = 1    # number of events in this notification
+    posted_at        : float = 0.0  # time.monotonic() of first event
+    queued_at        : float = 0.0  # time.monotonic() of latest queueing
 
-if sys.platform == "linux":
-    import dbus # install with "pip3 install dbus-python"; on Ubuntu install with "sudo apt install -y python3-dbus"
-
-    notify_itm = "org.freedesktop.Notifications"
-    notify_if  = dbus.Interface(dbus.SessionBus().
-                                get_object(notify_itm,
-                                           f"/{notify_itm.replace('.', '/')}"),
-                                notify_itm)
+    # Title shown; includes the number of coalesced events.
+    def title(self) -> str:
+        if self.count == 1:
+            return self.notification
+        return f"{self.notification} ({self.count} events)"
 
-    def notify(notification:str, notification_body:str) -> Notification:
-        return Notification(notify_if.Notify(os.path.split(sys.argv[0])[1], 0,
-                                             "", notification,
-                                             notification_body, [],
-                                             {"urgency": 1}, 0),
-                            notification, notification_body)
+# Notification backends are created on the dispatcher thread when the first
+# notification is shown. show() returns False if the notification cannot be
+# shown yet; the dispatcher retries later.
+class DbusNotificationBackend:
 
-    def update_notification(notification: Notification) -> None:
-        notify_if.Notify(os.path.split(sys.argv[0])[1],
-                         notification.id, "", notification.notification,
-                         notification.notification_body, [],
-                         {"urgency": 1}, 0)
+    supports_html = True
 
-    notification_supports_html = True
+    def __init__(self):
+        import dbus # install with "pip3 install dbus-python"; on Ubuntu install with "sudo apt install -y python3-dbus"
+        item = "org.freedesktop.Notifications"
+        self.interface = dbus.Interface(dbus.SessionBus().
+                                        get_object(item,
+                                                   f"/{item.replace('.', '/')}"),
+                                        item)
 
-elif sys.platform == "win32":
-    import win10toast # install with "pip install win10toast"
+    def show(self, notification: Notification) -> bool:
+        notification.id = self.interface.Notify(
+                              os.path.split(sys.argv[0])[1],
+                              notification.id or 0, "", notification.title(),
+                              notification.notification_body, [],
+                              {"urgency": 1}, 0)
+        return True
 
-    toaster = win10toast.ToastNotifier()
+class ToastNotificationBackend:
 
-    def notify(notification:str, notification_body:str) -> Notification:
-        while toaster.notification_active():
-            time.sleep(1.0)
-        toaster.show_toast(notification, notification_body,
-                           duration=60, threaded=True)
-        return Notification(None, notification, notification_body)
+    supports_html = False
 
-    def update_notification(notification: Notification) -> None:
-        while toaster.notification_active():
-            time.sleep(1.0)
-        toaster.show_toast(notification.notification,
-                           notification.notification_body,
-                           duration=60, threaded=True)
+    def __init__(self):
+        import win10toast # install with "pip install win10toast"
+        self.toaster = win10toast.ToastNotifier()
 
-    notification_supports_html = False
+    def show(self, notification: Notification) -> bool:
+        if self.toaster.notification_active():
+            return False
+        self.toaster.show_toast(notification.title(),
+                                notification.notification_body,
+                                duration=60, threaded=True)
+        return True
 
-else:
+class ConsoleNotificationBackend:
 
-    def notify(notification:str, notification_body:str) -> Notification:
-        print()
-        print(notification)
-        print('=' * len(notification))
-        print(notification_body)
-        print()
-        return Notification(None, notification, notification_body)
+    supports_html = False
 
-    def update_notification(notification: Notification) -> None:
+    def show(self, notification: Notification) -> bool:
+        title = notification.title()
         print()
-        print(notification.notification)
-        print('=' * len(notification.notification))
+        print(title)
+        print('=' * len(title))
         print(notification.notification_body)
         print()
+        return True
+
+# Shows nothing; for load tests and machines without a desktop.
+class NullNotificationBackend:
+
+    supports_html = False
+
+    def __init__(self):
+        self.shown = 0
+
+    def show(self, notification: Notification) -> bool:
+        self.shown += 1
+        return True
+
+if sys.platform == "linux":
+    DesktopNotificationBackend = DbusNotificationBackend
+elif sys.platform == "win32":
+    DesktopNotificationBackend = ToastNotificationBackend
+else:
+    DesktopNotificationBackend = ConsoleNotificationBackend
+
+NOTIFICATION_BACKENDS = {
+    'desktop': DesktopNotificationBackend,
+    'console': ConsoleNotificationBackend,
+    'none'   : NullNotificationBackend
+}
+
+class NotificationDispatcher:
+
+    QUEUE_SIZE      = 256 # max notifications waiting to be shown
+    COALESCE_WINDOW =  30 # seconds; same-key events merge within this window
+    MIN_INTERVAL    = 5.0 # seconds between showing the same key
+    RETRY_INTERVAL  = 1.0 # seconds; retry when backend is busy
+
+    def __init__(self, backend=DesktopNotificationBackend):
+        self.backend_class = backend
+        self.backend = None # created on the dispatcher thread
+        self.queue = queue.Queue(self.QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.recent = {}     # key -> latest Notification for key
+        self.pending = set() # notifications queued or waiting to be shown
+        self.last_shown = {} # key -> time.monotonic() of last show
+        self.posted = 0
+        self.coalesced = 0
+        self.shown = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        metrics().addCollector(self.collectMetrics)
+
+    @property
+    def supports_html(self) -> bool:
+        return self.backend_class.supports_html
+
+    # Post notification and return it; events with the same key within
+    # COALESCE_WINDOW seconds update the earlier notification instead.
+    def notify(self, notification: str, notification_body: str,
+               key: str = None) -> Notification:
+        now = time.monotonic()
+        with self.lock:
+            self.posted += 1
+            recent = self.recent.get(key) if key is not None else None
+            if recent is not None and \
+               now - recent.posted_at < self.COALESCE_WINDOW:
+                recent.count += 1
+                self.coalesced += 1
+                self.post(recent)
+                return recent
+            result = Notification(None, notification, notification_body,
+                                  key, 1, now)
+            if key is not None:
+                self.recent[key] = result
+            self.post(result)
+        return result
+
+    # Show notification again after its text has changed.
+    def update(self, notification: Notification) -> None:
+        with self.lock:
+            self.post(notification)
+
+    # Queue notification unless it is queued already; called with lock held.
+    # The dispatcher shows the text a notification has when its turn comes.
+    def post(self, notification: Notification) -> None:
+        if notification in self.pending:
+            return
+        try:
+            notification.queued_at = time.monotonic()
+            self.queue.put_nowait(notification)
+            self.pending.add(notification)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'posted'   : self.posted,
+                'coalesced': self.coalesced,
+                'shown'    : self.shown,
+                'dropped'  : self.dropped,
+                'pending'  : len(self.pending)
+            }
+
+    def collectMetrics(self) -> list:
+        stats = self.stats()
+        return [('arlo_notifications_total', {'outcome': outcome},
+                 stats[outcome])
+                for outcome in ('posted', 'coalesced', 'shown', 'dropped')] + \
+               [('arlo_notifications_pending', {}, stats['pending'])]
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join(1.0)
+
+    # Dispatcher thread; shows queued notifications when their key's rate
+    # limit allows.
+    def run(self):
+        waiting = [] # heap of (due, sequence number, notification)
+        sequence = 0
+        while True:
+            timeout = max(0.0, waiting[0][0] - time.monotonic()) \
+                      if waiting else None
+            try:
+                notification = self.queue.get(timeout=timeout)
+                if notification is None:
+                    return
+                key = notification.key or id(notification)
+                due = self.last_shown.get(key, -math.inf) + self.MIN_INTERVAL
+                sequence += 1
+                heapq.heappush(waiting, (due, sequence, notification))
+            except queue.Empty:
+                pass
+            while waiting and waiting[0][0] <= time.monotonic():
+                _, _, notification = heapq.heappop(waiting)
+                with self.lock:
+                    self.pending.discard(notification)
+                if self.show(notification):
+                    key = notification.key or id(notification)
+                    self.last_shown[key] = time.monotonic()
+                    continue
+                with self.lock: # backend busy; retry unless queued again
+                    if notification in self.pending:
+                        continue
+                    self.pending.add(notification)
+                sequence += 1
+                heapq.heappush(waiting, (time.monotonic() +
+                                         self.RETRY_INTERVAL, sequence,
+                                         notification))
+
+    # Show notification with backend; returns False if the backend is busy.
+    def show(self, notification: Notification) -> bool:
+        try:
+            if self.backend is None:
+                try:
+                    self.backend = self.backend_class()
+                except Exception as e: # e.g. no D-Bus session
+                    print(f"Desktop notifications not available: {e}.")
+                    self.backend_class = ConsoleNotificationBackend
+                    self.backend = self.backend_class()
+            if not self.backend.show(notification):
+                return False
+            with self.lock:
+                self.shown += 1
+            metrics().observe('arlo_notification_latency_seconds',
+                              time.monotonic() - notification.queued_at)
+        except Exception as e: # drop notification, keep dispatcher running
+            print(f"Cannot show notification: {e}.")
+        return True
+
+_notifications = None
+
+# Return the notification dispatcher; backend is used when it is created.
+def notifications(backend=DesktopNotificationBackend) -> NotificationDispatcher:
+    global _notifications
+    if _notifications is None:
+        _notifications = NotificationDispatcher(backend)
+    return _notifications
+
+def notify(notification: str, notification_body: str,
+           key: str = None) -> Notification:
+    return notifications().notify(notification, notification_body, key)
+
+def update_notification(notification: Notification) -> None:
+    notifications().update(notification)
+
+# Return path in directory for given video; expands the variables of
+# VIDEO_FILENAME_FORMAT the way pyaarlo does for its save_media_to option.
+# camera_name, e.g. with the site of the camera, replaces the camera's name.
+def video_file_name(video: 'pyaarlo.media.ArloVideo',
+                    directory: str = VIDEO_DIRECTORY,
+                    camera_name: str = None) -> str:
+    return os.path.join(directory,
+                        format_video_file_name(camera_name or
+                                               video.camera.name,
+                                               video.camera.device_id,
+                                               datetime.datetime.fromtimestamp(
+                                                   video.created_at / 1000)))
+
+# Return path in directory for a local recording.
+def local_video_file_name(camera_name: str, device_id: str,
+                          when: datetime.datetime,
+                          directory: str = LOCAL_VIDEO_DIRECTORY) -> str:
+    return os.path.join(directory,
+                        format_video_file_name(camera_name, device_id, when))
+
+def format_video_file_name(camera_name: str, device_id: str,
+                           when: datetime.datetime) -> str:
+    name = string.Template(VIDEO_FILENAME_FORMAT).substitute(
+               SN=device_id,
+               N=camera_name,
+               NN=re.sub(r'\W+', '_', camera_name.lower()).strip('_'),
+               Y=f'{when.year:04}', m=f'{when.month:02}', d=f'{when.day:02}',
+               H=f'{when.hour:02}', M=f'{when.minute:02}',
+               S=f'{when.second:02}', F=when.strftime('%Y-%m-%d'),
+               T=when.strftime('%H:%M:%S'), t=when.strftime('%H-%M-%S'),
+               s=str(int(when.timestamp())).zfill(10))
+    return name + '.mp4'
+
+#
+# SQLite index of the local video archive, kept in BASE_DIRECTORY. It records
+# every video this tool downloads and every html file it writes, so startup,
+# download dedupe, and html expiry are index lookups instead of directory
+# scans. Files added or removed outside this tool are picked up by reconcile,
+# which only lists VIDEO_DIRECTORY when its modification time has changed, and
+# only looks at the files when the listing differs from the index. Videos are
+# keyed by camera and creation time in whole seconds, the resolution of file
+# names, although times are kept in msecs.
+#
+class VideoIndex:
+
+    DATABASE   = os.path.join(BASE_DIRECTORY, 'archive.sqlite')
+    MTIME_TICK = 2 * 10**9 # nsecs; coarsest resolution of modification times
+
+    # Video states.
+    QUEUED   = 'queued'   # download queued or interrupted
+    DONE     = 'done'     # downloaded
+    FAILED   = 'failed'   # download failed
+    EXTERNAL = 'external' # file found in VIDEO_DIRECTORY, not downloaded by us
+
+    def __init__(self, database: str = DATABASE,
+                 directory: str = VIDEO_DIRECTORY):
+        self.directory = directory
+        os.makedirs(os.path.dirname(database), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(database, check_same_thread=False,
+                                  isolation_level=None)
+        with self.lock:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS videos (
+                                   camera     TEXT    NOT NULL,
+                                   created_at INTEGER NOT NULL,
+                                   path       TEXT    NOT NULL UNIQUE,
+                                   size       INTEGER,
+                                   duration   INTEGER,
+                                   state      TEXT    NOT NULL,
+                                   PRIMARY KEY (camera, created_at))''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS htmls (
+                                   path       TEXT PRIMARY KEY,
+                                   written_at REAL NOT NULL)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS meta (
+                                   key        TEXT PRIMARY KEY,
+                                   value)''')
+            # digest is NULL for videos that could not be decoded.
+            self.db.execute('''CREATE TABLE IF NOT EXISTS thumbnails (
+                                   path       TEXT PRIMARY KEY,
+                                   size       INTEGER,
+                                   digest     TEXT)''')
+            # Indexes of earlier versions have msecs in the key; the rows of
+            # videos that are also filed under whole seconds are dropped.
+            if self.db.execute("SELECT 1 FROM meta WHERE key = "
+                               "'key_seconds'").fetchone() is None:
+                self.db.execute('BEGIN')
+                self.db.execute("UPDATE OR IGNORE videos SET created_at = "
+                                "created_at - created_at % 1000 WHERE "
+                                "camera != ''")
+                self.db.execute("DELETE FROM videos WHERE camera != '' AND "
+                                "created_at % 1000 != 0")
+                self.db.execute("INSERT INTO meta VALUES ('key_seconds', 1)")
+                self.db.execute('COMMIT')
+
+    # Add video unless it is in the index already; returns its state.
+    # created_at is in msecs and filed under whole seconds.
+    def add(self, camera: str, created_at: int, path: str,
+            duration: int = None) -> str:
+        created_at -= created_at % 1000
+        with self.lock:
+            self.db.execute('INSERT OR IGNORE INTO videos (camera, created_at, '
+                            'path, duration, state) VALUES (?, ?, ?, ?, ?)',
+                            (camera, created_at, path, duration, self.QUEUED))
+            row = self.db.execute('SELECT state FROM videos WHERE camera = ? '
+                                  'AND created_at = ?',
+                                  (camera, created_at)).fetchone()
+        return row[0]
+
+    # State of video with given path or None if not in index.
+    def state(self, path: str) -> str:
+        with self.lock:
+            row = self.db.execute('SELECT state FROM videos WHERE path = ?',
+                                  (path,)).fetchone()
+        return row[0] if row else None
+
+    # True if video with given path is in the archive.
+    def isArchived(self, path: str) -> bool:
+        return self.state(path) in (self.DONE, self.EXTERNAL)
+
+    # Record state of a download; size is given for finished downloads.
+    def setState(self, path: str, state: str, size: int = None) -> None:
+        with self.lock:
+            self.db.execute('UPDATE videos SET state = ?, size = ? '
+                            'WHERE path = ?', (state, size, path))
+
+    # Camera, created_at, and size of archived video with given path or None.
+    def video(self, path: str) -> tuple:
+        with self.lock:
+            return self.db.execute('SELECT camera, created_at, size FROM '
+                                   'videos WHERE path = ? AND state IN (?, ?)',
+                                   (path, self.DONE, self.EXTERNAL)).fetchone()
+
+    # (camera, created_at, path, size) for all archived videos.
+    def archived(self) -> list:
+        with self.lock:
+            return self.db.execute('SELECT camera, created_at, path, size FROM '
+                                   'videos WHERE state IN (?, ?)',
+                                   (self.DONE, self.EXTERNAL)).fetchall()
+
+    # Remove video with given path from index; the file has been deleted.
+    def remove(self, path: str) -> None:
+        with self.lock:
+            self.db.execute('DELETE FROM videos WHERE path = ?', (path,))
+
+    # (path, size) of archived videos without thumbnails for their size.
+    def unindexed(self) -> list:
+        with self.lock:
+            return self.db.execute('SELECT v.path, v.size FROM videos v LEFT '
+                                   'JOIN thumbnails t ON t.path = v.path AND '
+                                   't.size IS v.size WHERE v.state IN (?, ?) '
+                                   'AND t.path IS NULL',
+                                   (self.DONE, self.EXTERNAL)).fetchall()
+
+    # Record SHA-1 digest of an indexed video, None if it cannot be decoded.
+    def addThumbnails(self, path: str, size: int, digest: str) -> None:
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO thumbnails VALUES '
+                            '(?, ?, ?)', (path, size, digest))
+
+    # (created_at, path, size, digest) of archived videos of camera created
+    # between start and end, in msecs, oldest first; digest is None for
+    # videos not indexed yet.
+    def cameraVideos(self, camera: str, start: int, end: int) -> list:
+        with self.lock:
+            return self.db.execute('SELECT v.created_at, v.path, v.size, '
+                                   't.digest FROM videos v LEFT JOIN '
+                                   'thumbnails t ON t.path = v.path AND '
+                                   't.size IS v.size WHERE v.camera = ? AND '
+                                   'v.created_at >= ? AND v.created_at < ? '
+                                   'AND v.state IN (?, ?) ORDER BY '
+                                   'v.created_at', (camera, start, end,
+                                   self.DONE, self.EXTERNAL)).fetchall()
+
+    # Forget thumbnails of videos no longer archived; returns the digests
+    # still in use.
+    def pruneThumbnails(self) -> set:
+        with self.lock:
+            self.db.execute('DELETE FROM thumbnails WHERE path NOT IN '
+                            '(SELECT path FROM videos WHERE state IN (?, ?))',
+                            (self.DONE, self.EXTERNAL))
+            return { digest for digest, in
+                     self.db.execute('SELECT DISTINCT digest FROM thumbnails '
+                                     'WHERE digest IS NOT NULL') }
+
+    # Record html file written for a video.
+    def addHtml(self, path: str) -> None:
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO htmls VALUES (?, ?)',
+                            (path, time.time()))
+
+    # Delete html files written more than max_age seconds ago.
+    def expireHtmls(self, max_age: float) -> None:
+        with self.lock:
+            expired = [path for path, in
+                       self.db.execute('SELECT path FROM htmls WHERE '
+                                       'written_at < ?',
+                                       (time.time() - max_age,))]
+            for path in expired:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.db.executemany('DELETE FROM htmls WHERE path = ?',
+                                [(path,) for path in expired])
+
+    # Bring index up to date with files added or removed outside this tool.
+    # Returns without listing VIDEO_DIRECTORY if its modification time is the
+    # one of the last listing and was at least MTIME_TICK older than that
+    # listing; a change within the same tick may keep the time. Our own
+    # changes, e.g. downloads, change the time too, but not the listing.
+    def reconcile(self) -> None:
+        mtime = os.stat(self.directory).st_mtime_ns
+        listed = time.time_ns()
+        with self.lock:
+            meta = dict(self.db.execute("SELECT key, value FROM meta WHERE "
+                                        "key IN ('directory_mtime', "
+                                        "'directory_listed')"))
+        if meta.get('directory_mtime') == mtime and \
+           meta.get('directory_listed', 0) - mtime >= self.MTIME_TICK:
+            return
+        with os.scandir(self.directory) as entries:
+            entries = [entry for entry in entries
+                       if entry.name.endswith(('.mp4', '.html')) and
+                          entry.is_file()]
+        with self.lock:
+            known = { path for path, in
+                      self.db.execute('SELECT path FROM videos WHERE state '
+                                      'IN (?, ?) UNION ALL SELECT path FROM '
+                                      'htmls', (self.DONE, self.EXTERNAL)) }
+        if { entry.path for entry in entries } != known:
+            self.rescan(entries)
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                                [('directory_mtime', mtime),
+                                 ('directory_listed', listed)])
+
+    # Bring index up to date with the .mp4 and .html files in entries, the
+    # DirEntry objects of VIDEO_DIRECTORY.
+    def rescan(self, entries: list) -> None:
+        videos, htmls = {}, {}
+        for entry in entries:
+            if entry.name.endswith('.mp4'):
+                videos[entry.path] = entry.stat()
+            else:
+                htmls[entry.path] = entry.stat().st_mtime
+        with self.lock:
+            self.db.execute('BEGIN')
+            for path, state in self.db.execute('SELECT path, state FROM '
+                                               'videos').fetchall():
+                if path in videos:
+                    if state != self.DONE and state != self.EXTERNAL:
+                        self.db.execute('UPDATE videos SET state = ?, size = ? '
+                                        'WHERE path = ?', (self.DONE,
+                                        videos[path].st_size, path))
+                    del videos[path]
+                elif state == self.DONE or state == self.EXTERNAL:
+                    self.db.execute('DELETE FROM videos WHERE path = ?',
+                                    (path,))
+            # Files that do not fit VIDEO_FILENAME_FORMAT are filed under
+            # camera '' and their modification time, made unique, and so are
+            # files whose name has the camera and second of another video.
+            keys = set(self.db.execute('SELECT camera, created_at FROM '
+                                       'videos'))
+            last = None
+            for path, stat in sorted(videos.items(),
+                                     key=lambda item: item[1].st_mtime_ns):
+                camera, created_at = \
+                    parse_video_file_name(os.path.basename(path)) or \
+                    ('', stat.st_mtime_ns // 10**6)
+                if camera != '' and (camera, created_at) in keys:
+                    print(f"Video '{path}' is of the same camera and second "
+                          f"as another video; indexed by its modification "
+                          f"time.")
+                    camera, created_at = '', stat.st_mtime_ns // 10**6
+                if camera == '':
+                    if last is not None:
+                        created_at = max(created_at, last + 1)
+                    while ('', created_at) in keys:
+                        created_at += 1
+                    last = created_at
+                keys.add((camera, created_at))
+                self.db.execute('INSERT INTO videos (camera, created_at, '
+                                'path, size, state) VALUES (?, ?, ?, ?, ?)',
+                                (camera, created_at, path, stat.st_size,
+                                 self.EXTERNAL))
+            known = { path for path, in self.db.execute('SELECT path FROM '
+                                                        'htmls') }
+            for path in known - htmls.keys():
+                self.db.execute('DELETE FROM htmls WHERE path = ?', (path,))
+            self.db.executemany('INSERT INTO htmls VALUES (?, ?)',
+                                [(path, mtime) for path, mtime in htmls.items()
+                                 if path not in known])
+            self.db.execute('COMMIT')
+
+#
+# Deletes videos from the archive to keep it within limits on age, total size,
+# and size per camera. Videos are kept in one heap per camera, ordered by
+# creation time; the heaps are filled once from the index and extended as
+# downloads finish. An expiry pass pops only the videos it has to delete and
+# never walks VIDEO_DIRECTORY. Passes run every INTERVAL seconds in a thread,
+# and right away when a download exceeds a size limit.
+#
+class RetentionPolicy:
 
-    notification_supports_html = False
+    INTERVAL = 3600 # seconds between expiry passes
 
-# Write HTML to play and download given video, return url and file name.
-def write_video_html(video: pyaarlo.media.ArloVideo) -> str:
-    video_file_name = video._arlo.ml._downloader._output_name(video)
-    base_file_name  = os.path.split(video_file_name)[1][:-4]
+    def __init__(self, index: VideoIndex, max_age: float = None,
+                 max_bytes: int = None, camera_quota: int = None,
+                 on_expire=None):
+        self.index = index
+        self.max_age = max_age           # seconds
+        self.max_bytes = max_bytes       # for whole archive
+        self.camera_quota = camera_quota # bytes per camera
+        self.on_expire = on_expire       # called with stats() after deletions
+        self.cond = threading.Condition()
+        self.heaps = collections.defaultdict(list) # (created_at, path, size)
+        self.camera_bytes = collections.Counter()
+        self.total_bytes = 0
+        self.files = 0
+        self.reclaimed_bytes = 0
+        self.reclaimed_files = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_age or self.max_bytes or self.camera_quota)
+
+    # Load archived videos from the index; called once at startup.
+    def load(self) -> None:
+        with self.cond:
+            for camera, created_at, path, size in self.index.archived():
+                self.heaps[camera].append((created_at, path, size or 0))
+                self.camera_bytes[camera] += size or 0
+                self.total_bytes += size or 0
+                self.files += 1
+            for heap in self.heaps.values():
+                heapq.heapify(heap)
+            self.cond.notify()
+
+    # Add a downloaded video; called by download threads.
+    def add(self, path: str) -> None:
+        video = self.index.video(path)
+        if video is None:
+            return
+        camera, created_at, size = video
+        with self.cond:
+            heapq.heappush(self.heaps[camera], (created_at, path, size or 0))
+            self.camera_bytes[camera] += size or 0
+            self.total_bytes += size or 0
+            self.files += 1
+            if self.overLimit(camera):
+                self.cond.notify()
+
+    # Archive size and what expiry passes have deleted so far.
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                'files'          : self.files,
+                'bytes'          : self.total_bytes,
+                'reclaimed_files': self.reclaimed_files,
+                'reclaimed_bytes': self.reclaimed_bytes
+            }
+
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    # True if the archive or given camera is over a size limit.
+    def overLimit(self, camera: str) -> bool:
+        return (self.max_bytes is not None and
+                self.total_bytes > self.max_bytes) or \
+               (self.camera_quota is not None and
+                self.camera_bytes[camera] > self.camera_quota)
+
+    def run(self):
+        with self.cond:
+            while not self.closed:
+                if self.enabled:
+                    self.expire()
+                self.cond.wait(self.INTERVAL)
+
+    # Expiry pass; called with lock held. Returns bytes reclaimed.
+    def expire(self) -> int:
+        expired = []
+        if self.max_age is not None:
+            cutoff = 1000 * (time.time() - self.max_age)
+            for camera, heap in self.heaps.items():
+                while heap and heap[0][0] < cutoff:
+                    expired.append((camera, heapq.heappop(heap)))
+        if self.camera_quota is not None:
+            for camera, heap in self.heaps.items():
+                excess = self.camera_bytes[camera] - self.camera_quota - \
+                         sum(size for cam, (_, _, size) in expired
+                             if cam == camera)
+                while heap and excess > 0:
+                    video = heapq.heappop(heap)
+                    expired.append((camera, video))
+                    excess -= video[2]
+        if self.max_bytes is not None:
+            excess = self.total_bytes - self.max_bytes - \
+                     sum(size for _, (_, _, size) in expired)
+            while excess > 0:
+                oldest = min((heap[0][0], camera)
+                             for camera, heap in self.heaps.items() if heap) \
+                         if any(self.heaps.values()) else None
+                if oldest is None:
+                    break
+                video = heapq.heappop(self.heaps[oldest[1]])
+                expired.append((oldest[1], video))
+                excess -= video[2]
+        reclaimed = 0
+        for camera, (created_at, path, size) in expired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Cannot delete expired video '{path}': {e}.")
+                heapq.heappush(self.heaps[camera], (created_at, path, size))
+                continue
+            self.index.remove(path)
+            self.camera_bytes[camera] -= size
+            self.total_bytes -= size
+            self.files -= 1
+            reclaimed += size
+            self.reclaimed_files += 1
+        self.reclaimed_bytes += reclaimed
+        if expired and self.on_expire is not None:
+            self.on_expire(self.stats())
+        return reclaimed
+
+# The archive index shared by all parts of this process.
+_video_index = None
+
+def video_index() -> VideoIndex:
+    global _video_index
+    if _video_index is None:
+        _video_index = VideoIndex()
+    return _video_index
+
+# Return camera name and created_at in msecs for a file name produced by
+# video_file_name or None if the name does not fit VIDEO_FILENAME_FORMAT.
+def parse_video_file_name(file_name: str) -> tuple:
+    fields = { 'Y': r'\d{4}', 'm': r'\d{2}', 'd': r'\d{2}', 'H': r'\d{2}',
+               'M': r'\d{2}', 'S': r'\d{2}', 'F': r'\d{4}-\d{2}-\d{2}',
+               'T': r'\d{2}:\d{2}:\d{2}', 't': r'\d{2}-\d{2}-\d{2}',
+               's': r'\d+', 'N': r'.+', 'NN': r'.+', 'SN': r'.+' }
+    pattern = ''
+    for literal, name, _, _ in string.Formatter().parse(
+            re.sub(r'\$\{(\w+)\}', r'{\1}', VIDEO_FILENAME_FORMAT)):
+        pattern += re.escape(literal)
+        if name:
+            pattern += f'(?P<{name}>{fields[name]})' \
+                       if f'(?P<{name}>' not in pattern else fields[name]
+    match = re.fullmatch(pattern + r'\.mp4', file_name)
+    if match is None:
+        return None
+    values = match.groupdict()
+    if 's' in values:
+        return values.get('N') or values.get('NN') or values.get('SN'), \
+               1000 * int(values['s'])
+    date = values.get('F') or f"{values.get('Y')}-{values.get('m')}-" \
+                              f"{values.get('d')}"
+    clock = values.get('T') or (values.get('t') or '').replace('-', ':') or \
+            f"{values.get('H')}:{values.get('M')}:{values.get('S')}"
+    try:
+        when = datetime.datetime.strptime(f'{date} {clock}',
+                                          '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+    return values.get('N') or values.get('NN') or values.get('SN'), \
+           int(1000 * when.timestamp())
+
+# Write HTML to play and download given video next to its place in the
+# archive of index, return url and file name.
+def write_video_html(video: 'pyaarlo.media.ArloVideo', index: VideoIndex,
+                     camera_name: str = None) -> str:
+    file_path = video_file_name(video, index.directory, camera_name)
+    base_file_name  = os.path.split(file_path)[1][:-4]
     video_url  = video.video_url
-    html_path = video_file_name[:-4] + '.html'
-    if notification_supports_html:
+    html_path = file_path[:-4] + '.html'
+    if notifications().supports_html:
         with open(html_path, 'wt') as f:
             print(f'''<html>
 <title>{base_file_name}</title>
@@ -127,25 +1038,540 @@ def write_video_html(video: pyaarlo.media.ArloVideo) -> str:
 Download video <a href="{video_url}" download="{base_file_name}.mp4">
 {base_file_name}</a>.
 </html>''', file=f)
+        index.addHtml(html_path)
         file_url = urljoin('file:', pathname2url(html_path))
     else:
         file_url = None
     return file_url, base_file_name
 
-# Delete all expired .html files in VIDEO_DIRECTORY.
-def expire_video_htmls() -> None:
-    if not notification_supports_html:
+# Delete all expired .html files in the archive of index.
+def expire_video_htmls(index: VideoIndex) -> None:
+    if not notifications().supports_html:
         return
-    now = datetime.datetime.now().timestamp()
-    for filename in os.listdir(VIDEO_DIRECTORY):
-        if not filename.endswith('.html'):
-            continue
-        full_path = os.path.join(VIDEO_DIRECTORY, filename)
-        if now - os.path.getmtime(full_path) > HTML_EXPIRATION:
+    index.expireHtmls(HTML_EXPIRATION)
+
+# Replace file at path with data atomically, so that an interrupted write
+# keeps the old file.
+def replace_file(path: str, data: bytes) -> None:
+    with open(path + '.tmp', 'wb') as file:
+        file.write(data)
+    os.replace(path + '.tmp', path)
+
+# SHA-1 digest of the content of the file at path as a hex string.
+def file_digest(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Frames of the video at path at the given fractions of its length; seeking
+# lands on the frames cheaply, it decodes from the nearest keyframe.
+def seek_frames(cap, fractions: list) -> list:
+    count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    frames = []
+    for fraction in fractions if count > 0 else [0]:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(fraction * (count - 1)))
+        retval, frame = cap.read()
+        if retval:
+            frames.append(frame)
+    return frames
+
+# Starts an indexer process; it runs one video at a time on one core, behind
+# the GUI and live streams.
+def init_indexer_process() -> None:
+    opencv().setNumThreads(1)
+    if hasattr(os, 'nice'):
+        os.nice(10)
+
+# Runs in an indexer process; writes a thumbnail and a contact strip of
+# strip_frames evenly spaced frames of the video at path to directory, named
+# by the SHA-1 digest of the video, so videos indexed before, e.g. under
+# another name, are not decoded again. Returns the digest, None if the video
+# cannot be decoded.
+def index_video(path: str, directory: str, thumbnail_width: int,
+                strip_frames: int, strip_height: int) -> str:
+    digest = file_digest(path)
+    thumbnail_path = os.path.join(directory, digest + '.jpg')
+    strip_path = os.path.join(directory, digest + '-strip.jpg')
+    if os.path.exists(thumbnail_path) and os.path.exists(strip_path):
+        return digest
+    cap = cv2.VideoCapture(path)
+    frames = seek_frames(cap, [(i + 0.5) / strip_frames
+                               for i in range(strip_frames)])
+    cap.release()
+    if not frames:
+        return None
+    scale = lambda frame, width, height: cv2.resize(frame, (width, height),
+                                             interpolation=cv2.INTER_AREA)
+    frame = frames[len(frames) // 2]
+    thumbnail = scale(frame, thumbnail_width,
+                      frame.shape[0] * thumbnail_width // frame.shape[1])
+    strip = numpy.hstack([scale(frame, frame.shape[1] * strip_height //
+                                       frame.shape[0], strip_height)
+                          for frame in frames])
+    os.makedirs(directory, exist_ok=True)
+    replace_file(strip_path, cv2.imencode('.jpg', strip)[1].tobytes())
+    replace_file(thumbnail_path, cv2.imencode('.jpg', thumbnail)[1].tobytes())
+    return digest
+
+# Runs in an indexer process; frames of the video at path every step seconds,
+# scaled to size, as JPEG data.
+def timelapse_frames(path: str, step: float, size: tuple) -> list:
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or Camera.DEFAULT_STREAM_FPS
+    count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    steps = max(1, int(count / fps / step)) if count > 0 else 1
+    frames = seek_frames(cap, [i / steps for i in range(steps)])
+    cap.release()
+    return [cv2.imencode('.jpg', cv2.resize(frame, size,
+                                            interpolation=cv2.INTER_AREA))[1]
+            for frame in frames]
+
+#
+# Indexes the video archive in a pool of processes, so throughput grows with
+# the number of cores: extracts a thumbnail and a contact strip of every
+# archived video into THUMBNAIL_DIRECTORY, named by the SHA-1 digest of the
+# video. The video index records which videos have been indexed; only new
+# videos are processed, so indexing again is almost free. Timelapses of the
+# videos of a camera on a day are made on demand and cached by the digests of
+# their videos.
+#
+class ArchiveIndexer:
+
+    # Indexer processes; half the cores. ArloCore indexes nothing with 0; an
+    # indexer made anyway, e.g. for a timelapse, starts one process.
+    WORKERS         = max(1, (os.cpu_count() or 2) // 2)
+    THUMBNAIL_WIDTH =  320 # pixels
+    STRIP_FRAMES    =    8 # frames per contact strip
+    STRIP_HEIGHT    =   90 # pixels
+    TIMELAPSE_STEP  =  2.0 # seconds of video per timelapse frame
+    TIMELAPSE_FPS   =   15 # frames per second of timelapse
+    TIMELAPSE_WIDTH =  640 # pixels
+
+    def __init__(self, index: VideoIndex, directory: str = THUMBNAIL_DIRECTORY,
+                 workers: int = None):
+        self.index = index
+        self.directory = directory
+        self.workers = max(1, self.WORKERS if workers is None else workers)
+        self.pool = None # created on first use
+        self.cond = threading.Condition()
+        self.futures = {} # path -> future, while queued or being indexed
+        self.indexed = 0
+        self.failed = 0
+        self.started = None # time.monotonic() when the queue was last empty
+        self.created = time.time()
+        self.closed = False
+        metrics().addCollector(self.collectMetrics)
+
+    # Queue video at path with given size unless queued already; called by
+    # download threads for new videos. Returns the future of its digest.
+    def add(self, path: str, size: int) -> concurrent.futures.Future:
+        with self.cond:
+            future = self.futures.get(path)
+            if future is not None or self.closed:
+                return future
+            if not self.futures:
+                self.started = time.monotonic()
+            future = self.processPool().submit(index_video, path,
+                         self.directory, self.THUMBNAIL_WIDTH,
+                         self.STRIP_FRAMES, self.STRIP_HEIGHT)
+            self.futures[path] = future
+        future.add_done_callback(lambda future: self.done(path, size, future))
+        return future
+
+    # Pool of indexer processes, started on first use; called with lock held.
+    # Workers are spawned, not forked, as this process has threads.
+    def processPool(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                            self.workers, multiprocessing.get_context('spawn'),
+                            init_indexer_process)
+        return self.pool
+
+    # Record result of an indexed video; called by the pool's thread. Videos
+    # that cannot be decoded are recorded too, so they are not tried again;
+    # videos that failed otherwise are tried again at the next update.
+    def done(self, path, size, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self.index.addThumbnails(path, size, future.result())
+        else: # file removed or pool broken
+            print(f"Cannot index video '{path}': {error}.")
+        with self.cond:
+            del self.futures[path]
+            if error is None and future.result() is not None:
+                self.indexed += 1
+            else:
+                self.failed += 1
+            if isinstance(error, concurrent.futures.BrokenExecutor):
+                self.pool = None # started again on next use
+            if not self.futures:
+                print(f"Indexed videos: {self.indexed} done, {self.failed} "
+                      "failed, last batch in "
+                      f"{time.monotonic() - self.started:.1f} seconds.")
+            self.cond.notify_all()
+
+    # Delete thumbnails of videos no longer archived, then queue all archived
+    # videos not indexed yet; runs in a thread at startup. Returns the number
+    # of videos queued.
+    def update(self) -> int:
+        digests = self.index.pruneThumbnails()
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    # Thumbnails written since startup may not be recorded
+                    # yet.
+                    if entry.name.endswith('.jpg') and \
+                       entry.name[:40] not in digests and \
+                       entry.stat().st_mtime < self.created:
+                        os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+        videos = self.index.unindexed()
+        for path, size in videos:
+            self.add(path, size)
+        return len(videos)
+
+    # Wait until all queued videos have been indexed.
+    def wait(self, timeout: float = None) -> bool:
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.futures, timeout)
+
+    # Thumbnail and contact strip of archived video at path, None for either
+    # if not indexed yet.
+    def thumbnails(self, path: str, digest: str) -> tuple:
+        return tuple(path if os.path.exists(path) else None for path in
+                     [os.path.join(self.directory, digest + '.jpg'),
+                      os.path.join(self.directory, digest + '-strip.jpg')])
+
+    # Make timelapse of the archived videos of camera on day and an html page
+    # with it and the contact strip of each video; videos not indexed yet are
+    # indexed first. Returns the paths of the timelapse and the page, None if
+    # the camera has no videos that day.
+    def timelapse(self, camera: str, day: datetime.date) -> tuple:
+        start = datetime.datetime.combine(day, datetime.time())
+        videos = self.index.cameraVideos(camera,
+                     int(1000 * start.timestamp()),
+                     int(1000 * (start + datetime.timedelta(days=1))
+                                .timestamp()))
+        futures = [self.add(path, size) if digest is None else None
+                   for created_at, path, size, digest in videos]
+        indexed = []
+        for (created_at, path, size, digest), future in zip(videos, futures):
+            if future is not None:
+                try:
+                    digest = future.result()
+                except Exception: # reported by done; leave the video out
+                    digest = None
+            if digest is not None:
+                indexed.append((created_at, path, digest))
+        videos = indexed
+        if not videos:
+            return None
+        key = hashlib.sha1(repr((self.TIMELAPSE_STEP, self.TIMELAPSE_FPS,
+                                 self.TIMELAPSE_WIDTH,
+                                 [digest for _, _, digest in videos]))
+                           .encode()).hexdigest()
+        path = os.path.join(self.directory, f'timelapse-{key}.mp4')
+        if not os.path.exists(path):
+            self.writeTimelapse(path, [path for _, path, _ in videos])
+        page_path = os.path.join(self.directory,
+                                 re.sub(r'[^\w-]+', '_', camera) +
+                                 f' {day.isoformat()}.html')
+        self.writePage(page_path, camera, day, path, videos)
+        return path, page_path
+
+    # Write timelapse of the videos at paths; their frames are extracted in
+    # the pool.
+    def writeTimelapse(self, path: str, paths: list) -> None:
+        opencv()
+        cap = cv2.VideoCapture(paths[0])
+        width = cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 16
+        height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 9
+        cap.release()
+        size = (self.TIMELAPSE_WIDTH,
+                int(self.TIMELAPSE_WIDTH * height / width) // 2 * 2)
+        with self.cond:
+            pool = self.processPool()
+        part_path = path[:-4] + '.part.mp4'
+        writer = cv2.VideoWriter(part_path,
+                                 cv2.VideoWriter_fourcc(*StreamRecorder.FOURCC),
+                                 self.TIMELAPSE_FPS, size)
+        for frames in pool.map(timelapse_frames, paths,
+                                    [self.TIMELAPSE_STEP] * len(paths),
+                                    [size] * len(paths)):
+            for data in frames:
+                writer.write(cv2.imdecode(data, cv2.IMREAD_COLOR))
+        writer.release()
+        os.replace(part_path, path)
+
+    # Write html page with timelapse and the contact strip of each video,
+    # which links to the video.
+    def writePage(self, page_path: str, camera: str, day: datetime.date,
+                  timelapse_path: str, videos: list) -> None:
+        url = lambda path: urljoin('file:', pathname2url(path))
+        rows = []
+        for created_at, path, digest in videos:
+            when = datetime.datetime.fromtimestamp(created_at / 1000)
+            strip_path = os.path.join(self.directory, digest + '-strip.jpg')
+            rows.append(f'''<p>{when.strftime('%H:%M:%S')}<br>
+<a href="{url(path)}"><img src="{url(strip_path)}"></a></p>
+''')
+        title = f'{camera} {day.isoformat()}'
+        replace_file(page_path, f'''<html>
+<title>{title}</title>
+<h2>{title}: {len(videos)} videos</h2>
+<video controls width="{self.TIMELAPSE_WIDTH}">
+<source src="{url(timelapse_path)}" type="video/mp4">
+</video>
+{''.join(rows)}</html>
+'''.encode())
+
+    # Indexer metrics.
+    def collectMetrics(self):
+        with self.cond:
+            return [('arlo_index_queue_depth', {}, len(self.futures)),
+                    ('arlo_videos_indexed_total', {'result': 'done'},
+                     self.indexed),
+                    ('arlo_videos_indexed_total', {'result': 'failed'},
+                     self.failed)]
+
+    # Stop indexing; videos not indexed yet are indexed next time.
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            for future in self.futures.values():
+                future.cancel()
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+#
+# Token bucket shared by download threads to cap their combined bandwidth.
+#
+class BandwidthLimiter:
+
+    def __init__(self, rate: float = None):
+        self.rate = rate # bytes per second, None for unlimited
+        self.lock = threading.Lock()
+        self.tokens = rate or 0
+        self.last = time.monotonic()
+
+    # Account for n bytes; sleeps while the bandwidth limit is exceeded.
+    def consume(self, n: int) -> None:
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate,
+                              self.tokens + (now - self.last) * self.rate) - n
+            self.last = now
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+#
+# Downloads videos with a bounded pool of worker threads. A download is
+# written to a '.part' file that is renamed when complete, so VIDEO_DIRECTORY
+# never contains partial videos. Interrupted downloads are resumed with HTTP
+# range requests.
+#
+class DownloadEngine:
+
+    WORKERS           =         4 # parallel downloads
+    CHUNK_SIZE        = 64 * 1024 # bytes read at a time
+    TIMEOUT           =        30 # seconds to wait for the server
+    RETRIES           =         3 # attempts per download
+    RETRY_DELAY       =         5 # seconds between attempts
+    PROGRESS_INTERVAL =       1.0 # seconds between progress callbacks
+    RATE_SMOOTHING    =       0.3 # weight of newest second in throughput
+
+    def __init__(self, workers: int = WORKERS, max_rate: float = None,
+                 on_progress=None, index: VideoIndex = None,
+                 on_downloaded=None):
+        self.index = index # records downloads if given
+        self.on_downloaded = on_downloaded # called with path of new videos
+        self.limiter = BandwidthLimiter(max_rate)
+        self.on_progress = on_progress # called with stats() once per second
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = set() # paths queued or being downloaded
+        self.active = 0
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.rate = 0.0
+        self.rate_bytes = 0
+        self.rate_time = time.monotonic()
+        self.threads = [threading.Thread(target=self.worker, daemon=True)
+                        for _ in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+        metrics().addCollector(self.collectMetrics)
+
+    # Queue download of url to path unless path exists or is queued already.
+    # Returns True if the download has been queued.
+    def queue(self, url: str, path: str) -> bool:
+        with self.lock:
+            if path in self.pending:
+                return False
+            if self.index.isArchived(path) if self.index is not None \
+               else os.path.exists(path):
+                return False
+            self.pending.add(path)
+        self.jobs.put((url, path))
+        return True
+
+    # Queue download of an ArloVideo to its place in the archive of the index,
+    # VIDEO_DIRECTORY without one. The video is filed under camera_name if
+    # given, so that same-named cameras of several sites are kept apart.
+    def queueVideo(self, video: 'pyaarlo.media.ArloVideo',
+                   camera_name: str = None) -> bool:
+        camera_name = camera_name or video.camera.name
+        path = video_file_name(video, self.index.directory
+                                      if self.index is not None
+                                      else VIDEO_DIRECTORY, camera_name)
+        if self.index is not None:
+            state = self.index.add(camera_name, video.created_at, path,
+                                   video.media_duration_seconds)
+            if state == VideoIndex.DONE or state == VideoIndex.EXTERNAL:
+                return False
+        return self.queue(video.video_url, path)
+
+    # Number of active, queued, finished, and failed downloads, bytes
+    # downloaded and current throughput in bytes per second.
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'active': self.active,
+                'queued': len(self.pending) - self.active,
+                'done'  : self.done,
+                'failed': self.failed,
+                'bytes' : self.bytes,
+                'rate'  : self.rate
+            }
+
+    def collectMetrics(self) -> list:
+        stats = self.stats()
+        return [('arlo_download_bytes_total', {}, stats['bytes']),
+                ('arlo_download_rate_bytes', {}, stats['rate']),
+                ('arlo_downloads_active', {}, stats['active']),
+                ('arlo_downloads_queued', {}, stats['queued']),
+                ('arlo_downloads_total', {'result': 'done'}, stats['done']),
+                ('arlo_downloads_total', {'result': 'failed'},
+                 stats['failed'])]
+
+    # Stop worker threads; running downloads are resumed on the next start.
+    def close(self) -> None:
+        for _ in self.threads:
+            self.jobs.put(None)
+
+    def worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            url, path = job
+            with self.lock:
+                self.active += 1
+            success = False
             try:
-                os.remove(full_path)
-            except:
-                pass
+                for attempt in range(self.RETRIES):
+                    try:
+                        self.download(url, path)
+                        success = True
+                        break
+                    except Exception as e:
+                        error = e
+                        # Retry network errors only, but not an expired url
+                        # or a missing video.
+                        if not isinstance(e, (OSError,
+                                              http.client.HTTPException)) or \
+                           isinstance(e, urllib.error.HTTPError) and \
+                           e.code in (403, 404):
+                            break
+                        time.sleep(self.RETRY_DELAY)
+                if not success:
+                    print(f"Download of '{path}' failed: {error}.")
+                if self.index is not None:
+                    if success:
+                        self.index.setState(path, VideoIndex.DONE,
+                                            os.path.getsize(path))
+                    else:
+                        self.index.setState(path, VideoIndex.FAILED)
+                if success and self.on_downloaded is not None:
+                    self.on_downloaded(path)
+            except Exception as e: # keep the worker running
+                print(f"Cannot archive '{path}': {e}.")
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    self.pending.discard(path)
+                    if success:
+                        self.done += 1
+                    else:
+                        self.failed += 1
+                self.progress(0)
+
+    # Download url to path; resumes a previous partial download.
+    def download(self, url: str, path: str) -> None:
+        part_path = path + '.part'
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request = urllib.request.Request(url)
+        if offset:
+            request.add_header('Range', f'bytes={offset}-')
+        try:
+            response = urllib.request.urlopen(request, timeout=self.TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset: # range not satisfiable
+                # The part is done if it has the length of the video, else
+                # it is stale, e.g. of an earlier video; start over.
+                total = re.fullmatch(r'bytes \*/(\d+)',
+                                     e.headers.get('Content-Range', '')
+                                     if e.headers is not None else '')
+                if total is not None and int(total[1]) == offset:
+                    os.replace(part_path, path)
+                    return
+                os.remove(part_path)
+                self.download(url, path)
+                return
+            raise
+        with response:
+            if offset and response.status != 206: # server ignored range
+                offset = 0
+            length = response.headers.get('Content-Length')
+            expected = offset + int(length) if length is not None else None
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                while True:
+                    chunk = response.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.limiter.consume(len(chunk))
+                    f.write(chunk)
+                    offset += len(chunk)
+                    self.progress(len(chunk))
+        if expected is not None and offset != expected:
+            raise http.client.IncompleteRead(b'', expected - offset)
+        os.replace(part_path, path)
+
+    # Account for n downloaded bytes; reports progress once per second.
+    def progress(self, n: int) -> None:
+        with self.lock:
+            self.bytes += n
+            self.rate_bytes += n
+            now = time.monotonic()
+            elapsed = now - self.rate_time
+            if elapsed < self.PROGRESS_INTERVAL:
+                return
+            self.rate += self.RATE_SMOOTHING * \
+                         (self.rate_bytes / elapsed - self.rate)
+            self.rate_bytes = 0
+            self.rate_time = now
+        if self.on_progress is not None:
+            self.on_progress(self.stats())
 
 #
 # GUI Dialog for Arlo Credentials.
@@ -213,318 +1639,3093 @@ class ArloCredentials:
         return None
 
 #
-# An instance of class Camera represents an Arlo camera.
+# Runs functions on the Tk main thread on behalf of other threads. Tk must only
+# be called from the main thread; other threads queue calls here and a helper
+# thread wakes up the Tk event loop with a virtual event. The helper thread,
+# not the caller, waits for Tk to accept the event, so posting never blocks.
 #
-class Camera:
+class TkDispatcher:
 
-    VIDEO_UPDATE_INTERVAL   =     25  # try updating video frame every 25 msecs
-    BATTERY_UPDATE_INTERVAL = 900000  # update battery level every 15 minutes
-    VIDEO_STREAM_FORMAT     =  'arlo' # request rtsps stream
-    LOW_BATTERY_THRESHOLD   =     15  # warn when battery level drops below this
-    MEDIA_UPDATE_INTERVAL   =  90000  # check every 90 seconds for motion video
+    WAKEUP_EVENT = '<<ArloWakeup>>'
+    RETRY_DELAY  = 0.1 # seconds to wait when the Tk main loop is not running
 
-    def __init__(self, camera, frame, image_size):
-        self.camera = camera
-        self.frame = frame
-        self.image_size = image_size
-        self.name = camera.name
-        self.model = camera.model_id
-        self.frame.configure(text=self.name, labelanchor='n')
-        # self.label has camera image.
-        self.label = tkinter.Label(self.frame)
-        self.label.grid(column=0, row=0, sticky=tkinter.W)
-        # self.status_line is shown below camera image.
-        self.low_battery_warned = False
-        self.addl_status_text = ''
-        self.status_line = tkinter.Label(self.frame)
-        self.status_line.grid(column=0, row=1, sticky=tkinter.W)
-        self.snapshot_requested = False
-        # Load camera image.
-        self.lastImageData(self.camera, LAST_IMAGE_DATA_KEY,
-                           self.camera.last_image_from_cache)
-        self.updateBatteryLevel()
-        # Members for live video stream.
-        self.live_stream = 'off' # values: 'on', 'off', 'init', 'error'
-        self.thread = None
-        self.video_frame_queue = queue.SimpleQueue()
-        # Motion detection.
-        self.motion_notices = []
-        self.find_motion_scheduled = False
-        camera.add_attr_callback(MOTION_DETECTED_KEY, self.motionDetected)
-        # Snapshot callback.
-        camera.add_attr_callback(LAST_IMAGE_DATA_KEY, self.lastImageData)
-        # Left and right mouse buttons callback.
-        self.label.bind("<Button-1>", self.buttonPressed)
-        self.label.bind("<Button-3>", self.buttonPressed)
+    def __init__(self, window):
+        self.window = window
+        self.calls = collections.deque()
+        self.cond = threading.Condition()
+        self.wakeup_pending = False
+        self.closed = False
+        window.bind(self.WAKEUP_EVENT, self.runCalls)
+        self.thread = threading.Thread(target=self.wakeupThread, daemon=True)
+        self.thread.start()
+        metrics().addCollector(lambda: [('arlo_tk_queue_depth', {},
+                                         len(self.calls))])
 
-    # Update battery level; called every 15 minutes.
-    def updateBatteryLevel(self):
-        self.battery_level = self.camera.battery_level
-        self.updateStatus(self.addl_status_text)
-        if self.battery_level < self.LOW_BATTERY_THRESHOLD and \
-           not self.low_battery_warned:
-            notify("Arlo camera battery is low.", f"Camera {self.name} "
-                   f"has only {self.battery_level}% battery left.")
-            self.low_battery_warned = True
-        self.status_line.after(self.BATTERY_UPDATE_INTERVAL,
-                               self.updateBatteryLevel)
+    # Queue a call of function(*args) on the Tk thread; safe from any thread.
+    def post(self, function, *args) -> None:
+        with self.cond:
+            self.calls.append((function, args))
+            self.cond.notify()
 
-    # Update status line.
-    def updateStatus(self, addl = ''):
-        self.addl_status_text = addl
-        status_text = f"Camera model {self.model}, battery level "\
-                      f"{self.battery_level}%{addl}"
-        self.status_line.configure(text=status_text)
+    # Helper thread; sends one wakeup event at a time while calls are queued.
+    def wakeupThread(self):
+        while True:
+            with self.cond:
+                while not self.closed and \
+                      (not self.calls or self.wakeup_pending):
+                    self.cond.wait()
+                if self.closed:
+                    return
+                self.wakeup_pending = True
+            try:
+                self.window.event_generate(self.WAKEUP_EVENT, when='tail')
+            except (RuntimeError, tkinter.TclError):
+                with self.cond:
+                    self.wakeup_pending = False
+                time.sleep(self.RETRY_DELAY)
 
-    # Turn live stream off so streamThread shuts down.
-    def shutdown(self):
-        if self.live_stream != 'off':
-            self.stopStream()
+    # Runs on the Tk thread when the wakeup event arrives. Times the calls
+    # while metrics are enabled.
+    def runCalls(self, event=None):
+        with self.cond:
+            calls = list(self.calls)
+            self.calls.clear()
+            self.wakeup_pending = False
+            self.cond.notify()
+        if not metrics().enabled:
+            for function, args in calls:
+                function(*args)
+            return
+        for function, args in calls:
+            started = time.perf_counter()
+            function(*args)
+            metrics().observe('arlo_tk_callback_seconds',
+                              time.perf_counter() - started,
+                              function=getattr(function, '__qualname__',
+                                               type(function).__name__))
 
-    # Resize image to fit within self.image_size; maintain aspect ratio.
-    def resize(self, image):
-        factor = min(self.image_size[0] / image.width,
-                     self.image_size[1] / image.height)
-        return image.resize((int(image.width * factor),
-                             int(image.height * factor)))
+    # Stop helper thread; called after the Tk main loop has exited.
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
 
-    # Update still image; called on LAST_IMAGE_DATA_KEY event.
-    def lastImageData(self, device, attr, value):
-        with io.BytesIO(value) as file:
-            image = Image.open(file)
-            image.load()
-        self.image = ImageTk.PhotoImage(image=self.resize(image))
-        self.label.configure(image=self.image)
-        if self.snapshot_requested:
-            self.snapshot_requested = False
-            self.updateStatus()
+#
+# Bounded buffer for the most recent video frames of a live stream. The decode
+# thread puts frames, the GUI takes the newest one. Frames that are replaced
+# before they are displayed are counted as dropped. Frame arrays are recycled
+# so that steady-state streaming does not allocate.
+#
+class FrameBuffer:
 
-    # Called on motionDetected event. Sends notification to session.
-    def motionDetected(self, device, attr, value):
-        if value:
-            now = datetime.datetime.now()
-            time_string = now.strftime('%m-%d %H:%M:%S')
-            notification = notify("Motion detected.", "Motion detected on "
-                                  f"{time_string} at {self.name}.")
-            self.motion_notices.append((now, notification))
-            if not self.find_motion_scheduled:
-                self.find_motion_scheduled = True
-                self.frame.after(self.MEDIA_UPDATE_INTERVAL,
-                                 self.findMotionVideos)
-
-    # This function is called after a motion was detected. It waits for the
-    # video that shows that motion and extends the notification with a link to
-    # this video.
-    def findMotionVideos(self):
-        self.camera._arlo.ml.update()
-        self.camera.update_media(wait=True)
-        videos = self.camera.last_n_videos(25)
-        now = datetime.datetime.now().timestamp()
-        for video in videos:
-            video_time = video.created_at / 1000
-            best_idx = -1
-            best_notification = None
-            best_diff = 3600
-            for idx, (time, notification) in enumerate(self.motion_notices):
-                diff = abs(time.timestamp() - video_time)
-                if diff < 10.0 and diff < best_diff:
-                    best_diff = diff
-                    best_notification = notification
-                    best_idx = idx
-            if best_idx >= 0:
-                file_url, file_name = write_video_html(video)
-                if notification_supports_html:
-                    notification.notification_body += \
-                        f'<br><a href="{file_url}">Play</a> or <a href='\
-                        f'"{video.video_url}" download="{file_name}.mp4">'\
-                          'download</a> video.'
-                else:
-                    notification.notification_body += '\r\nVideo '\
-                        f"'{file_name}' is available for this motion event."
-                update_notification(best_notification)
-            self.motion_notices = [(time, notification)
-                                   for idx, (time, notification) in
-                                       enumerate(self.motion_notices)
-                                   if idx != best_idx and
-                                       now - time.timestamp() < 3600]
-            if not self.motion_notices:
-                break
-        if self.motion_notices: # update videos and try again
-            self.frame.after(self.MEDIA_UPDATE_INTERVAL, self.findMotionVideos)
-        else:
-            self.find_motion_scheduled = False
+    FPS_SMOOTHING = 0.1 # weight of newest frame interval in frame rate average
 
-    # This function is called when the left or right mouse button is pressed in
-    # an image. The left mouse button updates the image with a snapshot; the
-    # right one starts a video stream. Either button stops a video stream.
-    def buttonPressed(self, e):
-        if self.live_stream != 'off': # either mouse button stops video stream
-            self.stopStream()
-            self.updateStatus()
-        elif e.num == 1: # left mouse button takes snapshot
-            self.snapshot_requested = True
-            self.updateStatus("   snapshot requested")
-            self.camera.request_snapshot()
-        elif e.num == 3: # right mouse button starts video stream
-            if self.live_stream == 'off':
-                url = self.camera.start_stream(self.VIDEO_STREAM_FORMAT)
-                if isinstance(url, str) and url.startswith('rtsps://'):
-                    self.live_stream = 'init'
-                    self.thread = threading.Thread(target=self.streamThread,
-                                                   args=[url])
-                    self.thread.start()
-                    self.label.after(self.VIDEO_UPDATE_INTERVAL,
-                                     self.updateVideoFrame)
-                    self.updateStatus("   waiting for video stream")
+    def __init__(self, slots: int = 1):
+        self.slots = max(1, slots)
+        self.lock = threading.Lock()
+        self.frames = collections.deque() # (capture time, frame) pairs
+        self.free = []                    # recycled frame arrays
+        self.reset()
 
-    # Helper function for video streaming. Runs in a thread that receives
-    # the video stream and appends video frames to the frame queue.
-    def streamThread(self, url):
-        cap = cv2.VideoCapture(url)
-        while cap.isOpened():
-            retval, video_frame = cap.read()
-            if not retval or self.live_stream == 'off':
-                break
-            video_frame = video_frame[:,:,::-1] # color mode BGR -> RGB
-            image = self.resize(Image.fromarray(video_frame))
-            self.video_frame_queue.put(image)
-        if self.live_stream != 'off':
-            self.live_stream = 'error'
-        cap.release()
+    # Clear frames and statistics; called when a stream starts.
+    def reset(self) -> None:
+        with self.lock:
+            self.free.extend(frame for _, frame in self.frames)
+            self.frames.clear()
+            self.frames_in = 0
+            self.frames_dropped = 0
+            self.high_water = 0
+            self.last_put = None
+            self.frame_interval = None
 
-    # Stop video stream and wait for thread to exit.
-    def stopStream(self):
-        assert self.live_stream != 'off'
-        self.live_stream = 'off'
-        self.camera.stop_stream()
-        self.thread.join()
-        self.thread = None
+    # Return a recycled array of given shape; allocate one if none is free.
+    def acquire(self, shape: tuple) -> numpy.ndarray:
+        with self.lock:
+            while self.free:
+                frame = self.free.pop()
+                if frame.shape == shape:
+                    return frame
+        return numpy.empty(shape, dtype=numpy.uint8)
 
-    # Helper function for video streaming. This function is called every
-    # VIDEO_UPDATE_INTERVAL msecs; it checks the frame queue for frames
-    # and displays the most recent one.
-    def updateVideoFrame(self):
-        if not self.video_frame_queue.empty():
-            if self.live_stream == 'init':
-                self.updateStatus("   video stream")
-                self.live_stream = 'on'
-            while not self.video_frame_queue.empty():
-                video_frame = self.video_frame_queue.get()
-            self.image = ImageTk.PhotoImage(image=video_frame)
-            self.label.configure(image=self.image)
-        if self.live_stream == 'error':
-            self.stopStream()
-            self.updateStatus()
-        elif self.live_stream != 'off':
-            self.label.after(self.VIDEO_UPDATE_INTERVAL, self.updateVideoFrame)
+    # Return an array obtained from acquire or get_latest for reuse.
+    def release(self, frame: numpy.ndarray) -> None:
+        with self.lock:
+            if len(self.free) < self.slots + 2:
+                self.free.append(frame)
+
+    # Add a frame captured at given time.monotonic() timestamp; the oldest frame
+    # is dropped when all slots are in use.
+    def put(self, frame: numpy.ndarray, captured: float = None) -> None:
+        now = time.monotonic()
+        if captured is None:
+            captured = now
+        with self.lock:
+            if self.last_put is not None:
+                interval = now - self.last_put
+                if self.frame_interval is None:
+                    self.frame_interval = interval
+                else:
+                    self.frame_interval += self.FPS_SMOOTHING * \
+                                           (interval - self.frame_interval)
+            self.last_put = now
+            self.frames_in += 1
+            self.frames.append((captured, frame))
+            if len(self.frames) > self.slots:
+                self.free.append(self.frames.popleft()[1])
+                self.frames_dropped += 1
+            self.high_water = max(self.high_water, len(self.frames))
+
+    # Return (capture time, frame) of the newest frame or None; older frames
+    # are dropped. The caller passes the frame to release when done with it.
+    def get_latest(self) -> tuple:
+        with self.lock:
+            if not self.frames:
+                return None
+            latest = self.frames.pop()
+            self.frames_dropped += len(self.frames)
+            self.free.extend(frame for _, frame in self.frames)
+            self.frames.clear()
+            return latest
+
+    # Frame rate, drop rate, queue depth, and queue high-water mark of current
+    # stream.
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'fps'       : 1.0 / self.frame_interval
+                              if self.frame_interval else 0.0,
+                'frames'    : self.frames_in,
+                'dropped'   : self.frames_dropped,
+                'drop_rate' : self.frames_dropped / self.frames_in
+                              if self.frames_in else 0.0,
+                'queued'    : len(self.frames),
+                'high_water': self.high_water
+            }
 
 #
-# Main GUI class.
+# Compute rows, columns, and image size for a grid of camera images on the
+# screen of given window. Image sizes are upper limits; images keep their
+# aspect ratios.
 #
-class ArloWindow:
+def grid_layout(window, count: int) -> tuple:
+    no_columns = max(1, int(math.ceil(math.sqrt(count))))
+    no_rows    = max(1, int(math.ceil(count / no_columns)))
+    width  = int(0.85 * window.winfo_screenwidth() / no_columns)
+    height = int(0.85 * window.winfo_screenheight() / no_rows)
+    return no_columns, no_rows, (width, height)
 
-    UPDATE_MEDIA_LIBRARY = 900000 # update media library every 15 minutes
+#
+# Decoder for one live wall stream. Decoding and scaling run in a separate
+# process that writes RGB frames straight into shared memory; the GUI reads
+# them from there without pickling them through a pipe. Displaying a frame
+# still copies it twice, into a PIL image, which stores RGB as 4 bytes per
+# pixel, and into the stream's Tk photo image. The shared memory holds a
+# header of int64 values followed by WALL_SLOTS frame slots. Each slot has a
+# sequence number that is odd while the slot is being written; a reader that
+# sees the sequence number change has read a torn frame and skips it.
+#
+class WallDecoder:
 
-    def __init__(self, **args):
+    WALL_SLOTS   = 3 # frame slots; the writer never touches the newest frame
+    HEADER_SIZE  = 4096 # bytes reserved for the header
+    LATEST       = 0 # index of slot with the newest frame, -1 if none
+    WIDTH        = 1 # width of frames
+    HEIGHT       = 2 # height of frames
+    FRAMES       = 3 # number of frames decoded
+    STATE        = 4 # 0 starting, 1 decoding, 2 stream ended
+    WAKE_PENDING = 5 # 1 if the reader has been sent a wakeup
+    FIRST_FRAME  = 6 # time.monotonic_ns() of first frame
+    LAST_FRAME   = 7 # time.monotonic_ns() of last frame
+    SLOT_SEQ     = 8 # first of WALL_SLOTS sequence numbers
 
-        # By default use GUI to ask user 6-digit TFA code.
-        if 'tfa_source' not in args:
-            args['tfa_source'] = TFAgetCode()
+    def __init__(self, context, source: str, image_size: tuple):
+        self.source = source
+        self.image_size = image_size
+        self.slot_size = image_size[0] * image_size[1] * 3
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=self.HEADER_SIZE +
+                                                   self.WALL_SLOTS *
+                                                   self.slot_size)
+        self.header = numpy.ndarray((self.SLOT_SEQ + self.WALL_SLOTS,),
+                                    numpy.int64, self.shm.buf)
+        self.header[:] = 0
+        self.header[self.LATEST] = -1
+        self.reader, writer = context.Pipe(duplex=False)
+        self.stop_event = context.Event()
+        self.process = context.Process(target=wall_decode_process,
+                                       args=(source, self.shm.name,
+                                             image_size, writer,
+                                             self.stop_event),
+                                       daemon=True)
+        self.process.start()
+        writer.close()
 
-        # Store configuration under ~/.cache/pyaarlo.
-        if 'storage_dir' not in args:
-            args['storage_dir'] = BASE_DIRECTORY
+    # Return the newest frame as (sequence number, slot index, width, height)
+    # or None; the caller reads the frame with frameData and passes the
+    # sequence number to isValid afterwards. Clears the wakeup flag.
+    def latest(self) -> tuple:
+        self.header[self.WAKE_PENDING] = 0
+        slot = int(self.header[self.LATEST])
+        if slot < 0:
+            return None
+        seq = int(self.header[self.SLOT_SEQ + slot])
+        if seq & 1:
+            return None
+        return seq, slot, int(self.header[self.WIDTH]), \
+               int(self.header[self.HEIGHT])
 
-        # Download media to local directory.
-        if 'save_media_to' not in args:
-            args['save_media_to'] = os.path.join(VIDEO_DIRECTORY,
-                                                 VIDEO_FILENAME_FORMAT)
+    # Memoryview of RGB pixels in given slot; valid until the process writes
+    # the slot again.
+    def frameData(self, slot: int, width: int, height: int) -> memoryview:
+        offset = self.HEADER_SIZE + slot * self.slot_size
+        return self.shm.buf[offset:offset + width * height * 3]
 
-        # Delete html for expired videos.
-        expire_video_htmls()
+    # True if slot has not been overwritten since latest returned seq.
+    def isValid(self, slot: int, seq: int) -> bool:
+        return int(self.header[self.SLOT_SEQ + slot]) == seq
 
-        print('Connecting to Arlo cloud...')
-        self.arlo = pyaarlo.PyArlo(**args)
-        if self.arlo.is_connected:
-            print('Connected.')
+    @property
+    def ended(self) -> bool:
+        return self.header[self.STATE] == 2
 
-            self.window = tkinter.Tk()
-            self.window.title("Arlo Camera Viewer")
+    # Number of frames decoded and frames per second decoded.
+    def stats(self) -> tuple:
+        frames = int(self.header[self.FRAMES])
+        elapsed = int(self.header[self.LAST_FRAME] -
+                      self.header[self.FIRST_FRAME]) / 1e9
+        return frames, (frames - 1) / elapsed if elapsed > 0 else 0.0
 
-            # Menu bar.
-            self.menubar = tkinter.Menu(self.window)
+    # Ask decoder process to stop; returns at once.
+    def stop(self) -> None:
+        self.stop_event.set()
 
-            # File menu
-            self.filemenu = tkinter.Menu(self.menubar, tearoff=0)
-            self.filemenu.add_command(label="Exit", command=self.window.destroy)
-            self.menubar.add_cascade(label="File", menu=self.filemenu)
+    # Stop decoder process and release shared memory. The reader end of the
+    # wakeup pipe is left open for the thread that may be waiting on it.
+    def close(self) -> None:
+        self.stop_event.set()
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        del self.header
+        self.shm.close()
+        self.shm.unlink()
 
-            # Add menu bar.
-            self.window.config(menu=self.menubar)
+# Runs in a decoder process for WallDecoder; decodes source, scales frames to
+# fit image_size and writes them in RGB to shared memory.
+def wall_decode_process(source, shm_name, image_size, writer, stop_event):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    header = numpy.ndarray((WallDecoder.SLOT_SEQ + WallDecoder.WALL_SLOTS,),
+                           numpy.int64, shm.buf)
+    slot_size = image_size[0] * image_size[1] * 3
+    cap = opencv().VideoCapture(source)
+    video_frame = scaled_frame = None
+    header[WallDecoder.STATE] = 1
+    try:
+        while cap.isOpened() and not stop_event.is_set():
+            retval, video_frame = cap.read(video_frame)
+            if not retval:
+                break
+            if scaled_frame is None:
+                height, width = video_frame.shape[:2]
+                factor = min(image_size[0] / width, image_size[1] / height)
+                size = int(width * factor), int(height * factor)
+                scaled_frame = numpy.empty((size[1], size[0], 3), numpy.uint8)
+                header[WallDecoder.WIDTH] = size[0]
+                header[WallDecoder.HEIGHT] = size[1]
+                header[WallDecoder.FIRST_FRAME] = time.monotonic_ns()
+            cv2.resize(video_frame, size, dst=scaled_frame,
+                       interpolation=cv2.INTER_AREA)
+            slot = (int(header[WallDecoder.LATEST]) + 1) % \
+                   WallDecoder.WALL_SLOTS
+            slot_frame = numpy.ndarray(scaled_frame.shape, numpy.uint8,
+                                       shm.buf, offset=WallDecoder.HEADER_SIZE +
+                                                       slot * slot_size)
+            header[WallDecoder.SLOT_SEQ + slot] += 1
+            cv2.cvtColor(scaled_frame, cv2.COLOR_BGR2RGB, dst=slot_frame)
+            header[WallDecoder.SLOT_SEQ + slot] += 1
+            del slot_frame
+            header[WallDecoder.LATEST] = slot
+            header[WallDecoder.FRAMES] += 1
+            header[WallDecoder.LAST_FRAME] = time.monotonic_ns()
+            if not header[WallDecoder.WAKE_PENDING]:
+                header[WallDecoder.WAKE_PENDING] = 1
+                writer.send_bytes(b'\0')
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        header[WallDecoder.STATE] = 2
+        try:
+            writer.send_bytes(b'\0')
+        except OSError:
+            pass
+        cap.release()
+        writer.close()
+        del header
+        shm.close()
 
-            # Compute number of rows and columns for window of camera images.
-            no_columns = int(math.ceil(math.sqrt(len(self.arlo.cameras))))
-            no_rows    = int(math.ceil(len(self.arlo.cameras) / no_columns))
+#
+# Live wall: streams many cameras at once. Each stream is decoded by its own
+# WallDecoder process so throughput scales with the number of cores instead of
+# being limited by the GUI process. A waiter thread in the GUI process turns
+# decoder wakeups into display calls on the Tk thread and closes the decoders
+# of removed streams, which may take a while, so the Tk thread never waits.
+#
+class LiveWall:
 
-            # These sizes are upper limits since we also maintain aspect ratios.
-            width  = int(0.85 * self.window.winfo_screenwidth() / no_columns)
-            height = int(0.85 * self.window.winfo_screenheight() / no_rows)
-            image_size = (width, height)
+    WAIT_TIMEOUT = 0.5 # seconds; waiter thread checks for new streams
 
-            # Add a LabelFrame to window for each camera.
-            camera_list = []
-            for i, camera in enumerate(self.arlo.cameras):
-                frame = tkinter.LabelFrame(self.window)
-                camera_list.append(Camera(camera, frame, image_size))
-                frame.grid(column=i%no_columns, row=i//no_columns,
-                           padx=5, pady=5)
+    def __init__(self, dispatcher: TkDispatcher, max_display_fps: int):
+        self.dispatcher = dispatcher
+        self.min_interval = 1.0 / max_display_fps
+        # Spawn decoders; forking a process with Tk and threads is unsafe.
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()
+        self.streams = {} # stream id -> _WallStream
+        self.retired = [] # decoders of removed streams, closed by waiter
+        self.next_id = 0
+        self.closed = False
+        # Not a daemon, so that decoders are closed before the process exits.
+        self.thread = threading.Thread(target=self.waiterThread)
+        self.thread.start()
 
-            # We do not re-scale images properly on resize event; disable.
-            self.window.resizable(False, False)
+    # Start decoding source; display(image) is called on the Tk thread with
+    # the stream's PhotoImage when it shows a new frame, ended() once the stream
+    # has ended. Returns id for remove.
+    def add(self, source: str, image_size: tuple, display, ended) -> int:
+        stream = _WallStream(WallDecoder(self.context, source, image_size),
+                             display, ended)
+        with self.lock:
+            stream_id = self.next_id
+            self.next_id += 1
+            self.streams[stream_id] = stream
+        return stream_id
 
-            # Periodically update media library.
-            self.window.after(2 * self.UPDATE_MEDIA_LIBRARY,
-                              self.updateMediaLibrary)
+    # Stop decoding stream with given id; the waiter thread closes its
+    # decoder.
+    def remove(self, stream_id: int) -> None:
+        with self.lock:
+            stream = self.streams.pop(stream_id, None)
+            if stream is not None:
+                stream.removed = True
+                stream.decoder.stop()
+                self.retired.append(stream.decoder)
 
-            # Enter main loop.
-            self.window.mainloop()
+    # Frames decoded and decode rate for each stream id.
+    def stats(self) -> dict:
+        with self.lock:
+            return { stream_id: stream.decoder.stats()
+                     for stream_id, stream in self.streams.items() }
 
-            # Exit video streams for clean shutdown.
-            for camera in camera_list:
-                camera.shutdown()
-        else:
-            print(f"Connection failed; {self.arlo.last_error}.")
+    # Stop all streams; the waiter thread closes their decoders and exits.
+    def close(self) -> None:
+        for stream_id in list(self.streams):
+            self.remove(stream_id)
+        self.closed = True
 
-    # Update media library; called periodically to learn about new videos
-    # and download them, e.g. after motion detection.
-    def updateMediaLibrary(self):
-        self.arlo.ml.update()
-        for camera in self.arlo.cameras:
-            camera.update_media(wait=False)
-        self.window.after(self.UPDATE_MEDIA_LIBRARY, self.updateMediaLibrary)
+    # Waits for decoder wakeups and posts displayFrame calls to Tk thread;
+    # closes decoders of removed streams.
+    def waiterThread(self):
+        while True:
+            with self.lock:
+                retired, self.retired = self.retired, []
+                readers = { stream.decoder.reader: stream
+                            for stream in self.streams.values()
+                            if not stream.eof }
+            for decoder in retired:
+                decoder.close()
+                decoder.reader.close()
+            if self.closed and not self.retired:
+                return
+            if not readers:
+                time.sleep(self.WAIT_TIMEOUT)
+                continue
+            ready = multiprocessing.connection.wait(list(readers),
+                                                    self.WAIT_TIMEOUT)
+            for reader in ready:
+                stream = readers[reader]
+                try:
+                    while reader.poll():
+                        reader.recv_bytes()
+                except (EOFError, OSError):
+                    stream.eof = True # decoder process has exited
+                if not stream.display_pending and not stream.removed:
+                    stream.display_pending = True
+                    self.dispatcher.post(self.displayFrame, stream)
 
+    # Runs on Tk thread; displays newest frame of stream.
+    def displayFrame(self, stream):
+        if stream.removed:
+            return
+        now = time.monotonic()
+        wait = stream.displayed_at + self.min_interval - now
+        if wait > 0:
+            self.dispatcher.window.after(int(math.ceil(1000 * wait)),
+                                         self.displayFrame, stream)
+            return
+        stream.display_pending = False
+        latest = stream.decoder.latest()
+        if latest is not None:
+            seq, slot, width, height = latest
+            image = Image.frombuffer('RGB', (width, height),
+                                     stream.decoder.frameData(slot, width,
+                                                              height),
+                                     'raw', 'RGB', 0, 1)
+            if stream.decoder.isValid(slot, seq):
+                # The photo image is reused; Tk redraws it where shown.
+                if stream.photo is None or \
+                   (stream.photo.width(), stream.photo.height()) != \
+                   (width, height):
+                    stream.photo = ImageTk.PhotoImage(image=image)
+                else:
+                    stream.photo.paste(image)
+                stream.displayed_at = now
+                stream.frames_displayed += 1
+                stream.display(stream.photo)
+            del image
+        if stream.decoder.ended and not stream.ended_reported:
+            stream.ended_reported = True
+            stream.ended()
 
-# Helper class that redirects TFA query to GUI.
-class TFAgetCode:
+class _WallStream:
+
+    def __init__(self, decoder: WallDecoder, display, ended):
+        self.decoder = decoder
+        self.display = display
+        self.ended = ended
+        self.photo = None # PhotoImage of frames shown
+        self.display_pending = False
+        self.displayed_at = 0.0
+        self.frames_displayed = 0
+        self.removed = False
+        self.eof = False
+        self.ended_reported = False
+
+#
+# Motion notifications that wait for their videos, sorted by time of motion so
+# that a video is matched to its notification with a binary search.
+#
+class MotionNotices:
 
     def __init__(self):
+        self.times = []         # sorted timestamps of motion events
+        self.notifications = [] # notification for each timestamp
+
+    def __len__(self):
+        return len(self.times)
+
+    # Add notification for motion at timestamp.
+    def add(self, timestamp: float, notification: Notification) -> None:
+        idx = bisect.bisect_right(self.times, timestamp)
+        self.times.insert(idx, timestamp)
+        self.notifications.insert(idx, notification)
+
+    # Remove and return notification closest to timestamp if it is less than
+    # max_diff seconds away; return None otherwise.
+    def match(self, timestamp: float, max_diff: float) -> Notification:
+        idx = bisect.bisect_left(self.times, timestamp)
+        best = None
+        for i in (idx - 1, idx):
+            if 0 <= i < len(self.times):
+                diff = abs(self.times[i] - timestamp)
+                if diff < max_diff and (best is None or diff < best[0]):
+                    best = (diff, i)
+        if best is None:
+            return None
+        del self.times[best[1]]
+        return self.notifications.pop(best[1])
+
+    # Remove notifications for motion before timestamp.
+    def expire(self, timestamp: float) -> None:
+        idx = bisect.bisect_left(self.times, timestamp)
+        del self.times[:idx]
+        del self.notifications[:idx]
+
+#
+# Refreshes the media library for all cameras of a site. Camera monitors that
+# wait for motion videos request a refresh; requests from several cameras are coalesced
+# into a single ml.update() whose result is handed to every waiting camera.
+# While motion videos are pending the library is refreshed every MIN_INTERVAL
+# seconds, slowing down to PENDING_INTERVAL; when idle the interval backs off
+# to IDLE_INTERVAL. Runs as a task on the event loop of ArloCore.
+#
+class MediaScheduler:
+
+    MIN_INTERVAL     =  20 # seconds; first refresh after motion
+    PENDING_INTERVAL =  90 # seconds; max interval while videos are pending
+    IDLE_INTERVAL    = 900 # seconds; max interval when idle (15 minutes)
+    PENDING_BACKOFF  = 1.5 # interval growth while videos are pending
+    IDLE_BACKOFF     = 2.0 # interval growth when idle
+
+    def __init__(self, core, site, on_refresh=None):
+        self.core = core
+        self.site = site
+        self.arlo = site.arlo
+        self.on_refresh = on_refresh # called with stats() after refreshes
+        self.wakeup = None # asyncio.Event, created on the event loop
+        self.waiting = set() # camera monitors waiting for motion videos
+        self.refreshing = False
+        self.interval = self.IDLE_INTERVAL
+        self.next_refresh = time.monotonic() + self.IDLE_INTERVAL
+        self.refreshes = 0
+        self.cloud_calls = 0
+        self.motion_calls = 0 # cloud calls while monitors wait for videos
+        self.motion_events = 0
+        labels = {'site': site.name} if site.name else {}
+        metrics().addCollector(lambda: [
+            ('arlo_media_refreshes_total', labels, self.refreshes),
+            ('arlo_media_waiting', labels, len(self.waiting))])
+
+    # Camera monitor has detected motion and waits for its video; the
+    # scheduler calls monitor.matchMotionVideos() after refreshes until that
+    # returns False. Called on the event loop.
+    def request(self, monitor) -> None:
+        self.motion_events += 1
+        self.waiting.add(monitor)
+        self.interval = self.MIN_INTERVAL
+        self.next_refresh = min(self.next_refresh,
+                                time.monotonic() + self.MIN_INTERVAL)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    # Refresh statistics; cloud calls per motion event count only the
+    # refreshes made while monitors waited for motion videos, not idle ones.
+    def stats(self) -> dict:
+        return {
+            'site'           : self.site.name,
+            'refreshes'      : self.refreshes,
+            'cloud_calls'    : self.cloud_calls,
+            'motion_events'  : self.motion_events,
+            'calls_per_event': self.motion_calls / self.motion_events
+                               if self.motion_events else 0.0,
+            'waiting'        : len(self.waiting),
+            'interval'       : self.interval
+        }
+
+    # Scheduler task; waits for the next refresh and runs it. Waits with
+    # asyncio.wait, not wait_for, which can swallow the cancellation of this
+    # task when the wakeup event is set at the same time.
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            wait = self.next_refresh - time.monotonic()
+            if wait > 0:
+                waiter = asyncio.ensure_future(self.wakeup.wait())
+                try:
+                    await asyncio.wait([waiter], timeout=wait)
+                finally:
+                    waiter.cancel()
+                self.wakeup.clear()
+                continue
+            waiting, self.waiting = self.waiting, set()
+            self.refreshing = True
+            try:
+                await self.refresh(waiting)
+            except Exception as e: # keep refreshing after cloud errors
+                print(f"Media library refresh failed: {e}.")
+                self.waiting |= waiting
+                self.next_refresh = time.monotonic() + self.interval
+            finally:
+                self.refreshing = False
+
+    # Update media library once and hand the result to all waiting cameras.
+    async def refresh(self, waiting: set) -> None:
+        await self.core.call(self.updateLibrary)
+        still_waiting = set()
+        for monitor in waiting:
+            if await self.core.call(monitor.matchMotionVideos):
+                still_waiting.add(monitor)
+        self.refreshes += 1
+        self.cloud_calls += 1
+        if waiting:
+            self.motion_calls += 1
+        self.waiting |= still_waiting
+        if self.waiting:
+            self.interval = min(self.interval * self.PENDING_BACKOFF,
+                                self.PENDING_INTERVAL)
+        else:
+            self.interval = min(self.interval * self.IDLE_BACKOFF,
+                                self.IDLE_INTERVAL)
+        self.next_refresh = time.monotonic() + self.interval
+        if self.on_refresh is not None:
+            self.on_refresh(self.stats())
+
+    # Blocking part of a refresh; runs in the executor of ArloCore.
+    def updateLibrary(self) -> None:
+        started = time.monotonic()
+        self.arlo.ml.update()
+        metrics().observe('arlo_ml_update_seconds',
+                          time.monotonic() - started)
+        for camera in self.arlo.cameras:
+            camera.update_media(wait=True) # no cloud call, reads library
+
+#
+# History of battery level, signal strength, and connectivity of each camera,
+# kept in BASE_DIRECTORY with a file per camera. A file holds MAGIC and then
+# fixed-width records in time order and is only ever appended to, so the
+# records since a given time are found by a binary search over the file. A
+# record is written when a value changes and at least every HEARTBEAT seconds;
+# a year of polls takes at most 8760 records of 8 bytes per camera. Battery
+# drain is the least-squares slope of the levels since the last charge.
+#
+class HealthHistory:
+
+    DIRECTORY      = os.path.join(BASE_DIRECTORY, 'health')
+    MAGIC          = b'ARLOHLTH\x01'
+    RECORD         = struct.Struct('<IbbBx') # time, battery, signal, flags
+    AVAILABLE      =          1 # flag; camera is connected
+    CHARGING       =          2 # flag; camera is charging
+    HEARTBEAT      =       3600 # seconds; max time between records
+    DRAIN_WINDOW   = 14 * 86400 # seconds of history for drain estimates
+    MIN_DRAIN_SPAN =   6 * 3600 # seconds of draining needed for an estimate
+    CHARGE_STEP    =          3 # percent; larger rises of level are charges
+
+    def __init__(self, directory: str = DIRECTORY):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.last = {} # device id -> latest record
+
+    def path(self, device_id: str) -> str:
+        return os.path.join(self.directory,
+                            re.sub(r'[^\w-]', '_', device_id) + '.bin')
+
+    # Record battery level and signal strength, None if unknown, and flags of
+    # camera with given device id at time when, seconds since the epoch;
+    # returns True if a record was written.
+    def add(self, device_id: str, when: float, battery: int, signal: int,
+            flags: int) -> bool:
+        record = (int(when), -1 if battery is None else battery,
+                  -1 if signal is None else signal, flags)
+        with self.lock:
+            try:
+                last = self.last.get(device_id)
+                if last is None:
+                    last = self.last[device_id] = self.latest(device_id)
+                if last is not None:
+                    if record[1:] == last[1:] and \
+                       record[0] - last[0] < self.HEARTBEAT:
+                        return False
+                    record = (max(record[0], last[0]),) + record[1:]
+                os.makedirs(self.directory, exist_ok=True)
+                with open(self.path(device_id), 'ab') as file:
+                    if file.tell() == 0:
+                        file.write(self.MAGIC)
+                    file.write(self.RECORD.pack(*record))
+                self.last[device_id] = record
+                return True
+            except (OSError, ValueError, struct.error) as e:
+                print(f"Cannot record health of camera {device_id}: {e}.")
+                return False
+
+    # Latest raw record of camera or None; cuts off a truncated last record,
+    # e.g. after a crash, so that appended records stay aligned.
+    def latest(self, device_id: str) -> tuple:
+        try:
+            with open(self.path(device_id), 'r+b') as file:
+                if file.read(len(self.MAGIC)) != self.MAGIC:
+                    raise ValueError('not a health history')
+                size = os.fstat(file.fileno()).st_size - len(self.MAGIC)
+                if size % self.RECORD.size:
+                    size -= size % self.RECORD.size
+                    file.truncate(len(self.MAGIC) + size)
+                if size == 0:
+                    return None
+                file.seek(len(self.MAGIC) + size - self.RECORD.size)
+                return self.RECORD.unpack(file.read(self.RECORD.size))
+        except FileNotFoundError:
+            return None
+
+    # Records of camera since time since as (time, battery, signal, flags)
+    # tuples, oldest first; battery and signal are None if unknown.
+    def records(self, device_id: str, since: float = 0) -> list:
+        try:
+            with open(self.path(device_id), 'rb') as file:
+                if file.read(len(self.MAGIC)) != self.MAGIC:
+                    raise ValueError(f"'{file.name}' is not a health history")
+                count = (os.fstat(file.fileno()).st_size - len(self.MAGIC)) \
+                        // self.RECORD.size
+                low, high = 0, count
+                while low < high:
+                    middle = (low + high) // 2
+                    file.seek(len(self.MAGIC) + middle * self.RECORD.size)
+                    if self.RECORD.unpack(
+                           file.read(self.RECORD.size))[0] < since:
+                        low = middle + 1
+                    else:
+                        high = middle
+                file.seek(len(self.MAGIC) + low * self.RECORD.size)
+                data = file.read((count - low) * self.RECORD.size)
+        except FileNotFoundError:
+            return []
+        return [(when, None if battery < 0 else battery,
+                 None if signal < 0 else signal, flags)
+                for when, battery, signal, flags in
+                self.RECORD.iter_unpack(data)]
+
+    # Battery drain of camera in percent per day and the time its level is
+    # predicted to drop below threshold, or None while it is not draining or
+    # has not drained for MIN_DRAIN_SPAN since its last charge.
+    def drain(self, device_id: str, threshold: int, now: float) -> tuple:
+        points = [] # (time, level), newest first
+        for when, battery, _, flags in \
+                reversed(self.records(device_id, now - self.DRAIN_WINDOW)):
+            if battery is None:
+                continue
+            if flags & self.CHARGING or \
+               points and battery + self.CHARGE_STEP < points[-1][1]:
+                break
+            points.append((when, battery))
+        if len(points) < 2 or points[0][0] - points[-1][0] < \
+                              self.MIN_DRAIN_SPAN:
+            return None
+        mean_time = sum(when for when, _ in points) / len(points)
+        mean_level = sum(level for _, level in points) / len(points)
+        slope = sum((when - mean_time) * (level - mean_level)
+                    for when, level in points) / \
+                sum((when - mean_time) ** 2 for when, _ in points)
+        if slope >= 0:
+            return None
+        return -86400 * slope, mean_time + (threshold - mean_level) / slope
+
+#
+# Watches an Arlo camera of a site for ArloCore. Sends notifications on motion
+# and low battery, also ahead of time when the battery drain predicts a low
+# battery, and extends motion notifications with links to their videos. Front
+# ends set on_battery to follow the battery level. Cameras are named with
+# their site when ArloCore hosts several.
+#
+class CameraMonitor:
+
+    BATTERY_UPDATE_INTERVAL =   900  # update battery level every 15 minutes
+    LOW_BATTERY_THRESHOLD   =    15  # warn when battery level drops below this
+    LOW_BATTERY_FORECAST    = 86400  # warn a day before battery will be low
+    MOTION_MATCH_WINDOW     =  10.0  # max seconds between motion and video
+    MOTION_EXPIRATION       =  3600  # give up on motion video after an hour
+    MOTION_VIDEO_COUNT      =    25  # check at least this many recent videos
+
+    def __init__(self, core, site, camera):
+        self.core = core
+        self.site = site
+        self.camera = camera
+        self.name = f"{camera.name} ({site.name})" if site.name else \
+                    camera.name
+        self.battery_level = None
+        self.battery_drain = None  # percent per day, None if not draining
+        self.battery_low_at = None # predicted time battery will be low
+        self.signal_strength = None
+        self.low_battery_warned = False
+        self.low_battery_forecast = False
+        self.on_battery = None # called with battery level on the event loop
+        self.motion_lock = threading.Lock()
+        self.motion_notices = MotionNotices()
+
+    # Subscribe to camera events; called on the event loop.
+    def start(self):
+        self.camera.add_attr_callback(MOTION_DETECTED_KEY, self.motionDetected)
+
+    # Update battery level, signal strength, and battery drain, a tuple of
+    # percent per day and the time the battery will be low or None; called
+    # every 15 minutes on the event loop. Warnings are repeated after the
+    # battery has been charged.
+    def batteryPolled(self, level, signal, drain):
+        self.battery_level = level
+        self.signal_strength = signal
+        self.battery_drain, self.battery_low_at = drain or (None, None)
+        if level is not None and level < self.LOW_BATTERY_THRESHOLD:
+            if not self.low_battery_warned:
+                notify("Arlo camera battery is low.", f"Camera {self.name} "
+                       f"has only {level}% battery left.",
+                       f"battery {self.name}")
+                self.low_battery_warned = True
+        else:
+            self.low_battery_warned = False
+            if drain is None:
+                self.low_battery_forecast = False
+            elif not self.low_battery_forecast and self.battery_low_at - \
+                 self.core.now().timestamp() < self.LOW_BATTERY_FORECAST:
+                when = datetime.datetime.fromtimestamp(self.battery_low_at)
+                notify("Arlo camera battery runs low.", f"Camera {self.name} "
+                       f"loses {self.battery_drain:.1f}% battery a day and "
+                       f"will have less than {self.LOW_BATTERY_THRESHOLD}% "
+                       f"left on {when.strftime('%m-%d %H:%M')}.",
+                       f"battery {self.name}")
+                self.low_battery_forecast = True
+        if self.on_battery is not None:
+            self.on_battery(level)
+
+    # When the battery will be low, e.g. 'low in 12 days'; '' if unknown.
+    def batteryForecast(self) -> str:
+        if self.battery_low_at is None:
+            return ''
+        hours = (self.battery_low_at - self.core.now().timestamp()) / 3600
+        if hours <= 0:
+            return 'low now'
+        if hours < 48:
+            return f'low in {hours:.0f} hours'
+        return f'low in {hours / 24:.0f} days'
+
+    # Called on motionDetected event by a pyaarlo thread.
+    def motionDetected(self, device, attr, value):
+        if value:
+            self.core.submit(self.motion(self.core.now(),
+                                         received=time.monotonic()))
+
+    # Called by a stream thread when MotionDetector sees motion in the live
+    # stream.
+    def localMotionDetected(self, now):
+        self.core.submit(self.motion(now, ' locally'))
+
+    # Sends notification and waits for the video of this motion. Motion
+    # events in quick succession share one notification. received is the
+    # time.monotonic() of the pyaarlo event, if any.
+    async def motion(self, now, how='', received=None):
+        if received is not None:
+            metrics().observe('arlo_event_lag_seconds',
+                              time.monotonic() - received, event='motion')
+        time_string = now.strftime('%m-%d %H:%M:%S')
+        notification = notify("Motion detected.", f"Motion detected{how} on "
+                              f"{time_string} at {self.name}.",
+                              f"motion {self.name}")
+        with self.motion_lock:
+            self.motion_notices.add(now.timestamp(), notification)
+        self.site.media_scheduler.request(self)
+
+    # This function is called in the executor of ArloCore after the media
+    # library has been refreshed while motion videos are pending. It looks for
+    # the videos that show these motions and extends the notifications with
+    # links to them. Returns True while motion videos are still pending.
+    def matchMotionVideos(self):
+        with self.motion_lock:
+            count = max(self.MOTION_VIDEO_COUNT, len(self.motion_notices))
+        videos = self.core.lastVideos(self.camera, count)
+        matches = []
+        with self.motion_lock:
+            self.motion_notices.expire(self.core.now().timestamp() -
+                                       self.MOTION_EXPIRATION)
+            for video in videos:
+                if not self.motion_notices:
+                    break
+                notification = self.motion_notices.match(
+                                   video.created_at / 1000,
+                                   self.MOTION_MATCH_WINDOW)
+                if notification is not None:
+                    matches.append((video, notification))
+            pending = bool(self.motion_notices)
+        for video, notification in matches:
+            self.motionVideoFound(video, notification,
+                                  *write_video_html(video, self.core.index,
+                                                    self.name))
+        return pending
+
+    # Extends notification with links to its video.
+    def motionVideoFound(self, video, notification, file_url, file_name):
+        if notifications().supports_html:
+            notification.notification_body += \
+                f'<br><a href="{file_url}">Play</a> or <a href='\
+                f'"{video.video_url}" download="{file_name}.mp4">'\
+                  'download</a> video.'
+        else:
+            notification.notification_body += '\r\nVideo '\
+                f"'{file_name}' is available for this motion event."
+        update_notification(notification)
+
+#
+# Decodes camera snapshots in worker threads. JPEGs are decoded in draft mode,
+# i.e. the decoder scales them down by up to 8x while decoding, and are then
+# resized to fit the requested size. Scaled images are cached by a hash of the
+# JPEG data and the size, so an unchanged image is never decoded twice. The
+# cache holds at most CACHE_BYTES of pixels and drops the least recently used
+# images first.
+#
+class SnapshotDecoder:
+
+    WORKERS     =                2 # decoder threads; PIL releases the GIL
+    CACHE_BYTES = 64 * 1024 * 1024 # pixel bytes of cached images
+
+    def __init__(self, dispatcher: TkDispatcher, workers: int = WORKERS,
+                 cache_bytes: int = CACHE_BYTES):
+        self.dispatcher = dispatcher
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+                            max_workers=workers,
+                            thread_name_prefix='snapshot')
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict() # (hash, size) -> Image
+        self.decoding = {} # (hash, size) -> displays waiting for the image
+        self.cache_bytes = 0
+        self.max_cache_bytes = cache_bytes
+        self.decoded = 0
+        self.hits = 0
+        metrics().addCollector(self.collectMetrics)
+
+    # Decode JPEG data to an image that fits size; display(image) is called on
+    # the Tk thread with the result. Safe to call from any thread.
+    def decode(self, data: bytes, size: tuple, display) -> None:
+        try:
+            self.executor.submit(self.decodeImage, data, size, display)
+        except RuntimeError: # shut down
+            pass
+
+    def decodeImage(self, data, size, display):
+        key = (hashlib.blake2b(data, digest_size=16).digest(), size)
+        with self.lock:
+            image = self.cache.get(key)
+            if image is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+            elif key in self.decoding: # same image is being decoded
+                self.decoding[key].append(display)
+                self.hits += 1
+                return
+            else:
+                self.decoding[key] = [display]
+        if image is not None:
+            self.dispatcher.post(display, image)
+            return
+        started = time.monotonic()
+        try:
+            image = self.scaledImage(data, size)
+            metrics().observe('arlo_snapshot_decode_seconds',
+                              time.monotonic() - started)
+        except (OSError, ValueError) as e: # truncated or no image data
+            print(f"Cannot decode snapshot: {e}.")
+            image = None
+        with self.lock:
+            displays = self.decoding.pop(key)
+            if image is None:
+                return
+            self.decoded += 1
+            self.cache[key] = image
+            self.cache_bytes += image.width * image.height * 3
+            while self.cache_bytes > self.max_cache_bytes and \
+                  len(self.cache) > 1:
+                _, old = self.cache.popitem(last=False)
+                self.cache_bytes -= old.width * old.height * 3
+        for display in displays:
+            self.dispatcher.post(display, image)
+
+    # Decode data and scale it to fit size; maintain aspect ratio.
+    @staticmethod
+    def scaledImage(data: bytes, size: tuple) -> Image.Image:
+        with io.BytesIO(data) as file:
+            image = Image.open(file)
+            image.draft('RGB', size)
+            image.load()
+        factor = min(size[0] / image.width, size[1] / image.height)
+        return image.resize((max(1, int(image.width * factor)),
+                             max(1, int(image.height * factor))))
+
+    # Number of images decoded and number of cache hits.
+    def stats(self) -> dict:
+        with self.lock:
+            return { 'decoded': self.decoded, 'hits': self.hits,
+                     'cached': len(self.cache),
+                     'cache_bytes': self.cache_bytes }
+
+    def collectMetrics(self) -> list:
+        stats = self.stats()
+        return [('arlo_snapshots_decoded_total', {}, stats['decoded']),
+                ('arlo_snapshot_cache_hits_total', {}, stats['hits'])]
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+#
+# Live stream session for Camera.streamThread. Opens the stream with the
+# capture options below and reconnects when reading fails, after a backoff
+# that doubles with every failed attempt and is randomized so that cameras do
+# not reconnect in lockstep. A stream url is reused for reconnects while it is
+# younger than URL_LIFETIME seconds and opens; otherwise a new stream is
+# requested. Records time to first frame, stalls, and reconnects.
+#
+class StreamSession:
+
+    TRANSPORT      =  'tcp' # RTSP transport, 'tcp' or 'udp'
+    BUFFER_SIZE    =  None  # socket buffer size in bytes, None for default
+    OPEN_TIMEOUT   =  10.0  # seconds to open a stream
+    READ_TIMEOUT   =   5.0  # seconds without data before a read fails
+    URL_LIFETIME   =  60.0  # seconds a stream url is reused for reconnects
+    MIN_BACKOFF    =   0.5  # seconds before first reconnect attempt
+    MAX_BACKOFF    =  15.0  # max seconds between reconnect attempts
+    MAX_FAILURES   =    8   # give up after this many failures in a row
+
+    def __init__(self, start_stream, url: str = None, on_reconnect=None):
+        opencv()
+        self.start_stream = start_stream # returns new stream url or None
+        self.on_reconnect = on_reconnect # called before reconnect attempts
+        self.url = url
+        self.url_time = time.monotonic()
+        self.cap = None
+        self.closed = threading.Event()
+        self.lock = threading.Lock()
+        self.connect_started = time.monotonic()
+        self.frame_received = False # on current connection
+        self.failures = 0           # failed attempts since last frame
+        self.ttff = None            # seconds from connect to first frame
+        self.first_ttff = None      # time to first frame of the session
+        self.stalls = 0             # reads that failed after frames arrived
+        self.reconnects = 0
+
+    # FFmpeg capture options.
+    @classmethod
+    def captureOptions(cls) -> str:
+        options = [f'rtsp_transport;{cls.TRANSPORT}']
+        if cls.BUFFER_SIZE:
+            options.append(f'buffer_size;{cls.BUFFER_SIZE}')
+        return '|'.join(options)
+
+    # Apply the capture options to all streams opened afterwards, also by the
+    # decoder processes of the live wall. OpenCV reads them from the
+    # environment, which is process-global and not safe to change while
+    # stream threads open captures, so this is called once at startup.
+    @classmethod
+    def configure(cls) -> None:
+        os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = cls.captureOptions()
+
+    # Open url with timeouts.
+    @classmethod
+    def openCapture(cls, url: str) -> 'cv2.VideoCapture':
+        try:
+            return cv2.VideoCapture(url, cv2.CAP_FFMPEG,
+                                    [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC,
+                                     int(1000 * cls.OPEN_TIMEOUT),
+                                     cv2.CAP_PROP_READ_TIMEOUT_MSEC,
+                                     int(1000 * cls.READ_TIMEOUT)])
+        except (AttributeError, TypeError): # OpenCV before 4.5.2
+            return cv2.VideoCapture(url)
+
+    # Read next frame into frame, reconnecting as needed. Returns (False,
+    # None) when the session has been closed or has given up.
+    def read(self, frame: numpy.ndarray = None) -> tuple:
+        while not self.closed.is_set():
+            if self.cap is None and not self.connect():
+                break
+            retval, frame = self.cap.read(frame)
+            if retval:
+                if not self.frame_received:
+                    self.frame_received = True
+                    self.failures = 0
+                    with self.lock:
+                        self.ttff = time.monotonic() - self.connect_started
+                        if self.first_ttff is None:
+                            self.first_ttff = self.ttff
+                return True, frame
+            with self.lock:
+                if self.frame_received:
+                    self.stalls += 1
+                else:
+                    self.url = None # opened but sent nothing; get new url
+            self.failures += 1
+            self.release()
+            frame = None
+            if not self.backoff():
+                break
+        return False, None
+
+    # Open stream, reusing url if it is fresh enough. Returns False if the
+    # session has been closed or has given up.
+    def connect(self) -> bool:
+        while not self.closed.is_set():
+            self.frame_received = False
+            self.connect_started = time.monotonic()
+            if self.url is None or \
+               time.monotonic() - self.url_time > self.URL_LIFETIME:
+                self.url = self.start_stream()
+                self.url_time = time.monotonic()
+            if self.url is not None:
+                cap = self.openCapture(self.url)
+                if cap.isOpened():
+                    self.cap = cap
+                    return True
+                cap.release()
+                self.url = None
+            self.failures += 1
+            if not self.backoff():
+                break
+        return False
+
+    # Wait before next attempt; returns False to give up.
+    def backoff(self) -> bool:
+        if self.failures > self.MAX_FAILURES:
+            return False
+        delay = min(self.MAX_BACKOFF,
+                    self.MIN_BACKOFF * 2 ** (self.failures - 1))
+        if self.on_reconnect is not None:
+            self.on_reconnect()
+        if self.closed.wait(random.uniform(delay / 2, delay)):
+            return False
+        with self.lock:
+            self.reconnects += 1
+        return True
+
+    # Time to first frame of the session and of the latest connection,
+    # stalls, and reconnects.
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'first_ttff': self.first_ttff,
+                'ttff'      : self.ttff,
+                'stalls'    : self.stalls,
+                'reconnects': self.reconnects
+            }
+
+    # Stop reading; safe to call from any thread.
+    def close(self) -> None:
+        self.closed.set()
+
+    # Close the stream; called by the thread that reads.
+    def release(self) -> None:
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+#
+# Detects motion in the frames of a live stream. Frames are scaled down to
+# WIDTH pixels and converted to grayscale; each frame is compared with a
+# background model, a running average of earlier frames. Pixels that differ by
+# more than THRESHOLD gray levels are moving. Motion starts when more than
+# MIN_AREA of the region of interest moves in MIN_FRAMES consecutive frames and
+# ends after MIN_FRAMES frames without motion.
+#
+class MotionDetector:
+
+    WIDTH         =  160 # pixels; width of frames compared
+    LEARNING_RATE = 0.05 # weight of newest frame in background model
+    THRESHOLD     =   25 # gray levels; min change of a moving pixel
+    MIN_AREA      = 0.01 # fraction of region of interest that has to move
+    MIN_FRAMES    =    3 # frames of motion or no motion to change state
+
+    # Regions of interest per camera name; lists of (x0, y0, x1, y1) tuples in
+    # fractions of frame width and height. Cameras without regions of interest
+    # detect motion in the whole frame.
+    REGIONS = {}
+
+    def __init__(self, regions: list = None):
+        opencv()
+        self.regions = regions or []
+        self.reset()
+
+    def reset(self) -> None:
+        self.background = None # float32 running average
+        self.mask = None       # uint8 region of interest, None for all
+        self.area = 0          # pixels in region of interest
+        self.level = 0.0       # fraction of region of interest moving
+        self.moving = False
+        self.count = 0         # frames since last change of moving
+        self.frames = 0
+        self.events = 0
+
+    # Compare BGR frame with background; returns True when motion starts.
+    def update(self, frame: numpy.ndarray) -> bool:
+        height = max(1, frame.shape[0] * self.WIDTH // frame.shape[1])
+        small = cv2.resize(frame, (self.WIDTH, height),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        self.frames += 1
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray.astype(numpy.float32)
+            self.diff = numpy.empty_like(gray)
+            self.mask = self.regionMask(gray.shape)
+            self.area = cv2.countNonZero(self.mask) \
+                        if self.mask is not None else gray.size
+            return False
+        cv2.absdiff(gray, cv2.convertScaleAbs(self.background), dst=self.diff)
+        cv2.threshold(self.diff, self.THRESHOLD, 255, cv2.THRESH_BINARY,
+                      dst=self.diff)
+        if self.mask is not None:
+            cv2.bitwise_and(self.diff, self.mask, dst=self.diff)
+        self.level = cv2.countNonZero(self.diff) / max(1, self.area)
+        cv2.accumulateWeighted(gray, self.background, self.LEARNING_RATE)
+        if (self.level > self.MIN_AREA) == self.moving:
+            self.count = 0
+            return False
+        self.count += 1
+        if self.count < self.MIN_FRAMES:
+            return False
+        self.moving = not self.moving
+        self.count = 0
+        if self.moving:
+            self.events += 1
+        return self.moving
+
+    # Mask of regions of interest for frames of given shape.
+    def regionMask(self, shape: tuple) -> numpy.ndarray:
+        if not self.regions:
+            return None
+        height, width = shape
+        mask = numpy.zeros(shape, numpy.uint8)
+        for x0, y0, x1, y1 in self.regions:
+            mask[int(y0 * height):math.ceil(y1 * height),
+                 int(x0 * width):math.ceil(x1 * width)] = 255
+        return mask
+
+#
+# Keeps the last seconds of a live stream as JPEG-encoded frames, so that a
+# recording can start with what happened before it was triggered. Holds at most
+# SECONDS of stream and MAX_BYTES of JPEG data; oldest frames are dropped first.
+# Frames are kept at most MAX_FPS times per second and encoded on a thread of
+# the buffer's own, so the stream thread only copies a frame now and then; a
+# frame that arrives while the encoder is busy is skipped.
+#
+class PreRollBuffer:
+
+    SECONDS      =             10.0 # seconds of stream kept; 0 disables
+    MAX_BYTES    = 64 * 1024 * 1024 # bytes of JPEG data kept per camera
+    MAX_FPS      =              5.0 # frames kept per second
+    JPEG_QUALITY =               85
+
+    def __init__(self, seconds: float = None, max_bytes: int = None):
+        self.seconds = self.SECONDS if seconds is None else seconds
+        self.max_bytes = self.MAX_BYTES if max_bytes is None else max_bytes
+        self.cond = threading.Condition()
+        self.frames = collections.deque() # (timestamp, JPEG data)
+        self.bytes = 0
+        self.pending = None # (timestamp, frame) waiting for the encoder
+        self.spare = None   # frame array to copy the next pending frame into
+        self.taken_at = -math.inf # timestamp of newest frame taken
+        self.generation = 0 # incremented by drain; encodes of older frames
+                            # are discarded
+        self.skipped = 0
+        self.thread = None  # encoder thread, started on first frame
+
+    # Offer BGR frame captured at timestamp; called by the stream thread.
+    def add(self, frame: numpy.ndarray, timestamp: float) -> None:
+        if timestamp - self.taken_at < 1.0 / self.MAX_FPS:
+            return
+        with self.cond:
+            if self.pending is not None:
+                self.skipped += 1
+                return
+            copy = self.spare if self.spare is not None and \
+                                 self.spare.shape == frame.shape else \
+                   numpy.empty_like(frame)
+            self.spare = None
+            numpy.copyto(copy, frame)
+            self.pending = (timestamp, copy)
+            self.taken_at = timestamp
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.encodeThread,
+                                               daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    # Encodes pending frames and keeps them.
+    def encodeThread(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending is not None)
+                (timestamp, frame), self.pending = self.pending, None
+                generation = self.generation
+            retval, data = cv2.imencode('.jpg', frame,
+                                        [cv2.IMWRITE_JPEG_QUALITY,
+                                         self.JPEG_QUALITY])
+            with self.cond:
+                self.spare = frame
+                if not retval or generation != self.generation:
+                    continue
+                self.frames.append((timestamp, data))
+                self.bytes += data.nbytes
+                while self.frames and \
+                      (self.bytes > self.max_bytes or
+                       timestamp - self.frames[0][0] > self.seconds):
+                    self.bytes -= self.frames.popleft()[1].nbytes
+
+    # Remove and return all frames as (timestamp, JPEG data), oldest first.
+    # A frame being encoded is discarded.
+    def drain(self) -> list:
+        with self.cond:
+            frames = list(self.frames)
+            self.frames.clear()
+            self.bytes = 0
+            self.pending = None
+            self.generation += 1
+        return frames
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                'frames' : len(self.frames),
+                'seconds': self.frames[-1][0] - self.frames[0][0]
+                           if self.frames else 0.0,
+                'bytes'  : self.bytes,
+                'skipped': self.skipped
+            }
+
+#
+# Records a live stream to directory when triggered by local motion or by the
+# user. A recording starts with the frames in the pre-roll buffer, each
+# repeated for as long as it was shown, and ends POST_ROLL seconds after the
+# last trigger. Frames are encoded on a writer thread, so the stream thread
+# does not wait for the video encoder.
+#
+class StreamRecorder:
+
+    POST_ROLL  = 5.0    # seconds recorded after the last trigger
+    FOURCC     = 'mp4v' # MPEG-4 part 2; supported by every OpenCV build
+    QUEUE_SIZE = 100    # frames waiting for the writer thread
+
+    def __init__(self, camera_name: str, device_id: str,
+                 pre_roll: PreRollBuffer = None,
+                 directory: str = LOCAL_VIDEO_DIRECTORY):
+        self.camera_name = camera_name
+        self.device_id = device_id
+        self.pre_roll = pre_roll
+        self.directory = directory
+        self.queue = None # frames for writer thread while recording
+        self.path = None
+        self.stop_at = -math.inf
+        self.dropped = 0
+
+    @property
+    def recording(self) -> bool:
+        return self.queue is not None
+
+    # Record from now until POST_ROLL seconds from now.
+    def trigger(self, now: float) -> None:
+        self.stop_at = max(self.stop_at, now + self.POST_ROLL)
+
+    # Called by the stream thread for every frame.
+    def update(self, frame: numpy.ndarray, fps: float, now: float) -> None:
+        if now <= self.stop_at:
+            if self.queue is None:
+                self.start(frame, fps, now)
+            try:
+                self.queue.put_nowait(frame.copy())
+            except queue.Full: # encoder cannot keep up
+                self.dropped += 1
+        else:
+            if self.queue is not None:
+                self.stop()
+            if self.pre_roll is not None:
+                self.pre_roll.add(frame, now)
+
+    def start(self, frame: numpy.ndarray, fps: float, now: float) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = local_video_file_name(self.camera_name, self.device_id,
+                                          datetime.datetime.now(),
+                                          self.directory)
+        pre_roll = self.pre_roll.drain() if self.pre_roll is not None else []
+        self.queue = queue.Queue(self.QUEUE_SIZE)
+        threading.Thread(target=self.writeThread,
+                         args=[self.queue, self.path, fps,
+                               (frame.shape[1], frame.shape[0]),
+                               pre_roll, now]).start()
+        print(f"Recording {self.path}.")
+
+    def stop(self) -> None:
+        if self.queue is not None:
+            self.queue.put(None)
+            self.queue = None
+        self.stop_at = -math.inf
+
+    # Writes the pre-roll frames, then the frames queued until None. Each
+    # pre-roll frame is written until the next one was captured, the last one
+    # until the recording started at time start, but for at most a second.
+    def writeThread(self, frames, path, fps, size, pre_roll, start):
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.FOURCC),
+                                 fps, size)
+        for i, (timestamp, data) in enumerate(pre_roll):
+            frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+            if frame is not None:
+                if frame.shape[1::-1] != size: # stream resolution changed
+                    frame = cv2.resize(frame, size)
+                until = pre_roll[i + 1][0] if i + 1 < len(pre_roll) else start
+                for _ in range(max(1, min(round((until - timestamp) * fps),
+                                          math.ceil(fps)))):
+                    writer.write(frame)
+        while True:
+            frame = frames.get()
+            if frame is None:
+                break
+            writer.write(frame)
+        writer.release()
+
+#
+# An instance of class Camera represents an Arlo camera.
+#
+class Camera:
+
+    MAX_DISPLAY_FPS         =     30  # display at most 30 frames per second
+    VIDEO_STREAM_FORMAT     =  'arlo' # request rtsps stream
+    FRAME_BUFFER_SLOTS      =      1  # keep only the latest decoded frame
+    STATS_UPDATE_INTERVAL   =    1.0  # refresh stream statistics every second
+    LATENCY_SMOOTHING       =    0.1  # weight of newest frame in latency average
+    LOCAL_MOTION            =  False  # detect motion in live streams
+    RECORD_MOTION           =  False  # record live streams on local motion
+    DEFAULT_STREAM_FPS      =     15  # recording frame rate if stream has none
+
+    # camera is a pyaarlo camera or a CachedCamera until connect() is called.
+    def __init__(self, camera, window):
+        self.camera = camera
+        self.window = window
+        self.dispatcher = window.dispatcher
+        self.monitor = None # CameraMonitor once connected
+        self.snapshot_decoder = window.snapshot_decoder
+        self.tile = None # CameraTile while on the current page
+        self.image_size = window.image_size
+        self.image = None
+        self.name = camera.name
+        self.model = camera.model_id
+        self.battery_level = camera.battery_level
+        self.addl_status_text = ''
+        self.status_text = ''
+        self.snapshot_requested = False
+        self.snapshots_requested = 0 # snapshots passed to snapshot decoder
+        self.snapshots_shown = 0     # newest snapshot displayed
+        self.painted = False         # shown in a tile at least once
+        # Latest camera image as JPEG data; pyaarlo holds it anyway, so
+        # keeping it costs no memory. Decoded only while on the current page.
+        self.original = self.camera.last_image_from_cache
+        # Members for live video stream.
+        self.live_stream = 'off' # values: 'on', 'off', 'init', 'error', 'wall'
+        self.thread = None
+        self.session = None      # StreamSession while streaming
+        self.wall = None         # LiveWall while streaming to the live wall
+        self.wall_stream = None  # stream id in self.wall
+        self.wall_request = None # future of wall stream url until it arrives
+        self.frame_buffer = FrameBuffer(self.FRAME_BUFFER_SLOTS)
+        self.stats_updated = 0.0
+        self.display_pending = False # frame display posted to Tk thread
+        self.displayed_at = 0.0      # time.monotonic() of last frame display
+        self.display_latency = None  # smoothed capture-to-display latency
+        # Recordings go to the core's archive once connected.
+        self.recorder = StreamRecorder(self.name, camera.device_id,
+                                       PreRollBuffer()
+                                       if PreRollBuffer.SECONDS > 0 else None)
+        self.record_requested = False # set on Tk thread, read by streamThread
+        if isinstance(camera, CachedCamera):
+            self.updateStatus("   connecting to Arlo cloud")
+        else:
+            self.connect(camera)
+
+    # Switch to live camera of the Arlo cloud; called on the Tk thread once
+    # the core has connected. Cameras created from the cache of the previous
+    # session keep their tiles and show the live image if it differs.
+    def connect(self, camera):
+        self.camera = camera
+        self.monitor = self.window.core.monitor(camera)
+        self.name = self.monitor.name # tells sites apart
+        self.recorder.camera_name = self.name
+        self.recorder.directory = os.path.join(self.window.core.index.directory,
+                                               'Local')
+        self.model = camera.model_id
+        self.battery_level = camera.battery_level
+        if camera.last_image_from_cache and \
+           camera.last_image_from_cache != self.original:
+            self.original = camera.last_image_from_cache
+            if self.tile is not None:
+                self.decodeSnapshot()
+        if self.tile is not None:
+            self.tile.frame.configure(text=self.name)
+        self.updateStatus()
+        # The core checks the battery level every 15 minutes.
+        self.monitor.on_battery = lambda level: \
+            self.dispatcher.post(self.updateBatteryLevel, level)
+        # Snapshot callback.
+        camera.add_attr_callback(LAST_IMAGE_DATA_KEY, self.lastImageData)
+        metrics().addCollector(self.collectMetrics)
+
+    # Show camera in tile; called on the Tk thread when the camera's page is
+    # shown.
+    def attach(self, tile, image_size):
+        self.tile = tile
+        self.image_size = image_size
+        tile.frame.configure(text=self.name)
+        tile.label.configure(image='')
+        tile.status_line.configure(text=self.status_text)
+        # Left and right mouse buttons callback.
+        tile.label.bind("<Button-1>", self.buttonPressed)
+        tile.label.bind("<Button-3>", self.buttonPressed)
+        if self.original:
+            self.decodeSnapshot()
+        elif not self.painted: # nothing to paint
+            self.painted = True
+            self.window.cameraPainted(self)
+
+    # Remove camera from its tile; stops its live stream.
+    def detach(self):
+        if self.live_stream != 'off':
+            self.stopStream()
+            self.updateStatus()
+        self.tile = None
+        self.image = None
+
+    # Rescale image to new tile size; called on the Tk thread. Live streams
+    # pick up the new size with their next frame.
+    def resize(self, image_size):
+        self.image_size = image_size
+        if self.tile is not None and self.live_stream == 'off' and \
+           self.original:
+            self.decodeSnapshot()
+
+    # Show new battery level; called on the Tk thread.
+    def updateBatteryLevel(self, level):
+        self.battery_level = level
+        self.updateStatus(self.addl_status_text)
+
+    # Update status line.
+    def updateStatus(self, addl = ''):
+        self.addl_status_text = addl
+        forecast = self.monitor.batteryForecast() \
+                   if self.monitor is not None else ''
+        if forecast:
+            forecast = f" ({forecast})"
+        self.status_text = f"Camera model {self.model}, battery level "\
+                           f"{self.battery_level}%{forecast}{addl}"
+        if self.tile is not None:
+            self.tile.status_line.configure(text=self.status_text)
+
+    # Turn live stream off so streamThread shuts down.
+    def shutdown(self):
+        if self.live_stream != 'off':
+            self.stopStream()
+
+    # Return size that fits within self.image_size; maintain aspect ratio.
+    def scaledSize(self, width, height):
+        factor = min(self.image_size[0] / width, self.image_size[1] / height)
+        return int(width * factor), int(height * factor)
+
+    # Frame rate, drop rate, queue depth and high-water mark, capture-to-
+    # display latency in seconds, time to first frame, stalls, reconnects, and
+    # pre-roll buffer use of the live stream.
+    def streamStats(self):
+        stats = self.frame_buffer.stats()
+        stats['latency'] = self.display_latency
+        stats['recording'] = self.recorder.recording
+        if self.session is not None:
+            stats.update(self.session.stats())
+        if self.recorder.pre_roll is not None:
+            pre_roll = self.recorder.pre_roll.stats()
+            stats['pre_roll_seconds'] = pre_roll['seconds']
+            stats['pre_roll_bytes'] = pre_roll['bytes']
+        return stats
+
+    # Live stream metrics; none while not streaming.
+    def collectMetrics(self):
+        if self.live_stream not in ('init', 'on'):
+            return []
+        labels = {'camera': self.name}
+        stats = self.streamStats()
+        return [('arlo_stream_fps', labels, stats['fps']),
+                ('arlo_stream_frames_total', labels, stats['frames']),
+                ('arlo_stream_dropped_frames_total', labels,
+                 stats['dropped']),
+                ('arlo_stream_queue_depth', labels, stats['queued']),
+                ('arlo_stream_reconnects_total', labels,
+                 stats.get('reconnects', 0))]
+
+    # Record the live stream, starting with the pre-roll buffer; called on the
+    # Tk thread by the record hotkey.
+    def recordStream(self):
+        if self.live_stream in ('init', 'on'):
+            self.record_requested = True
+
+    # Update still image; called by pyaarlo on LAST_IMAGE_DATA_KEY event,
+    # which hands the image to the Tk thread.
+    def lastImageData(self, device, attr, value):
+        if value:
+            self.dispatcher.post(self.imageReceived, value, time.monotonic())
+
+    # Store new still image; called on the Tk thread. Images of cameras that
+    # are not on the current page are only stored.
+    def imageReceived(self, value, received):
+        self.original = value
+        if self.tile is not None:
+            self.decodeSnapshot(received)
+
+    # Decoding happens in the snapshot decoder; showSnapshot displays the
+    # result. received is the time.monotonic() of the pyaarlo event, if any.
+    def decodeSnapshot(self, received=None):
+        self.snapshots_requested += 1
+        number = self.snapshots_requested
+        self.snapshot_decoder.decode(self.original, self.image_size,
+                                     lambda image: self.showSnapshot(number,
+                                                         image, received))
+
+    # Display decoded snapshot; called on the Tk thread. Snapshots decoded
+    # out of order or after the camera has left the page are ignored.
+    def showSnapshot(self, number, image, received=None):
+        if number < self.snapshots_shown or self.tile is None:
+            return
+        if received is not None:
+            metrics().observe('arlo_event_lag_seconds',
+                              time.monotonic() - received, event='snapshot')
+        self.snapshots_shown = number
+        if self.live_stream == 'off':
+            self.image = ImageTk.PhotoImage(image=image)
+            self.tile.label.configure(image=self.image)
+        if not self.painted:
+            self.painted = True
+            self.window.cameraPainted(self)
+        if self.snapshot_requested:
+            self.snapshot_requested = False
+            self.updateStatus()
+
+    # This function is called when the left or right mouse button is pressed in
+    # an image. The left mouse button updates the image with a snapshot; the
+    # right one starts a video stream. Either button stops a video stream.
+    def buttonPressed(self, e):
+        if self.monitor is None: # not connected yet
+            return
+        if self.live_stream != 'off': # either mouse button stops video stream
+            self.stopStream()
+            self.updateStatus()
+        elif e.num == 1: # left mouse button takes snapshot
+            self.snapshot_requested = True
+            self.updateStatus("   snapshot requested")
+            self.camera.request_snapshot()
+        elif e.num == 3: # right mouse button starts video stream
+            if self.live_stream == 'off':
+                url = self.streamUrl()
+                if url is not None:
+                    self.live_stream = 'init'
+                    self.frame_buffer.reset()
+                    self.display_latency = None
+                    self.session = StreamSession(self.streamUrl, url,
+                                                 self.streamReconnecting)
+                    self.thread = threading.Thread(target=self.streamThread,
+                                                   args=[self.session])
+                    self.thread.start()
+                    self.updateStatus("   waiting for video stream")
+
+    # Request a live stream from the Arlo cloud; returns its url or None.
+    # Simulated cameras also stream rtsp:// and file:// urls and local files,
+    # e.g. for benchmarks.
+    def streamUrl(self):
+        url = self.camera.start_stream(self.VIDEO_STREAM_FORMAT)
+        if not isinstance(url, str):
+            return None
+        if url.startswith('rtsps://'):
+            return url
+        if self.window.core.simulated:
+            if url.startswith('rtsp://'):
+                return url
+            if url.startswith('file://'):
+                url = url2pathname(urlparse(url).path)
+            if os.path.isfile(url):
+                return url
+        return None
+
+    # Called by the stream session before it reconnects.
+    def streamReconnecting(self):
+        self.dispatcher.post(self.updateStatus,
+                             "   video stream lost, reconnecting")
+
+    # Helper function for video streaming. Runs in a thread that receives
+    # the video stream and puts video frames into the frame buffer. Frames are
+    # scaled and converted to RGB here, into reused arrays, so the GUI thread
+    # only needs to display them. With LOCAL_MOTION the scaled frames are also
+    # checked for motion, which is notified and optionally recorded. The
+    # recorder keeps the last seconds of the stream in its pre-roll buffer.
+    # The stream session reconnects when the stream fails. The thread exits
+    # when its stream has been stopped or replaced by a new one.
+    def streamThread(self, session):
+        video_frame = scaled_frame = fps = None
+        detector = None
+        if self.LOCAL_MOTION:
+            detector = MotionDetector(MotionDetector.REGIONS.get(self.name))
+        recorder = self.recorder
+        while True:
+            retval, video_frame = session.read(video_frame)
+            if not retval or self.live_stream == 'off' or \
+               self.session is not session:
+                break
+            captured = time.monotonic()
+            if fps is None:
+                fps = session.cap.get(cv2.CAP_PROP_FPS) or \
+                      self.DEFAULT_STREAM_FPS
+            size = self.scaledSize(video_frame.shape[1], video_frame.shape[0])
+            if scaled_frame is None or scaled_frame.shape[1::-1] != size:
+                scaled_frame = numpy.empty((size[1], size[0], 3), numpy.uint8)
+            cv2.resize(video_frame, size, dst=scaled_frame,
+                       interpolation=cv2.INTER_AREA)
+            if detector is not None:
+                if detector.update(scaled_frame):
+                    self.monitor.localMotionDetected(datetime.datetime.now())
+                if detector.moving and self.RECORD_MOTION:
+                    recorder.trigger(captured)
+            if self.record_requested:
+                self.record_requested = False
+                recorder.trigger(captured)
+            recorder.update(video_frame, fps, captured)
+            rgb_frame = self.frame_buffer.acquire(scaled_frame.shape)
+            cv2.cvtColor(scaled_frame, cv2.COLOR_BGR2RGB, dst=rgb_frame)
+            self.frame_buffer.put(rgb_frame, captured)
+            self.wakeDisplay()
+        # A newer stream of this camera has taken over status and recorder.
+        if self.session is session:
+            if self.live_stream != 'off':
+                self.live_stream = 'error'
+                self.wakeDisplay()
+            recorder.stop()
+        session.release()
+
+    # Ask the Tk thread to display the newest frame unless it has been asked
+    # already; called by streamThread.
+    def wakeDisplay(self):
+        if not self.display_pending:
+            self.display_pending = True
+            self.dispatcher.post(self.updateVideoFrame)
+
+    # Stream video to the live wall; its decoder process does the work of
+    # streamThread. The stream is requested from the Arlo cloud in the core's
+    # executor, so that a page of cameras does not block the Tk thread.
+    def startWallStream(self, wall):
+        assert self.live_stream == 'off'
+        if self.monitor is None: # not connected yet
+            return
+        self.live_stream = 'wall'
+        self.wall = wall
+        self.wall_request = self.window.core.executor.submit(self.streamUrl)
+        self.wall_request.add_done_callback(lambda future:
+            self.dispatcher.post(self.wallStreamUrl, future))
+        self.updateStatus("   waiting for live wall stream")
+
+    # Add stream to the live wall once its url has arrived; called on the Tk
+    # thread. Ignored if the stream has been stopped meanwhile.
+    def wallStreamUrl(self, future):
+        if future is not self.wall_request:
+            return
+        self.wall_request = None
+        try:
+            url = future.result()
+        except Exception as e:
+            print(f"Cannot start live wall stream of {self.name}: {e}.")
+            url = None
+        if url is None:
+            self.live_stream = 'off'
+            self.wall = None
+            self.updateStatus()
+            return
+        self.wall_stream = self.wall.add(url, self.image_size,
+                                         self.displayWallFrame,
+                                         self.wallStreamEnded)
+        self.updateStatus("   live wall")
+
+    # Display a frame from the live wall; called on the Tk thread.
+    def displayWallFrame(self, image):
+        if self.tile is not None:
+            self.image = image
+            self.tile.label.configure(image=self.image)
+
+    # Live wall stream has ended; called on the Tk thread.
+    def wallStreamEnded(self):
+        if self.live_stream == 'wall':
+            self.stopStream()
+            self.updateStatus()
+
+    # Stop video stream; the stream thread sees its session closed, stops
+    # its recording, and exits by itself, so the Tk thread does not wait.
+    def stopStream(self):
+        assert self.live_stream != 'off'
+        if self.live_stream == 'wall':
+            if self.wall_stream is not None:
+                self.wall.remove(self.wall_stream)
+            self.wall = self.wall_stream = self.wall_request = None
+        self.live_stream = 'off'
+        if self.session is not None:
+            self.session.close()
+        self.camera.stop_stream()
+        self.thread = None
+
+    # Helper function for video streaming. This function is called on the Tk
+    # thread when streamThread has a new frame; it takes the most recent frame
+    # from the frame buffer and displays it. Frames are displayed at most
+    # MAX_DISPLAY_FPS times per second.
+    def updateVideoFrame(self):
+        if self.live_stream in ('off', 'wall'): # stream has been stopped
+            self.display_pending = False
+            return
+        if self.live_stream == 'error':
+            self.display_pending = False
+            self.stopStream()
+            self.updateStatus()
+            return
+        now = time.monotonic()
+        wait = self.displayed_at + 1.0 / self.MAX_DISPLAY_FPS - now
+        if wait > 0:
+            self.window.window.after(int(math.ceil(1000 * wait)),
+                                     self.updateVideoFrame)
+            return
+        self.display_pending = False
+        latest = self.frame_buffer.get_latest()
+        if latest is None:
+            return
+        if self.live_stream == 'init':
+            self.live_stream = 'on'
+        captured, video_frame = latest
+        # PhotoImage copies the pixels; the frame can be reused right away.
+        self.image = ImageTk.PhotoImage(image=Image.fromarray(video_frame))
+        self.frame_buffer.release(video_frame)
+        self.tile.label.configure(image=self.image)
+        self.displayed_at = now = time.monotonic()
+        metrics().observe('arlo_frame_latency_seconds', now - captured,
+                          camera=self.name)
+        if self.display_latency is None:
+            self.display_latency = now - captured
+        else:
+            self.display_latency += self.LATENCY_SMOOTHING * \
+                                    (now - captured - self.display_latency)
+        if now - self.stats_updated >= self.STATS_UPDATE_INTERVAL:
+            self.stats_updated = now
+            stats = self.streamStats()
+            if stats['recording']:
+                recording = ', recording'
+            elif 'pre_roll_bytes' in stats:
+                recording = f", pre-roll {stats['pre_roll_seconds']:.0f} s " \
+                            f"{stats['pre_roll_bytes'] / 1e6:.1f} MB"
+            else:
+                recording = ''
+            if stats['reconnects']:
+                reconnects = f", {stats['stalls']} stalls, " \
+                             f"{stats['reconnects']} reconnects"
+            else:
+                reconnects = ''
+            self.updateStatus(f"   video stream {stats['fps']:.1f} fps, "
+                              f"{100 * stats['drop_rate']:.0f}% dropped, "
+                              f"{1000 * self.display_latency:.0f} ms latency, "
+                              f"first frame after {stats['ttff']:.1f} s"
+                              f"{reconnects}{recording}")
+
+#
+# Append-only journal of camera events for debugging and load tests. Records
+# pyaarlo's attribute callbacks and the video lists returned by last_n_videos
+# with the time they arrived. Each record is a RECORD header (time, kind,
+# camera number, payload length) followed by the payload. A session starts
+# with a SESSION record and numbers its cameras with CAMERA records.
+# Snapshots are stored as their JPEG data, video lists as creation time and
+# duration of each video, and only when they have changed. Records are flushed
+# at least every FLUSH_INTERVAL seconds.
+#
+class EventJournal:
+
+    MAGIC          = b'ARLOJRNL\x01'
+    RECORD         = struct.Struct('<dBHI') # time, kind, camera, length
+    VIDEO          = struct.Struct('<qI')   # created_at, duration
+    SESSION        = 0 # new session; camera numbers start over
+    CAMERA         = 1 # device id, name, and model of a camera
+    ATTRIBUTE      = 2 # attribute name and value of a callback
+    MEDIA          = 3 # videos returned by last_n_videos, newest first
+    ATTRIBUTES     = (MOTION_DETECTED_KEY, LAST_IMAGE_DATA_KEY, BATTERY_KEY)
+    FLUSH_INTERVAL = 1.0 # seconds
+
+    # Open journal at path, appending to it if it exists, and record the
+    # events of cameras.
+    def __init__(self, path: str, cameras: list):
+        self.lock = threading.Lock()
+        self.file = open(path, 'a+b')
+        self.file.seek(0)
+        magic = self.file.read(len(self.MAGIC))
+        if magic and magic != self.MAGIC:
+            self.file.close()
+            raise ValueError(f"'{path}' is not an event journal")
+        if not magic:
+            self.file.write(self.MAGIC)
+        self.flushed = time.monotonic()
+        self.numbers = {} # device id -> camera number
+        self.videos = {}  # device id -> last recorded video list
+        self.records = 0
+        self.write(self.SESSION, 0, b'')
+        for camera in cameras:
+            self.numbers[camera.device_id] = number = len(self.numbers)
+            self.write(self.CAMERA, number,
+                       '\0'.join((camera.device_id, camera.name,
+                                  str(camera.model_id))).encode())
+            self.attributeChanged(camera, BATTERY_KEY, camera.battery_level)
+            self.attributeChanged(camera, LAST_IMAGE_DATA_KEY,
+                                  camera.last_image_from_cache)
+            for attr in self.ATTRIBUTES:
+                camera.add_attr_callback(attr, self.attributeChanged)
+
+    # Attribute callback; called by pyaarlo threads.
+    def attributeChanged(self, device, attr, value):
+        if value is None:
+            return
+        if isinstance(value, bool):
+            data = b'T' if value else b'F'
+        elif isinstance(value, int):
+            data = b'I' + struct.pack('<q', value)
+        elif isinstance(value, (bytes, bytearray)):
+            data = b'B' + bytes(value)
+        else:
+            data = b'S' + str(value).encode()
+        self.write(self.ATTRIBUTE, self.numbers[device.device_id],
+                   attr.encode() + b'\0' + data)
+
+    # Record videos returned by camera.last_n_videos(count) unless the last
+    # recorded list gives them, as a replay slices it; refreshes of the newest
+    # videos then do not write the full list again, nor the full list the
+    # newest videos.
+    def media(self, camera, videos: list, count: int) -> None:
+        entries = tuple((video.created_at,
+                         int(video.media_duration_seconds or 0))
+                        for video in videos)
+        with self.lock:
+            last = self.videos.get(camera.device_id)
+            if last is not None and last[:count] == entries:
+                return
+            self.videos[camera.device_id] = entries
+        self.write(self.MEDIA, self.numbers[camera.device_id],
+                   b''.join(self.VIDEO.pack(*entry) for entry in entries))
+
+    def write(self, kind: int, number: int, payload: bytes) -> None:
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(self.RECORD.pack(time.time(), kind, number,
+                                             len(payload)))
+            self.file.write(payload)
+            self.records += 1
+            now = time.monotonic()
+            if now - self.flushed >= self.FLUSH_INTERVAL:
+                self.file.flush()
+                self.flushed = now
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    # Records of the journal at path as (time, kind, device id, data) tuples;
+    # data is (name, model) for CAMERA, (attribute, value) for ATTRIBUTE, and
+    # a list of (created_at, duration) for MEDIA records. Payloads longer than
+    # skip_over bytes are not read and given as None. A truncated last record,
+    # e.g. after a crash, ends the records.
+    @classmethod
+    def records(cls, path: str, skip_over: int = None):
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"'{path}' is not an event journal")
+            devices = []
+            while True:
+                header = f.read(cls.RECORD.size)
+                if len(header) < cls.RECORD.size:
+                    return
+                when, kind, number, length = cls.RECORD.unpack(header)
+                if skip_over is not None and length > skip_over and \
+                   kind != cls.CAMERA:
+                    f.seek(length, os.SEEK_CUR)
+                    payload = None
+                else:
+                    payload = f.read(length)
+                    if len(payload) < length:
+                        return
+                if kind == cls.SESSION:
+                    devices = []
+                    yield when, kind, None, None
+                    continue
+                if kind == cls.CAMERA:
+                    device_id, name, model = payload.decode().split('\0')
+                    devices.append(device_id)
+                    yield when, kind, device_id, (name, model)
+                    continue
+                if number >= len(devices):
+                    continue
+                data = payload
+                if payload is None:
+                    pass
+                elif kind == cls.ATTRIBUTE:
+                    attr, value = payload.split(b'\0', 1)
+                    tag, value = value[:1], value[1:]
+                    if tag in (b'T', b'F'):
+                        value = tag == b'T'
+                    elif tag == b'I':
+                        value = struct.unpack('<q', value)[0]
+                    elif tag == b'S':
+                        value = value.decode()
+                    data = (attr.decode(), value)
+                elif kind == cls.MEDIA:
+                    data = list(cls.VIDEO.iter_unpack(payload))
+                yield when, kind, devices[number], data
+
+@dataclass
+class JournalVideo:
+    camera                : object
+    created_at            : int # milliseconds since the epoch
+    media_duration_seconds: int
+    video_url             : str = None # replayed videos are not downloaded
+    thumbnail_url         : str = None
+
+# Camera of a replayed journal; provides the parts of pyaarlo's ArloCamera that
+# arlo.py uses. Live streams and snapshot requests are not available.
+class JournalCamera:
+
+    def __init__(self, device_id: str, name: str, model: str):
+        self.device_id = device_id
+        self.name = name
+        self.model_id = model
+        self.battery_level = 0
+        self.last_image_from_cache = None
+        self.videos = [] # last recorded video list
+        self.callbacks = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+    def add_attr_callback(self, attr, callback):
+        with self.lock:
+            self.callbacks[attr].append(callback)
+
+    # Replay attribute change.
+    def setAttr(self, attr: str, value) -> None:
+        if attr == BATTERY_KEY:
+            self.battery_level = value
+        elif attr == LAST_IMAGE_DATA_KEY:
+            self.last_image_from_cache = value
+        with self.lock:
+            callbacks = self.callbacks[attr] + self.callbacks['*']
+        for callback in callbacks:
+            callback(self, attr, value)
+
+    def last_n_videos(self, count):
+        return self.videos[:count]
+
+    def update_media(self, wait=True):
+        pass
+
+    def request_snapshot(self):
+        pass
+
+    def start_stream(self, stream_format=None):
+        return None
+
+    def stop_stream(self):
+        pass
+
+#
+# Replays an event journal in place of pyaarlo.PyArlo, so that ArloCore and
+# ArloWindow process recorded events again. Events are played at speed times
+# their recorded pace, or as fast as possible with speed 0, from the time
+# ArloCore calls start(). now() is the recorded time of the replay, so motion
+# events are matched to their videos as they were when recorded, at any
+# speed. Cameras return the video lists recorded last.
+#
+class JournalArlo:
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+        self.last_error = None
+        self.ml = self
+        self.first = None    # time of first record
+        self.position = None # time of latest record played
+        self.started = None  # time.monotonic() when replay started
+        self.played = 0
+        self.devices = {}    # device id -> JournalCamera
+        try:
+            for when, kind, device_id, data in EventJournal.records(path, 64):
+                if self.first is None:
+                    self.first = when
+                if kind == EventJournal.CAMERA and \
+                   device_id not in self.devices:
+                    self.devices[device_id] = JournalCamera(device_id, *data)
+                elif kind == EventJournal.ATTRIBUTE and data is not None and \
+                     data[0] == BATTERY_KEY:
+                    camera = self.devices[device_id]
+                    if not camera.battery_level:
+                        camera.battery_level = data[1]
+        except (OSError, ValueError) as e:
+            self.last_error = str(e)
+        if self.last_error is None and not self.devices:
+            self.last_error = f"no cameras in '{path}'"
+        self.cameras = list(self.devices.values())
+
+    @property
+    def is_connected(self) -> bool:
+        return self.last_error is None
+
+    # Media library update; video lists follow the journal.
+    def update(self):
+        pass
+
+    # Recorded time of the replay.
+    def now(self) -> datetime.datetime:
+        if self.started is None:
+            when = self.first
+        elif self.speed > 0:
+            when = self.first + (time.monotonic() - self.started) * self.speed
+        else:
+            when = self.position or self.first
+        return datetime.datetime.fromtimestamp(when)
+
+    # Start replay in a background thread; on_finished is called with the
+    # number of events and seconds taken when all events have been played.
+    def start(self, on_finished=None) -> None:
+        self.started = time.monotonic()
+        threading.Thread(target=self.replayThread, args=[on_finished],
+                         daemon=True).start()
+
+    def replayThread(self, on_finished):
+        for when, kind, device_id, data in EventJournal.records(self.path):
+            if self.speed > 0:
+                delay = self.started + (when - self.first) / self.speed - \
+                        time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            self.position = when
+            camera = self.devices.get(device_id)
+            if camera is None:
+                continue
+            if kind == EventJournal.ATTRIBUTE:
+                camera.setAttr(*data)
+            elif kind == EventJournal.MEDIA:
+                camera.videos = [JournalVideo(camera, created_at, duration)
+                                 for created_at, duration in data]
+            else:
+                continue
+            self.played += 1
+        if on_finished is not None:
+            on_finished(self.played, time.monotonic() - self.started)
+
+# Arlo account hosted by ArloCore: its PyArlo session and the scheduler of its
+# media library. The name tells the cameras of several sites apart; it is ''
+# while there is only one.
+class ArloSite:
+
+    def __init__(self, name: str, arlo):
+        self.name = name
+        self.arlo = arlo
+        self.media_scheduler = None # created once connected
+
+# Directory for the pyaarlo session, cookies, and state of an account given
+# with --accounts; accounts must not share them.
+def account_directory(username: str) -> str:
+    return os.path.join(BASE_DIRECTORY, 'accounts',
+                        hashlib.sha1(username.encode()).hexdigest()[:16])
+
+# Parse accounts file. Each line holds user name, password, and optionally
+# the method for two-factor authorization, separated by blanks; values with
+# blanks are quoted as in a shell and '#' starts a comment. Returns dicts of
+# PyArlo options with a storage directory per account; raises ValueError for
+# invalid lines.
+def read_accounts(lines) -> list:
+    accounts = []
+    for line_number, line in enumerate(lines, 1):
+        try:
+            fields = shlex.split(line, comments=True)
+            if not fields:
+                continue
+            if len(fields) not in (2, 3):
+                raise ValueError('expected user name, password, and '
+                                 'optional two-factor method')
+            tfa = fields[2].upper() if len(fields) == 3 else TFA_EMAIL_TYPE
+            if tfa not in (TFA_EMAIL_TYPE, TFA_SMS_TYPE):
+                raise ValueError(f"unknown two-factor method '{fields[2]}'")
+        except ValueError as e:
+            raise ValueError(f"line {line_number}: {e}") from None
+        accounts.append({'username': fields[0], 'password': fields[1],
+                         'tfa_type': tfa,
+                         'storage_dir': account_directory(fields[0])})
+    return accounts
+
+# Names of the sites of accounts with given user names: the part of the user
+# name before the '@', or the whole user name if another account has the same
+# part, numbered if still not unique.
+def site_names(usernames: list) -> list:
+    names = [username.split('@')[0] for username in usernames]
+    names = [username if names.count(name) > 1 else name
+             for name, username in zip(names, usernames)]
+    return [f'{name} {names[:i].count(name) + 1}' if names.count(name) > 1
+            else name for i, name in enumerate(names)]
+
+#
+# Core of the tool: connects to the Arlo cloud, sends motion and battery
+# notifications, refreshes the media library, and downloads videos. Its event
+# loop is asyncio; pyaarlo's blocking calls run in a bounded executor. One core
+# hosts the sites of one or more accounts, which share its event loop,
+# executor, downloads, and notifications. The core runs on its own in headless
+# mode or under a front end such as ArloWindow, which gets status updates
+# through its methods downloadProgress, archiveExpired, and
+# mediaLibraryRefreshed, called from core threads.
+#
+class ArloCore:
+
+    EXECUTOR_WORKERS = 4 # threads for blocking pyaarlo and notification calls
+
+    def __init__(self, front_end=None, **args):
+        self.front_end = front_end
+        self.loop = None
+        self.stopped = None # asyncio.Event, set to stop the event loop
+        self.started = threading.Event()
+        self.thread = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+                            self.EXECUTOR_WORKERS)
+
+        # Store configuration under ~/.cache/pyaarlo; accounts may have
+        # storage directories of their own.
+        if 'storage_dir' not in args:
+            args['storage_dir'] = BASE_DIRECTORY
+
+        # The video archive and its index; benchmarks and tests pass an index
+        # of a directory of their own.
+        self.index = args.pop('index', None)
+        if self.index is None:
+            self.index = video_index()
+
+        # Delete old videos when the archive exceeds its limits.
+        self.retention = RetentionPolicy(self.index,
+                                         args.pop('max_video_age', None),
+                                         args.pop('max_archive_size', None),
+                                         args.pop('camera_quota', None),
+                                         self.archiveExpired)
+
+        # Thumbnails and contact strips of archived videos. Indexing and
+        # deleting thumbnails and html of expired videos at startup are
+        # left to the GUI and headless mode, which ask for them.
+        self.maintain_archive = args.pop('maintain_archive', False)
+        self.indexer = ArchiveIndexer(self.index,
+                                      os.path.join(self.index.directory,
+                                                   'Thumbnails')) \
+                       if self.maintain_archive and \
+                          ArchiveIndexer.WORKERS > 0 else None
+
+        # Download media to local directory; we download, not pyaarlo.
+        self.download_engine = DownloadEngine(
+                                   args.pop('download_workers',
+                                            DownloadEngine.WORKERS),
+                                   args.pop('max_download_rate', None),
+                                   self.downloadProgress, self.index,
+                                   self.videoDownloaded)
+
+        # Pick up changes to the video archive, delete html for expired videos
+        # if asked to.
+        threading.Thread(target=self.maintainArchive, daemon=True).start()
+
+        # A PyArlo instance or a list of them can be passed in, e.g.
+        # simulated cameras or a replayed journal; replays run on the
+        # journal's clock. Otherwise the accounts, dicts of PyArlo options
+        # that add to the others, log in one after the other. The health
+        # history of cameras is kept for the Arlo cloud only, unless given.
+        arlos = args.pop('arlo', None)
+        accounts = args.pop('accounts', None) or [{}]
+        self.health = args.pop('health', None)
+        journal = args.pop('journal', None)
+        self.journal = None
+        # Cameras not of the Arlo cloud may stream from local files.
+        self.simulated = arlos is not None
+        sites = []
+        if arlos is not None:
+            arlos = arlos if isinstance(arlos, list) else [arlos]
+            sites = [ArloSite(f'site {i + 1}' if len(arlos) > 1 else '', arlo)
+                     for i, arlo in enumerate(arlos)]
+        else:
+            print('Connecting to Arlo cloud...')
+            import pyaarlo # install with "pip install git+https://github.com/twrecked/pyaarlo"
+            names = site_names([account.get('username', '')
+                                for account in accounts]) \
+                    if len(accounts) > 1 else ['']
+            for account, name in zip(accounts, names):
+                options = {**args, **account}
+                if name:
+                    print(f"Logging in to {name}...")
+                os.makedirs(options['storage_dir'], exist_ok=True)
+                sites.append(ArloSite(name, pyaarlo.PyArlo(**options)))
+            if self.health is None:
+                self.health = HealthHistory()
+        if isinstance(sites[0].arlo, JournalArlo):
+            self.now = sites[0].arlo.now
+        else:
+            self.now = datetime.datetime.now
+        self.sites = []
+        self.errors = [] # why sites failed to connect
+        for site in sites:
+            at = f" to {site.name}" if site.name else ''
+            if site.arlo.is_connected:
+                print(f"Connected{at}.")
+                self.sites.append(site)
+            else:
+                print(f"Connection{at} failed; {site.arlo.last_error}.")
+                self.errors.append(f"{site.name}: {site.arlo.last_error}"
+                                   if site.name else
+                                   str(site.arlo.last_error))
+        # Cameras of all sites, site by site.
+        self.cameras = [camera for site in self.sites
+                        for camera in site.arlo.cameras]
+        if self.sites:
+            # Record camera events if asked to.
+            if journal is not None:
+                try:
+                    self.journal = EventJournal(journal, self.cameras)
+                except (OSError, ValueError) as e:
+                    print(f"Cannot write event journal: {e}.")
+            # Keyed by site and device id; sites may share device ids, e.g.
+            # cameras shared with several accounts.
+            self.monitors = { (site, camera.device_id):
+                                  CameraMonitor(self, site, camera)
+                              for site in self.sites
+                              for camera in site.arlo.cameras }
+            for site in self.sites:
+                site.media_scheduler = MediaScheduler(
+                                           self, site,
+                                           self.mediaLibraryRefreshed)
+            metrics().addCollector(self.collectMetrics)
+
+    # Monitor of camera, one of self.cameras.
+    def monitor(self, camera) -> CameraMonitor:
+        site = next(site for site in self.sites
+                    if any(c is camera for c in site.arlo.cameras))
+        return self.monitors[site, camera.device_id]
+
+    # True if at least one site has connected.
+    @property
+    def is_connected(self) -> bool:
+        return bool(self.sites)
+
+    # Run core in this thread until SIGINT or SIGTERM; headless mode.
+    def run(self) -> None:
+        try:
+            asyncio.run(self.main(handle_signals=True))
+        except KeyboardInterrupt: # no signal handlers on Windows
+            pass
+        self.shutdown()
+
+    # Run core in a background thread; for front ends.
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.runThread, daemon=True)
+        self.thread.start()
+        self.started.wait()
+
+    def runThread(self):
+        try:
+            asyncio.run(self.main())
+        finally:
+            self.started.set() # do not leave start() waiting on errors
+
+    # Stop core started with start().
+    def close(self) -> None:
+        if self.thread is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.stopped.set)
+            self.thread.join()
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        if self.journal is not None:
+            self.journal.close()
+        self.download_engine.close()
+        self.retention.close()
+        if self.indexer is not None:
+            self.indexer.close()
+        self.executor.shutdown(wait=False)
+        notifications().close()
+
+    # Run blocking function in the executor; awaited on the event loop.
+    async def call(self, function, *args):
+        return await self.loop.run_in_executor(self.executor, function, *args)
+
+    # Run coroutine on the event loop; safe to call from any thread.
+    def submit(self, coroutine) -> None:
+        if self.loop is None or self.loop.is_closed():
+            coroutine.close()
+            return
+        asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def main(self, handle_signals=False):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        if handle_signals:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    self.loop.add_signal_handler(sig, self.stopped.set)
+                except NotImplementedError: # Windows
+                    pass
+        for monitor in self.monitors.values():
+            monitor.start()
+        tasks = [asyncio.ensure_future(site.media_scheduler.run())
+                 for site in self.sites] + \
+                [asyncio.ensure_future(self.checkBatteries())]
+        # Download videos not downloaded yet, up to 30 days old.
+        self.loop.run_in_executor(self.executor, self.queueDownloads, True)
+        for site in self.sites:
+            if isinstance(site.arlo, JournalArlo):
+                site.arlo.start(self.replayFinished)
+        self.started.set()
+        await self.stopped.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Battery task; polls all cameras at once every 15 minutes.
+    async def checkBatteries(self):
+        while True:
+            try:
+                for monitor, level, signal, drain in \
+                        await self.call(self.pollHealth):
+                    monitor.batteryPolled(level, signal, drain)
+            except Exception as e: # keep polling after errors
+                print(f"Battery check failed: {e}.")
+            await asyncio.sleep(CameraMonitor.BATTERY_UPDATE_INTERVAL)
+
+    # Battery level, signal strength, and connectivity of all cameras in one
+    # executor call; pyaarlo keeps them up to date from its event stream, so
+    # there are no cloud calls. Records them in the health history, if any,
+    # and returns (monitor, battery level, signal strength, battery drain)
+    # tuples; see CameraMonitor.batteryPolled.
+    def pollHealth(self) -> list:
+        now = self.now().timestamp()
+        readings = []
+        drains = {} # device id -> drain; cameras shared by sites count once
+        for monitor in self.monitors.values():
+            camera = monitor.camera
+            level = camera.battery_level
+            # Journal and simulated cameras have battery levels only.
+            signal = getattr(camera, 'signal_strength', None)
+            flags = 0 if getattr(camera, 'is_unavailable', False) else \
+                    HealthHistory.AVAILABLE
+            if getattr(camera, 'is_charging', False):
+                flags |= HealthHistory.CHARGING
+            drain = None
+            if self.health is not None:
+                if camera.device_id not in drains:
+                    self.health.add(camera.device_id, now, level, signal,
+                                    flags)
+                    drains[camera.device_id] = self.health.drain(
+                        camera.device_id, CameraMonitor.LOW_BATTERY_THRESHOLD,
+                        now)
+                drain = drains[camera.device_id]
+            readings.append((monitor, level, signal, drain))
+        return readings
+
+    # Battery level, predicted time until the battery is low, and signal
+    # strength of each camera as of the latest poll.
+    def collectMetrics(self) -> list:
+        values = []
+        for monitor in list(self.monitors.values()):
+            labels = {'camera': monitor.name}
+            if monitor.battery_level is not None:
+                values.append(('arlo_battery_level', labels,
+                               monitor.battery_level))
+            if monitor.battery_low_at is not None:
+                values.append(('arlo_battery_low_seconds', labels,
+                               max(0, monitor.battery_low_at -
+                                      self.now().timestamp())))
+            if monitor.signal_strength is not None:
+                values.append(('arlo_signal_strength', labels,
+                               monitor.signal_strength))
+        return values
+
+    # Runs in a thread at startup.
+    def maintainArchive(self):
+        self.index.reconcile()
+        if self.retention.enabled:
+            self.retention.load()
+        if not self.maintain_archive:
+            return
+        expire_video_htmls(self.index)
+        if self.indexer is not None:
+            self.indexer.update()
+
+    # Called by download threads with the path of each new video.
+    def videoDownloaded(self, path):
+        self.retention.add(path)
+        if self.indexer is not None:
+            video = self.index.video(path)
+            if video is not None:
+                self.indexer.add(path, video[2])
+
+    # Called on the retention thread after expired videos have been deleted.
+    def archiveExpired(self, stats):
+        text = f"Archive: {stats['files']} videos, {stats['bytes'] / 1e9:.2f}" \
+               f" GB; deleted {stats['reclaimed_files']} expired videos, " \
+               f"reclaimed {stats['reclaimed_bytes'] / 1e9:.2f} GB"
+        print(text)
+        if self.front_end is not None:
+            self.front_end.archiveExpired(text)
+
+    # Queue downloads of all videos in the media library that have not been
+    # downloaded yet; runs in the executor. Videos are filed under the names
+    # of the monitors, which tell the sites apart.
+    def queueDownloads(self, update_media=False):
+        for monitor in self.monitors.values():
+            if update_media:
+                # No cloud call, reads library.
+                monitor.camera.update_media(wait=True)
+            for video in self.lastVideos(monitor.camera, sys.maxsize):
+                if video.video_url:
+                    self.download_engine.queueVideo(video, monitor.name)
+
+    # Newest count videos of camera; recorded in the event journal, if any.
+    def lastVideos(self, camera, count: int) -> list:
+        videos = camera.last_n_videos(count)
+        if self.journal is not None:
+            self.journal.media(camera, videos, count)
+        return videos
+
+    # Called on the replay thread when a replayed journal has ended. Headless
+    # runs stop once the videos of replayed motion have been matched.
+    def replayFinished(self, events, seconds):
+        print(f"Replayed {events} events in {seconds:.1f} seconds.")
+        if self.front_end is None:
+            self.submit(self.stopWhenMatched())
+
+    async def stopWhenMatched(self):
+        deadline = time.monotonic() + 2 * MediaScheduler.PENDING_INTERVAL
+        while any(site.media_scheduler.waiting or
+                  site.media_scheduler.refreshing for site in self.sites) and \
+              time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self.stopped.set()
+
+    # Called by download threads once per second while downloading.
+    def downloadProgress(self, stats):
+        if self.front_end is not None:
+            self.front_end.downloadProgress(stats)
+
+    # Called on the event loop after the media library of a site has been
+    # refreshed; queues downloads of new videos.
+    def mediaLibraryRefreshed(self, stats):
+        self.loop.run_in_executor(self.executor, self.queueDownloads)
+        if self.front_end is not None:
+            self.front_end.mediaLibraryRefreshed(stats)
+
+# Camera of the previous session, shown until the Arlo cloud has connected;
+# provides the parts of pyaarlo's ArloCamera that Camera uses before then.
+class CachedCamera:
+
+    def __init__(self, device_id: str, name: str, model: str,
+                 battery_level: int, image: bytes = None):
+        self.device_id = device_id
+        self.name = name
+        self.model_id = model
+        self.battery_level = battery_level
+        self.last_image_from_cache = image
+
+    def add_attr_callback(self, attr, callback):
+        pass
+
+    def request_snapshot(self):
         pass
 
+    def start_stream(self, stream_format=None):
+        return None
+
+    def stop_stream(self):
+        pass
+
+#
+# Cameras and window layout of the previous session, so that the window is
+# painted at startup instead of after logging in. Kept next to pyaarlo's
+# session in BASE_DIRECTORY, in a directory per account: cameras.json holds
+# name, model, and battery level of each camera and the layout, and each
+# camera's latest image is <device id>.jpg. Images are written only when they
+# have changed.
+#
+class SessionCache:
+
+    DIRECTORY = 'viewer' # under BASE_DIRECTORY
+
+    def __init__(self, account: str, base_directory: str = BASE_DIRECTORY):
+        self.directory = os.path.join(base_directory, self.DIRECTORY,
+                              hashlib.sha1(account.encode()).hexdigest()[:16])
+        self.images = {} # device id -> image as loaded or last saved
+
+    def imagePath(self, device_id: str) -> str:
+        return os.path.join(self.directory,
+                            re.sub(r'[^\w-]', '_', device_id) + '.jpg')
+
+    # Cameras as CachedCamera instances and the layout, a dict with the
+    # window geometry and page; no cameras if nothing has been cached.
+    def load(self) -> tuple:
+        try:
+            with open(os.path.join(self.directory, 'cameras.json')) as file:
+                cache = json.load(file)
+            cameras = [CachedCamera(camera['device_id'], camera['name'],
+                                    camera['model'], camera['battery_level'])
+                       for camera in cache['cameras']]
+            layout = cache.get('layout', {})
+            layout = {'page': int(layout.get('page', 0)),
+                      'geometry': str(layout.get('geometry', ''))}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Ignoring camera cache: {e}.")
+            return [], {}
+        for camera in cameras:
+            try:
+                with open(self.imagePath(camera.device_id), 'rb') as file:
+                    camera.last_image_from_cache = file.read()
+                self.images[camera.device_id] = camera.last_image_from_cache
+            except OSError:
+                pass
+        return cameras, layout
+
+    # Save cameras, a list of CachedCamera instances, and the layout. Images
+    # of cameras no longer present are deleted.
+    def save(self, cameras: list, layout: dict) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            images = {}
+            for camera in cameras:
+                device_id, image = camera.device_id, \
+                                   camera.last_image_from_cache
+                if image:
+                    images[device_id] = image
+                    if self.images.get(device_id) != image:
+                        replace_file(self.imagePath(device_id), image)
+            for device_id in set(self.images) - set(images):
+                try:
+                    os.remove(self.imagePath(device_id))
+                except FileNotFoundError:
+                    pass
+            self.images = images
+            cache = { 'cameras': [{ 'device_id': camera.device_id,
+                                    'name': camera.name,
+                                    'model': camera.model_id,
+                                    'battery_level': camera.battery_level }
+                                  for camera in cameras],
+                      'layout': layout }
+            replace_file(os.path.join(self.directory, 'cameras.json'),
+                         json.dumps(cache, indent=1).encode())
+        except OSError as e:
+            print(f"Cannot save camera cache: {e}.")
+
+#
+# Widgets that show one camera on the current page of the camera grid.
+#
+class CameraTile:
+
+    def __init__(self, window):
+        self.frame = tkinter.LabelFrame(window, labelanchor='n')
+        # self.label has camera image.
+        self.label = tkinter.Label(self.frame)
+        self.label.grid(column=0, row=0, sticky=tkinter.W)
+        # self.status_line is shown below camera image.
+        self.status_line = tkinter.Label(self.frame)
+        self.status_line.grid(column=0, row=1, sticky=tkinter.W)
+
+#
+# Main GUI class; a front end for ArloCore.
+#
+class ArloWindow:
+
+    PAGE_SIZE              =    16 # max cameras shown at once
+    RESIZE_DELAY           =   200 # ms; rescale images when resizing has paused
+    RESIZE_TOLERANCE       =     8 # pixels; ignore smaller changes of tile size
+    CONNECTION_ERROR_DELAY = 10000 # ms; close after showing connection error
+
+    def __init__(self, **args):
+        self.window = tkinter.Tk()
+        self.window.title("Arlo Camera Viewer")
+
+        # Lets background threads run functions on the Tk thread.
+        self.dispatcher = TkDispatcher(self.window)
+
+        # By default use GUI to ask user 6-digit TFA code; each account
+        # asks for its own.
+        if 'tfa_source' not in args:
+            args['tfa_source'] = TFAgetCode(self.window, self.dispatcher)
+        for account in args.get('accounts') or []:
+            account.setdefault('tfa_source',
+                               TFAgetCode(self.window, self.dispatcher,
+                                          account['username']))
+
+        # Cameras and layout of the previous session of these accounts; the
+        # window shows them until the core has connected.
+        arlo = args.get('arlo')
+        if isinstance(arlo, JournalArlo):
+            account = 'replay:' + os.path.abspath(arlo.path)
+        elif args.get('accounts'):
+            account = ' '.join(account['username']
+                               for account in args['accounts'])
+        else:
+            account = args.get('username')
+        self.session_cache = SessionCache(account) if account else None
+        cameras, layout = self.session_cache.load() \
+                          if self.session_cache is not None else ([], {})
+        if layout.get('geometry'):
+            self.window.geometry(layout['geometry'])
+
+        # Decodes and scales camera snapshots off the Tk thread.
+        self.snapshot_decoder = SnapshotDecoder(self.dispatcher)
+        self.cameras_painted = set() # first page, until it is painted
+
+        # Menu bar.
+        self.menubar = tkinter.Menu(self.window)
+
+        # File menu
+        self.filemenu = tkinter.Menu(self.menubar, tearoff=0)
+        self.filemenu.add_command(label="Record Live Streams",
+                                  accelerator="R",
+                                  command=self.recordStreams)
+        self.filemenu.add_command(label="Exit", command=self.close)
+        self.window.bind('<Key-r>', self.recordStreams)
+        self.menubar.add_cascade(label="File", menu=self.filemenu)
+        self.window.protocol('WM_DELETE_WINDOW', self.close)
+
+        # View menu
+        self.live_wall = None
+        self.live_wall_on = tkinter.BooleanVar(value=False)
+        self.viewmenu = tkinter.Menu(self.menubar, tearoff=0)
+        self.viewmenu.add_checkbutton(label="Live Wall",
+                                      variable=self.live_wall_on,
+                                      command=self.toggleLiveWall)
+        self.menubar.add_cascade(label="View", menu=self.viewmenu)
+        self.paging = False # page menu entries added
+
+        # Add menu bar.
+        self.window.config(menu=self.menubar)
+
+        # Media library status below the camera images.
+        self.status_line = tkinter.Label(self.window,
+                                         text='Connecting to Arlo cloud...')
+        self.download_line = tkinter.Label(self.window)
+        self.archive_line = tkinter.Label(self.window)
+
+        # Paint the cameras of the previous session right away.
+        self.camera_list = []
+        self.tiles = []
+        self.page = 0
+        self.buildGrid(cameras)
+        if cameras:
+            self.showPage(layout.get('page', 0))
+
+        # Rescale camera images when the window is resized.
+        self.resize_pending = None
+        self.window.bind('<Configure>', self.windowConfigured)
+
+        # Log in and connect in the background; connected() switches to the
+        # live cameras.
+        self.core = None
+        self.live_cameras = None # cameras of all sites once connected
+        self.closed = False
+        self.lock = threading.Lock()
+        threading.Thread(target=self.connectThread, args=[args],
+                         daemon=True).start()
+
+        # Enter main loop.
+        self.window.mainloop()
+        with self.lock:
+            self.closed = True
+
+        # Exit video streams for clean shutdown.
+        for camera in self.camera_list:
+            camera.shutdown()
+        if self.live_wall is not None:
+            self.live_wall.close()
+        self.snapshot_decoder.close()
+        if self.core is not None:
+            self.core.close()
+        self.dispatcher.close()
+
+    # Lay out a tile for each camera on a page and create the cameras; called
+    # again if the cameras of the Arlo cloud differ from the cached ones.
+    def buildGrid(self, cameras):
+        for camera in self.camera_list:
+            camera.detach()
+        for tile in self.tiles:
+            tile.frame.destroy()
+
+        # Compute number of rows and columns for a page of camera images.
+        # Cameras are shown a page at a time; only cameras on the current
+        # page have widgets and decoded images.
+        self.page_size = max(1, min(len(cameras), self.PAGE_SIZE))
+        self.pages = max(1, math.ceil(len(cameras) / self.page_size))
+        self.page = min(self.page, self.pages - 1)
+        no_columns, no_rows, self.image_size = \
+            grid_layout(self.window, self.page_size)
+        self.no_columns, self.no_rows = no_columns, no_rows
+        if self.pages > 1 and not self.paging:
+            self.paging = True
+            self.viewmenu.add_separator()
+            self.viewmenu.add_command(label="Next Page",
+                                      accelerator="Page Down",
+                                      command=lambda:
+                                          self.showPage(self.page + 1))
+            self.viewmenu.add_command(label="Previous Page",
+                                      accelerator="Page Up",
+                                      command=lambda:
+                                          self.showPage(self.page - 1))
+            self.window.bind('<Next>',
+                             lambda e: self.showPage(self.page + 1))
+            self.window.bind('<Prior>',
+                             lambda e: self.showPage(self.page - 1))
+
+        # Add a tile to window for each camera on a page.
+        self.camera_list = [Camera(camera, self) for camera in cameras]
+        self.tiles = []
+        for i in range(self.page_size if cameras else 0):
+            tile = CameraTile(self.window)
+            tile.frame.grid(column=i%no_columns, row=i//no_columns,
+                            padx=5, pady=5)
+            self.tiles.append(tile)
+
+        # Status lines below the camera images.
+        rows = no_rows if cameras else 0
+        for row, line in enumerate([self.status_line, self.download_line,
+                                    self.archive_line]):
+            line.grid(column=0, row=rows + row, columnspan=no_columns,
+                      sticky=tkinter.W, padx=5)
+
+    # Runs in a thread; logs in, which may ask for a security code on the Tk
+    # thread, and hands the connected core to the Tk thread.
+    def connectThread(self, args):
+        try:
+            core = ArloCore(self, **args)
+        except Exception as e: # e.g. pyaarlo missing or a login error
+            print(f"Cannot connect to Arlo cloud: {e}.")
+            self.dispatcher.post(self.connectionFailed, e)
+            return
+        with self.lock:
+            if self.closed: # window closed while connecting
+                core.shutdown()
+                return
+            self.core = core
+        self.dispatcher.post(self.connected)
+
+    # Show why connecting failed, then close the window; called on the Tk
+    # thread.
+    def connectionFailed(self, error):
+        self.status_line.configure(text=f"Cannot connect to Arlo cloud: "
+                                        f"{error}.")
+        self.window.after(self.CONNECTION_ERROR_DELAY, self.close)
+
+    # Switch from the cached cameras to the live ones and start the core;
+    # called on the Tk thread. Shows why and closes the window if no site
+    # connected.
+    def connected(self):
+        if not self.core.is_connected:
+            self.connectionFailed('; '.join(self.core.errors))
+            return
+        self.live_cameras = self.core.cameras
+        self.status_line.configure(text='Connected to Arlo cloud.')
+        if [camera.device_id for camera in self.live_cameras] == \
+           [camera.camera.device_id for camera in self.camera_list]:
+            for camera, live_camera in zip(self.camera_list,
+                                           self.live_cameras):
+                camera.connect(live_camera)
+        else:
+            self.buildGrid(self.live_cameras)
+            if self.camera_list:
+                self.showPage(self.page)
+        self.saveSessionCache()
+
+        # Run the core's event loop in a background thread.
+        self.core.start()
+
+    # Save cameras and layout for the next start; called once connected and
+    # before the window closes.
+    def saveSessionCache(self):
+        if self.session_cache is not None and self.live_cameras is not None:
+            cameras = [CachedCamera(camera.camera.device_id, camera.name,
+                                    camera.model, camera.battery_level,
+                                    camera.original)
+                       for camera in self.camera_list]
+            self.session_cache.save(cameras,
+                                    {'page': self.page,
+                                     'geometry': self.window.geometry()})
+
+    # Close window; called from the File menu and the window manager.
+    def close(self):
+        self.saveSessionCache()
+        self.window.destroy()
+
+    # Cameras on the current page.
+    def visibleCameras(self):
+        return self.camera_list[self.page * self.page_size:
+                                (self.page + 1) * self.page_size]
+
+    # Show given page of cameras in the tiles; cameras leaving the window stop
+    # streaming and drop their images.
+    def showPage(self, page):
+        page = max(0, min(page, self.pages - 1))
+        if page == self.page and self.visibleCameras()[0].tile is not None:
+            return
+        for camera in self.visibleCameras():
+            camera.detach()
+        self.page = page
+        cameras = self.visibleCameras()
+        for tile, camera in zip(self.tiles, cameras):
+            tile.frame.grid()
+            camera.attach(tile, self.image_size)
+            if self.live_wall_on.get():
+                camera.startWallStream(self.live_wall)
+        for tile in self.tiles[len(cameras):]:
+            tile.frame.grid_remove()
+        if self.pages > 1:
+            self.window.title(f"Arlo Camera Viewer - page {page + 1} of "
+                              f"{self.pages}")
+
+    # Called on <Configure> events, which arrive continuously while the
+    # window is being resized; rescales once resizing has paused.
+    def windowConfigured(self, event):
+        if event.widget is not self.window:
+            return
+        if self.resize_pending is not None:
+            self.window.after_cancel(self.resize_pending)
+        self.resize_pending = self.window.after(self.RESIZE_DELAY,
+                                                self.resizeTiles)
+
+    # Fit camera images to the window size.
+    def resizeTiles(self):
+        self.resize_pending = None
+        if not self.tiles: # still connecting, nothing cached
+            return
+        tile = self.tiles[0]
+        border_width = tile.frame.winfo_width() - tile.label.winfo_width() + 10
+        border_height = tile.frame.winfo_height() - \
+                        tile.label.winfo_height() + 10
+        below = self.status_line.winfo_height() + \
+                self.download_line.winfo_height() + \
+                self.archive_line.winfo_height()
+        image_size = (max(16, self.window.winfo_width() // self.no_columns -
+                              border_width),
+                      max(16, (self.window.winfo_height() - below) //
+                              self.no_rows - border_height))
+        if abs(image_size[0] - self.image_size[0]) < self.RESIZE_TOLERANCE and \
+           abs(image_size[1] - self.image_size[1]) < self.RESIZE_TOLERANCE:
+            return
+        self.image_size = image_size
+        for camera in self.visibleCameras():
+            camera.resize(image_size)
+
+    # Turn live wall on or off; called from the View menu. The live wall
+    # streams all cameras on the current page at once.
+    def toggleLiveWall(self):
+        if self.live_wall_on.get():
+            if self.live_wall is None:
+                self.live_wall = LiveWall(self.dispatcher,
+                                          Camera.MAX_DISPLAY_FPS)
+            for camera in self.visibleCameras():
+                if camera.live_stream != 'off':
+                    camera.stopStream()
+                camera.startWallStream(self.live_wall)
+        else:
+            for camera in self.visibleCameras():
+                if camera.live_stream == 'wall':
+                    camera.stopStream()
+                    camera.updateStatus()
+
+    # Record all live streams including their pre-roll; called from the File
+    # menu and the R key.
+    def recordStreams(self, event=None):
+        for camera in self.camera_list:
+            camera.recordStream()
+
+    # Called by each camera when it has displayed its first image; reports the
+    # time from startup to a fully painted first page.
+    def cameraPainted(self, camera):
+        if self.cameras_painted is None:
+            return
+        self.cameras_painted.add(camera)
+        if len(self.cameras_painted) == min(self.page_size,
+                                            len(self.camera_list)):
+            self.cameras_painted = None
+            print(f"Camera images painted {time.monotonic() - STARTED:.2f} "
+                  "seconds after start.")
+
+    # Called on the retention thread after expired videos have been deleted.
+    def archiveExpired(self, text):
+        if self.archive_line is not None:
+            self.dispatcher.post(self.archive_line.configure, {'text': text})
+
+    # Called by download threads once per second while downloading.
+    def downloadProgress(self, stats):
+        self.dispatcher.post(self.download_line.configure,
+                             {'text': f"Downloads: {stats['active']} active, "
+                              f"{stats['queued']} queued, {stats['done']} done"
+                              f", {stats['failed']} failed, "
+                              f"{stats['bytes'] / 1e6:.1f} MB at "
+                              f"{stats['rate'] / 1e6:.2f} MB/s"})
+
+    # Called on the core's event loop after the media library has been
+    # refreshed.
+    def mediaLibraryRefreshed(self, stats):
+        site = f" of {stats['site']}" if stats['site'] else ''
+        self.dispatcher.post(self.status_line.configure,
+                             {'text': f"Media library{site}: "
+                              f"{stats['refreshes']} refreshes, "
+                              f"{stats['motion_events']} motion events, "
+                              f"{stats['calls_per_event']:.2f} cloud calls "
+                              "per motion event, next refresh in "
+                              f"{stats['interval']:.0f} seconds"})
+
+#
+# Live wall of local video files or RTSP urls; runs without the Arlo cloud to
+# test the live wall and measure its decode throughput.
+#
+class LiveWallWindow:
+
+    def __init__(self, sources: list, max_display_fps: int):
+        self.window = tkinter.Tk()
+        self.window.title("Arlo Live Wall")
+        self.dispatcher = TkDispatcher(self.window)
+        self.wall = LiveWall(self.dispatcher, max_display_fps)
+        no_columns, no_rows, image_size = grid_layout(self.window,
+                                                      len(sources))
+        self.labels = []
+        self.images = [None] * len(sources)
+        self.running = len(sources)
+        started = time.monotonic()
+        stream_ids = []
+        for i, source in enumerate(sources):
+            frame = tkinter.LabelFrame(self.window, text=source,
+                                       labelanchor='n')
+            label = tkinter.Label(frame)
+            label.grid(column=0, row=0)
+            frame.grid(column=i%no_columns, row=i//no_columns, padx=5, pady=5)
+            self.labels.append(label)
+            stream_ids.append(self.wall.add(source, image_size,
+                                            lambda image, i=i:
+                                                self.display(i, image),
+                                            self.ended))
+        self.window.mainloop()
+        elapsed = time.monotonic() - started
+        stats = self.wall.stats()
+        self.wall.close()
+        self.dispatcher.close()
+        total = 0
+        for source, stream_id in zip(sources, stream_ids):
+            frames, fps = stats.get(stream_id, (0, 0.0))
+            total += frames
+            print(f"{source}: {frames} frames decoded, {fps:.1f} fps")
+        print(f"Total: {total} frames in {elapsed:.1f} seconds, "
+              f"{total / elapsed:.1f} fps")
+
+    def display(self, i, image):
+        self.images[i] = image
+        self.labels[i].configure(image=image)
+
+    # Close window when all streams have ended.
+    def ended(self):
+        self.running -= 1
+        if self.running == 0:
+            self.window.destroy()
+
+# Helper class that redirects TFA query to GUI. pyaarlo asks for the code on
+# the thread that connects; with a window, the dialog runs on its Tk thread.
+# The dialog names the account, if given.
+class TFAgetCode:
+
+    def __init__(self, window=None, dispatcher=None, account: str = None):
+        self.window = window
+        self.dispatcher = dispatcher
+        self.account = account
+
     def start(self) -> bool:
         return True
 
     # Function to ask TFA code that user receives in text messsage or e-mail.
     def get(self) -> str:
-        win = tkinter.Tk()
-        win.withdraw()
-        tfa_code = simpledialog.askstring('Security Code', 'Enter code',
+        if self.dispatcher is None:
+            return self.ask()
+        answer = queue.Queue(1)
+        self.dispatcher.post(lambda: answer.put(self.ask()))
+        return answer.get()
+
+    # Ask code in a dialog; called on the Tk thread.
+    def ask(self) -> str:
+        win = self.window
+        if win is None:
+            win = tkinter.Tk()
+            win.withdraw()
+        prompt = f'Enter code for {self.account}' if self.account else \
+                 'Enter code'
+        tfa_code = simpledialog.askstring('Security Code', prompt,
                                           parent=win)
         while tfa_code is not None and \
               (len(tfa_code) != 6 or not tfa_code.isdigit()):
             tfa_code = simpledialog.askstring('Security Code',
-                f"Invalid code '{TFA_code}'. Enter 6-digit verification code",
+                f"Invalid code '{tfa_code}'. Enter 6-digit verification code",
                                               parent=win)
-        win.destroy()
+        if win is not self.window:
+            win.destroy()
         return tfa_code
 
     def stop(self) -> None:
@@ -540,6 +4741,18 @@ if __name__ == '__main__':
                                          "authorization method; supported: "
                                     f"'{TFA_EMAIL_TYPE}' and '{TFA_SMS_TYPE}'.")
 
+    def regionCheck(arg: str) -> tuple:
+        try:
+            camera, coordinates = arg.rsplit(':', 1)
+            x0, y0, x1, y1 = map(float, coordinates.split(','))
+            if 0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1:
+                return camera, (x0, y0, x1, y1)
+        except ValueError:
+            pass
+        raise argparse.ArgumentTypeError(f"'{arg}' is not a region of the form "
+                                         "CAMERA:X0,Y0,X1,Y1 with 0 <= X0 < X1 "
+                                         "<= 1 and 0 <= Y0 < Y1 <= 1.")
+
     parser = argparse.ArgumentParser()
     parser.add_argument('--username', '-u',
                         help='Arlo username (usually e-mail address).')
@@ -549,11 +4762,191 @@ if __name__ == '__main__':
                         "e-mail or text message, supported values "
                         f"'{TFA_EMAIL_TYPE}' and '{TFA_SMS_TYPE}'; "
                         f"default '{TFA_EMAIL_TYPE}'.")
+    parser.add_argument('--accounts', metavar='FILE',
+                        help='Monitor the Arlo accounts in FILE, too, in this '
+                        'process with one camera grid; each line holds user '
+                        "name, password, and optionally 'EMAIL' or 'SMS' for "
+                        'two-factor-authorization.')
+    parser.add_argument('--max-display-fps', type=int,
+                        default=Camera.MAX_DISPLAY_FPS,
+                        help='Maximum frame rate for displaying video streams; '
+                        f'default {Camera.MAX_DISPLAY_FPS}.')
+    parser.add_argument('--page-size', type=int, metavar='CAMERAS',
+                        default=ArloWindow.PAGE_SIZE,
+                        help='Show at most CAMERAS cameras at once; Page Up '
+                        'and Page Down switch between pages of cameras; '
+                        f'default {ArloWindow.PAGE_SIZE}.')
+    parser.add_argument('--wall-sources', nargs='+', metavar='SOURCE',
+                        help='Show live wall of local video files or RTSP '
+                        'urls without connecting to the Arlo cloud; prints '
+                        'decode throughput when all streams have ended.')
+    parser.add_argument('--download-workers', type=int,
+                        default=DownloadEngine.WORKERS,
+                        help='Number of videos downloaded in parallel; '
+                        f'default {DownloadEngine.WORKERS}.')
+    parser.add_argument('--max-download-rate', type=float, metavar='KBPS',
+                        help='Limit total download bandwidth to KBPS '
+                        'kilobytes per second; default unlimited.')
+    parser.add_argument('--max-video-age', type=float, metavar='DAYS',
+                        help='Delete downloaded videos older than DAYS days; '
+                        'default keep all videos.')
+    parser.add_argument('--max-archive-size', type=float, metavar='GB',
+                        help='Delete oldest downloaded videos when all videos '
+                        'take more than GB gigabytes; default unlimited.')
+    parser.add_argument('--camera-quota', type=float, metavar='GB',
+                        help="Delete a camera's oldest downloaded videos when "
+                        'they take more than GB gigabytes; default unlimited.')
+    parser.add_argument('--index-workers', type=int, metavar='PROCESSES',
+                        default=ArchiveIndexer.WORKERS,
+                        help='Processes that extract thumbnails and contact '
+                        'strips of downloaded videos; 0 disables; default '
+                        'half the number of cores.')
+    parser.add_argument('--timelapse', nargs=2, metavar=('CAMERA', 'DATE'),
+                        help="Make a timelapse of CAMERA's downloaded videos "
+                        'of DATE (YYYY-MM-DD) and a page with their contact '
+                        'strips, print their paths, and exit.')
+    parser.add_argument('--local-motion', action="store_true",
+                        help='Detect motion in live video streams and send '
+                        'notifications for it.')
+    parser.add_argument('--motion-region', action='append', default=[],
+                        type=regionCheck, metavar='CAMERA:X0,Y0,X1,Y1',
+                        help='Detect local motion only in this rectangle of '
+                        "the camera's image; coordinates are fractions of "
+                        'image width and height; may be repeated.')
+    parser.add_argument('--record-motion', action="store_true",
+                        help='Record live video streams while local motion '
+                        'is detected; implies --local-motion.')
+    parser.add_argument('--pre-roll', type=float, metavar='SECONDS',
+                        default=PreRollBuffer.SECONDS,
+                        help='Keep the last SECONDS of live video streams so '
+                        'that recordings start before they are triggered; 0 '
+                        f'disables; default {PreRollBuffer.SECONDS:g}.')
+    parser.add_argument('--pre-roll-memory', type=float, metavar='MB',
+                        default=PreRollBuffer.MAX_BYTES / 2**20,
+                        help='Memory for the pre-roll of each camera in '
+                        'megabytes; default '
+                        f'{PreRollBuffer.MAX_BYTES / 2**20:g}.')
+    parser.add_argument('--post-roll', type=float, metavar='SECONDS',
+                        default=StreamRecorder.POST_ROLL,
+                        help='Keep recording live video streams for SECONDS '
+                        'after motion has ended or the R key was pressed; '
+                        f'default {StreamRecorder.POST_ROLL:g}.')
+    parser.add_argument('--rtsp-transport', choices=['tcp', 'udp'],
+                        default=StreamSession.TRANSPORT,
+                        help='Transport for live video streams; default '
+                        f"'{StreamSession.TRANSPORT}'.")
+    parser.add_argument('--stream-buffer-size', type=int, metavar='KB',
+                        help='Socket buffer size for live video streams in '
+                        'kilobytes; default system default.')
+    parser.add_argument('--stream-open-timeout', type=float, metavar='SECONDS',
+                        default=StreamSession.OPEN_TIMEOUT,
+                        help='Time allowed to open a live video stream; '
+                        f'default {StreamSession.OPEN_TIMEOUT:g}.')
+    parser.add_argument('--stream-read-timeout', type=float, metavar='SECONDS',
+                        default=StreamSession.READ_TIMEOUT,
+                        help='Time without video after which a live video '
+                        'stream is reconnected; default '
+                        f'{StreamSession.READ_TIMEOUT:g}.')
+    parser.add_argument('--notifications', choices=NOTIFICATION_BACKENDS,
+                        default='desktop',
+                        help="Show notifications on the 'desktop', print them "
+                        "on the 'console', or show 'none'; default 'desktop'.")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='Serve metrics in Prometheus format at '
+                        'http://127.0.0.1:PORT/metrics; default off.')
+    parser.add_argument('--metrics-log', type=float, metavar='SECONDS',
+                        help='Print a line of metrics every SECONDS; default '
+                        'off.')
+    parser.add_argument('--journal', metavar='FILE',
+                        help='Append camera events and video lists to event '
+                        'journal FILE for replay.')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='Replay event journal FILE instead of connecting '
+                        'to the Arlo cloud.')
+    parser.add_argument('--replay-speed', type=float, metavar='FACTOR',
+                        default=1.0,
+                        help='Replay events FACTOR times faster than recorded,'
+                        ' 0 for as fast as possible; default 1.')
+    parser.add_argument('--headless', action="store_true",
+                        help='Run without GUI: send notifications and '
+                        'download videos until interrupted; needs --username '
+                        'and --password, --accounts, or --replay.')
     parser.add_argument('--debug', '-d', action="store_true",
                         help='Enable pyaarlo debug messages.')
     args = parser.parse_args()
 
-    if args.username is None or args.password is None:
+    accounts = []
+    if args.accounts is not None:
+        try:
+            with open(args.accounts) as file:
+                accounts = read_accounts(file)
+        except (OSError, ValueError) as e:
+            parser.error(f"{args.accounts}: {e}.")
+        usernames = [account['username'] for account in accounts] + \
+                    ([args.username] if args.username is not None else [])
+        for username in set(usernames):
+            if usernames.count(username) > 1:
+                parser.error(f"Account '{username}' is given twice.")
+
+    if args.headless and args.replay is None and \
+       (args.username is None and not accounts or
+        args.username is not None and args.password is None):
+        parser.error('--headless needs --username and --password or '
+                     '--accounts.')
+
+    Camera.MAX_DISPLAY_FPS = max(1, args.max_display_fps)
+    ArloWindow.PAGE_SIZE = max(1, args.page_size)
+    notifications(NOTIFICATION_BACKENDS[args.notifications])
+    Camera.LOCAL_MOTION = args.local_motion or args.record_motion
+    Camera.RECORD_MOTION = args.record_motion
+    PreRollBuffer.SECONDS = max(0.0, args.pre_roll)
+    PreRollBuffer.MAX_BYTES = int(2**20 * args.pre_roll_memory)
+    StreamRecorder.POST_ROLL = max(0.0, args.post_roll)
+    StreamSession.TRANSPORT = args.rtsp_transport
+    if args.stream_buffer_size:
+        StreamSession.BUFFER_SIZE = 1024 * args.stream_buffer_size
+    StreamSession.OPEN_TIMEOUT = args.stream_open_timeout
+    StreamSession.READ_TIMEOUT = args.stream_read_timeout
+    StreamSession.configure()
+    for camera, region in args.motion_region:
+        MotionDetector.REGIONS.setdefault(camera, []).append(region)
+    if args.metrics_port is not None or args.metrics_log:
+        metrics().enable(args.metrics_port, args.metrics_log)
+
+    if args.wall_sources:
+        LiveWallWindow(args.wall_sources, Camera.MAX_DISPLAY_FPS)
+        sys.exit(0)
+
+    ArchiveIndexer.WORKERS = max(0, args.index_workers)
+    if args.timelapse:
+        camera, day = args.timelapse
+        try:
+            day = datetime.date.fromisoformat(day)
+        except ValueError:
+            parser.error(f"'{day}' is not a date of the form YYYY-MM-DD.")
+        video_index().reconcile()
+        indexer = ArchiveIndexer(video_index(),
+                                 workers=max(1, ArchiveIndexer.WORKERS))
+        paths = indexer.timelapse(camera, day)
+        indexer.close()
+        if paths is None:
+            print(f"No downloaded videos of '{camera}' on {day}.")
+            sys.exit(1)
+        print(f"Timelapse: {paths[0]}\nPage: {paths[1]}")
+        sys.exit(0)
+
+    if args.replay is not None:
+        # Media library refreshes, battery checks, and notification
+        # coalescing keep pace with the replay.
+        scale = 1 / args.replay_speed if args.replay_speed > 0 else 0.001
+        MediaScheduler.MIN_INTERVAL *= scale
+        MediaScheduler.PENDING_INTERVAL *= scale
+        MediaScheduler.IDLE_INTERVAL *= scale
+        CameraMonitor.BATTERY_UPDATE_INTERVAL *= scale
+        NotificationDispatcher.COALESCE_WINDOW *= scale
+        NotificationDispatcher.MIN_INTERVAL *= scale
+    elif args.username is None and not accounts or \
+         args.username is not None and args.password is None:
         # Missing user name or password; invoke GUI to ask credentials.
         args.username, args.password, args.tfa = \
             ArloCredentials(args.username, args.password, args.tfa).credentials
@@ -567,6 +4960,33 @@ if __name__ == '__main__':
                  format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         _LOGGER = logging.getLogger('pyaarlo')
 
-    ArloWindow(username=args.username, password=args.password,
-               verbose_debug=args.debug, mqtt_hostname_check=False, backend="sse",
-               tfa_type=args.tfa)
+    # The account given by --username keeps its session in BASE_DIRECTORY;
+    # the others have directories of their own.
+    if args.username is not None:
+        accounts.insert(0, {'username': args.username,
+                            'password': args.password,
+                            'tfa_type': args.tfa})
+    options = dict(accounts=accounts, verbose_debug=args.debug,
+                   mqtt_hostname_check=False, backend="sse",
+                   download_workers=args.download_workers,
+                   max_download_rate=1000 * args.max_download_rate
+                                     if args.max_download_rate else None,
+                   max_video_age=24 * 3600 * args.max_video_age
+                                 if args.max_video_age else None,
+                   max_archive_size=int(1e9 * args.max_archive_size)
+                                    if args.max_archive_size else None,
+                   camera_quota=int(1e9 * args.camera_quota)
+                                if args.camera_quota else None,
+                   journal=args.journal, maintain_archive=True)
+    if args.replay is not None:
+        options['arlo'] = JournalArlo(args.replay, max(0.0, args.replay_speed))
+
+    if args.headless:
+        # Security code is read from the console.
+        core = ArloCore(**options)
+        if core.is_connected:
+            core.run()
+        else:
+            core.shutdown()
+    else:
+        ArloWindow(**options)
@@ -0,0 +1,1047 @@
+#!/usr/bin/env python3
+
+#
+# Benchmarks for arlo.py; they run without an Arlo account.
+#
+import argparse, datetime, http.server, io, json, os, platform, queue, shutil
+import socketserver, statistics, subprocess, sys, tempfile, threading, time
+import tkinter
+
+import cv2 # install with "pip install opencv-python"; on Ubuntu install with "sudo apt install -y python3-opencv"
+import numpy # installed along with opencv-python
+from PIL import Image
+
+from arlo import (BASE_DIRECTORY, ArchiveIndexer, ArloCore, ArloWindow,
+                  CachedCamera, Camera, CameraMonitor, DownloadEngine,
+                  HealthHistory, MotionDetector, Notification,
+                  NullNotificationBackend, SessionCache, SnapshotDecoder,
+                  StreamSession, VideoIndex, notifications)
+from simulated_arlo import SimulatedArlo, parse_events, storm_events
+
+# arlo.py next to this file; started by the startup benchmarks.
+ARLO_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'arlo.py')
+
+# Size camera images are scaled to before motion detection, as in the GUI.
+IMAGE_SIZE = (640, 480)
+
+# Size of camera images in a grid of 16 cameras on a 1920x1080 screen.
+TILE_SIZE = (460, 259)
+
+# Run the motion detector over recorded clips the way Camera.streamThread runs
+# it over live streams. Reports the frame rate the detector sustains on one
+# core, the frame rate of decoding, scaling, and detecting together, and the
+# motion events found.
+def motion_benchmark(clips: list) -> bool:
+    cv2.setNumThreads(1) # measure on one core
+    ok = True
+    for clip in clips:
+        cap = cv2.VideoCapture(clip)
+        if not cap.isOpened():
+            print(f"{clip}: cannot open.")
+            ok = False
+            continue
+        fps = cap.get(cv2.CAP_PROP_FPS) or Camera.DEFAULT_STREAM_FPS
+        detector = MotionDetector()
+        events = []
+        frames = 0
+        detecting = 0.0
+        started = time.perf_counter()
+        video_frame = None
+        while True:
+            retval, video_frame = cap.read(video_frame)
+            if not retval:
+                break
+            height, width = video_frame.shape[:2]
+            factor = min(IMAGE_SIZE[0] / width, IMAGE_SIZE[1] / height)
+            scaled_frame = cv2.resize(video_frame, (int(width * factor),
+                                                    int(height * factor)),
+                                      interpolation=cv2.INTER_AREA)
+            detect_started = time.perf_counter()
+            if detector.update(scaled_frame):
+                events.append(frames / fps)
+            detecting += time.perf_counter() - detect_started
+            frames += 1
+        elapsed = time.perf_counter() - started
+        cap.release()
+        if frames == 0:
+            print(f"{clip}: no frames.")
+            ok = False
+            continue
+        print(f"{clip}: {frames} frames {width}x{height} at {fps:.1f} fps")
+        print(f"  detector: {frames / detecting:.0f} fps, "
+              f"{1000 * detecting / frames:.2f} ms per frame, "
+              f"{frames / detecting / fps:.0f}x real time")
+        print(f"  decode, scale, and detect: {frames / elapsed:.0f} fps, "
+              f"{frames / elapsed / fps:.1f}x real time")
+        print(f"  motion detected {MotionDetector.MIN_FRAMES} frames "
+              f"({1000 * MotionDetector.MIN_FRAMES / fps:.0f} ms) after it "
+              "starts; motion at " +
+              (', '.join(f'{t:.1f}' for t in events) + ' seconds'
+               if events else 'no time'))
+        ok = ok and frames / elapsed >= fps
+    return ok
+
+#
+# HTTP server that plays a video file in real time as a stand-in for an Arlo
+# live stream. Every connection is cut after DROP_AFTER seconds: odd ones are
+# closed, even ones stall, i.e. stay open without sending data.
+#
+class FlakyStreamServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, path: str, duration: float, drop_after: float,
+                 stall: float):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.rate = len(self.data) / duration # bytes per second
+        self.drop_after = drop_after
+        self.stall = stall
+        self.connections = 0
+        self.stopped = threading.Event()
+        super().__init__(('127.0.0.1', 0), FlakyStreamHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/stream.avi'
+
+    def close(self) -> None:
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+class FlakyStreamHandler(http.server.BaseHTTPRequestHandler):
+
+    CHUNK_SIZE = 16384
+
+    def do_GET(self):
+        server = self.server
+        server.connections += 1
+        stall = server.connections % 2 == 0
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/x-msvideo')
+        self.end_headers()
+        started = time.monotonic()
+        sent = 0
+        while sent < len(server.data):
+            if time.monotonic() - started > server.drop_after:
+                if stall:
+                    server.stopped.wait(server.stall)
+                return
+            chunk = server.data[sent:sent + self.CHUNK_SIZE]
+            try:
+                self.wfile.write(chunk)
+            except OSError:
+                return
+            sent += len(chunk)
+            if server.stopped.wait(len(chunk) / server.rate):
+                return
+
+    def log_message(self, format, *args):
+        pass
+
+# Copy clip to a Motion-JPEG AVI file, which can be read while it is being
+# received; returns the copy's path and duration.
+def streamable_copy(clip: str) -> tuple:
+    cap = cv2.VideoCapture(clip)
+    fps = cap.get(cv2.CAP_PROP_FPS) or Camera.DEFAULT_STREAM_FPS
+    fd, path = tempfile.mkstemp(suffix='.avi')
+    os.close(fd)
+    writer = None
+    frames = 0
+    while True:
+        retval, frame = cap.read()
+        if not retval:
+            break
+        if writer is None:
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'),
+                                     fps, (frame.shape[1], frame.shape[0]))
+        writer.write(frame)
+        frames += 1
+    cap.release()
+    if writer is not None:
+        writer.release()
+    return path, frames / fps
+
+# Read a clip through StreamSession from a FlakyStreamServer for the given
+# number of seconds; reports frames received, time to first frame, stalls,
+# reconnects, and stream urls requested.
+def stream_benchmark(clip: str, seconds: float, drop_after: float) -> bool:
+    path, duration = streamable_copy(clip)
+    if duration == 0:
+        print(f"{clip}: no frames.")
+        os.remove(path)
+        return False
+    server = FlakyStreamServer(path, duration, drop_after,
+                               StreamSession.READ_TIMEOUT + 1)
+    urls = []
+    def start_stream():
+        urls.append(server.url)
+        return server.url
+    session = StreamSession(start_stream)
+    frames = 0
+    ttffs = []
+    timer = threading.Timer(seconds, session.close)
+    timer.start()
+    started = time.monotonic()
+    frame = None
+    while True:
+        retval, frame = session.read(frame)
+        if not retval:
+            break
+        frames += 1
+        stats = session.stats()
+        if len(ttffs) <= stats['reconnects'] and stats['ttff'] is not None:
+            ttffs.append(stats['ttff'])
+    elapsed = time.monotonic() - started
+    timer.cancel()
+    session.release()
+    server.close()
+    os.remove(path)
+    stats = session.stats()
+    print(f"{clip}: {frames} frames in {elapsed:.1f} seconds over "
+          f"{server.connections} connections cut after {drop_after:g} s")
+    print(f"  time to first frame {1000 * stats['first_ttff']:.0f} ms, "
+          f"after reconnect {1000 * max(ttffs[1:], default=0):.0f} ms max")
+    print(f"  {stats['stalls']} stalls, {stats['reconnects']} reconnects, "
+          f"{len(urls)} stream urls requested")
+    return frames > 0 and stats['reconnects'] > 0
+
+# Index of an empty video archive in directory; cores started by benchmarks
+# use it instead of the user's archive.
+def scratch_index(directory: str) -> VideoIndex:
+    videos = os.path.join(directory, 'Videos')
+    os.makedirs(videos, exist_ok=True)
+    return VideoIndex(os.path.join(directory, 'index.sqlite'), videos)
+
+# Resident memory of this process in bytes or None if not known.
+def resident_memory() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError): # not Linux
+        return None
+
+#
+# Camera grid of simulated cameras. Measures the time until the first page is
+# painted, the time to show each further page, and the time to rescale the
+# images after a resize, then closes the window.
+#
+class GridBenchmarkWindow(ArloWindow):
+
+    def __init__(self, cameras: int, index: VideoIndex):
+        self.started = time.monotonic()
+        self.memory_before = resident_memory()
+        self.startup = None
+        self.page_times = []
+        self.resize_time = None
+        super().__init__(arlo=SimulatedArlo(cameras), index=index)
+
+    def cameraPainted(self, camera):
+        super().cameraPainted(camera)
+        if self.cameras_painted is None and self.startup is None:
+            self.startup = time.monotonic() - self.started
+            self.memory_startup = resident_memory()
+            self.window.after(1, self.nextPage)
+
+    # Show the next page, or rescale the last page when all pages are done.
+    def nextPage(self):
+        if self.page + 1 < self.pages:
+            self.waitPainted(time.monotonic(), self.page_times.append)
+            self.showPage(self.page + 1)
+        else:
+            self.waitPainted(time.monotonic(), self.resized)
+            self.image_size = (self.image_size[0] // 2,
+                               self.image_size[1] // 2)
+            for camera in self.visibleCameras():
+                camera.resize(self.image_size)
+
+    # Call done with the elapsed time once all visible cameras show their
+    # newest snapshot.
+    def waitPainted(self, started, done):
+        if all(camera.snapshots_shown == camera.snapshots_requested
+               for camera in self.visibleCameras()):
+            done(time.monotonic() - started)
+            if done == self.page_times.append:
+                self.window.after(1, self.nextPage)
+        else:
+            self.window.after(1, self.waitPainted, started, done)
+
+    def resized(self, elapsed):
+        self.resize_time = elapsed
+        self.memory_end = resident_memory()
+        self.window.destroy()
+
+# Start the GUI with simulated cameras and report startup time, page and
+# resize repaint times, and memory.
+def grid_benchmark(cameras: int) -> bool:
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            window = GridBenchmarkWindow(cameras, scratch_index(directory))
+        except tkinter.TclError as e: # e.g. no display; try xvfb-run
+            print(f"Cannot open camera grid: {e}.")
+            return False
+    if window.startup is None:
+        print('Camera grid was closed before it was painted.')
+        return False
+    stats = window.snapshot_decoder.stats()
+    mb = lambda size: f'{size / 2**20:.0f} MB' if size is not None else 'n/a'
+    print(f"{cameras} simulated cameras, {window.pages} pages of "
+          f"{window.page_size}")
+    print(f"  first page painted after {1000 * window.startup:.0f} ms")
+    if window.page_times:
+        print(f"  further pages painted after "
+              f"{1000 * sum(window.page_times) / len(window.page_times):.0f}"
+              f" ms on average, {1000 * max(window.page_times):.0f} ms max")
+    print(f"  images rescaled after {1000 * window.resize_time:.0f} ms")
+    print(f"  {stats['decoded']} snapshots decoded, {stats['hits']} cache hits")
+    print(f"  resident memory {mb(window.memory_before)} before start, "
+          f"{mb(window.memory_startup)} after first page, "
+          f"{mb(window.memory_end)} at end")
+    return True
+
+# Start arlo.py replaying the journal at journal_path; returns the seconds from
+# starting the process until the first page is painted and until it has
+# connected, then ends the process.
+def first_paint(journal_path: str, home: str, timeout: float = 60.0) -> tuple:
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, '-u', ARLO_PY, '--replay',
+                                journal_path, '--notifications', 'none'],
+                               stdout=subprocess.PIPE, text=True,
+                               env={**os.environ, 'HOME': home,
+                                    'USERPROFILE': home})
+    lines = queue.Queue() # lines of output, None when it has ended
+    threading.Thread(target=lambda: [lines.put(line) for line
+                                     in [*process.stdout, None]],
+                     daemon=True).start()
+    painted = connected = None
+    try:
+        while painted is None or connected is None:
+            line = lines.get(timeout=max(0.0, started + timeout -
+                                              time.monotonic()))
+            if line is None:
+                raise RuntimeError('arlo.py exited with status '
+                                   f'{process.wait()}')
+            if line.startswith('Camera images painted'):
+                painted = time.monotonic() - started
+            elif line.startswith('Connected.'):
+                connected = time.monotonic() - started
+    except queue.Empty:
+        raise RuntimeError('arlo.py did not paint its window within '
+                           f'{timeout:.0f} seconds') from None
+    finally:
+        process.terminate()
+        process.wait()
+    return painted, connected
+
+# Time from starting arlo.py to its first painted page, without and with the
+# cameras of the previous session cached; needs a display. arlo.py replays a
+# journal of simulated cameras, so no Arlo account is needed; the cache holds
+# their snapshots. arlo.py runs with a scratch home directory, so it keeps its
+# cache and archive there. Also reports the time arlo.py takes to import.
+def startup_benchmark(cameras: int, runs: int) -> bool:
+    notifications(NullNotificationBackend)
+    with tempfile.TemporaryDirectory() as directory:
+        journal_path = os.path.join(directory, 'startup.journal')
+        arlo = SimulatedArlo(cameras)
+        home = os.path.join(directory, 'home')
+        core = ArloCore(arlo=arlo, journal=journal_path,
+                        index=scratch_index(directory))
+        core.start()
+        core.close()
+        cache = SessionCache('replay:' + os.path.abspath(journal_path),
+                             os.path.join(home, os.path.relpath(
+                                 BASE_DIRECTORY, os.path.expanduser('~'))))
+        try:
+            cold = []
+            for run in range(runs):
+                shutil.rmtree(cache.directory, ignore_errors=True)
+                cold.append(first_paint(journal_path, home))
+            cache.save([CachedCamera(camera.device_id, camera.name,
+                                     camera.model_id, camera.battery_level,
+                                     camera.last_image_from_cache)
+                        for camera in arlo.cameras], {'page': 0})
+            warm = [first_paint(journal_path, home) for run in range(runs)]
+        except RuntimeError as e:
+            print(f"{e}.")
+            return False
+        finally:
+            shutil.rmtree(cache.directory, ignore_errors=True)
+    imported = import_benchmark()
+    median = lambda times: 1000 * statistics.median(times)
+    print(f"{cameras} simulated cameras, median of {runs} runs")
+    print(f"  import {imported['import_ms']:.0f} ms, heavy modules "
+          f"imported: {imported['heavy_modules'] or 'none'}")
+    print(f"  without cache: painted after "
+          f"{median([painted for painted, connected in cold]):.0f} ms, "
+          f"connected after "
+          f"{median([connected for painted, connected in cold]):.0f} ms")
+    print(f"  with cache: painted after "
+          f"{median([painted for painted, connected in warm]):.0f} ms, "
+          f"connected after "
+          f"{median([connected for painted, connected in warm]):.0f} ms")
+    return True
+
+# Calls functions right away; stands in for TkDispatcher without a GUI.
+class DirectDispatcher:
+
+    def post(self, function, *args) -> None:
+        function(*args)
+
+# Value below which the given percentage of values lie.
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+# Write a clip of a moving white rectangle on a gray background of given shade
+# to a Motion-JPEG AVI file; returns its path.
+def synthetic_clip(seconds: float = 10.0, size: tuple = (1280, 720),
+                   fps: float = 25.0, shade: int = 64) -> str:
+    fd, path = tempfile.mkstemp(suffix='.avi')
+    os.close(fd)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    width, height = size
+    frame = numpy.empty((height, width, 3), numpy.uint8)
+    for i in range(int(seconds * fps)):
+        frame[:] = shade
+        x = int((width - width // 8) * i / (seconds * fps))
+        frame[height // 3:2 * height // 3, x:x + width // 8] = 255
+        writer.write(frame)
+    writer.release()
+    return path
+
+# Read the live stream of a simulated camera that plays clip and scale and
+# convert its frames the way Camera.streamThread does.
+def stream_decode_benchmark(clip: str) -> dict:
+    probe = cv2.VideoCapture(clip)
+    length = int(probe.get(cv2.CAP_PROP_FRAME_COUNT)) or 300
+    probe.release()
+    camera = SimulatedArlo(1, stream_url=clip).cameras[0]
+    session = StreamSession(camera.start_stream)
+    video_frame = scaled_frame = rgb_frame = None
+    frames = 0
+    started = time.perf_counter()
+    while frames < length: # the session would replay the clip forever
+        retval, video_frame = session.read(video_frame)
+        if not retval:
+            break
+        height, width = video_frame.shape[:2]
+        factor = min(IMAGE_SIZE[0] / width, IMAGE_SIZE[1] / height)
+        size = (int(width * factor), int(height * factor))
+        if scaled_frame is None or scaled_frame.shape[1::-1] != size:
+            scaled_frame = numpy.empty((size[1], size[0], 3), numpy.uint8)
+            rgb_frame = numpy.empty_like(scaled_frame)
+        cv2.resize(video_frame, size, dst=scaled_frame,
+                   interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(scaled_frame, cv2.COLOR_BGR2RGB, dst=rgb_frame)
+        frames += 1
+    elapsed = time.perf_counter() - started
+    stats = session.stats()
+    session.release()
+    if frames == 0:
+        raise RuntimeError(f"no frames in '{clip}'")
+    return {
+        'frames'      : frames,
+        'width'       : width,
+        'height'      : height,
+        'fps'         : frames / elapsed,
+        'ms_per_frame': 1000 * elapsed / frames,
+        'ttff_ms'     : 1000 * stats['first_ttff']
+    }
+
+# Decode the snapshots of simulated cameras to TILE_SIZE with the snapshot
+# decoder: one at a time for latency, all at once as at startup, and again
+# from the cache. For comparison, also decode them all the way Camera did
+# before there was a snapshot decoder: in full, one after the other on the
+# Tk thread.
+def snapshot_decode_benchmark(cameras: int) -> dict:
+    images = [camera.last_image_from_cache
+              for camera in SimulatedArlo(cameras).cameras]
+    started = time.perf_counter()
+    for data in images:
+        with io.BytesIO(data) as file:
+            image = Image.open(file)
+            image.load()
+        factor = min(TILE_SIZE[0] / image.width, TILE_SIZE[1] / image.height)
+        image.resize((int(image.width * factor), int(image.height * factor)))
+    inline = time.perf_counter() - started
+    def decode(decoder, parallel):
+        latencies = []
+        done = threading.Semaphore(0)
+        def request(data):
+            requested = time.perf_counter()
+            def display(image):
+                latencies.append(time.perf_counter() - requested)
+                done.release()
+            decoder.decode(data, TILE_SIZE, display)
+        started = time.perf_counter()
+        for data in images:
+            request(data)
+            if not parallel:
+                done.acquire()
+        if parallel:
+            for _ in images:
+                done.acquire()
+        return latencies, time.perf_counter() - started
+    decoder = SnapshotDecoder(DirectDispatcher())
+    latencies, _ = decode(decoder, False)
+    cached, _ = decode(decoder, False)
+    decoder.close()
+    decoder = SnapshotDecoder(DirectDispatcher())
+    _, burst = decode(decoder, True)
+    decoder.close()
+    return {
+        'snapshots'        : len(images),
+        'latency_ms_median': 1000 * statistics.median(latencies),
+        'latency_ms_p95'   : 1000 * percentile(latencies, 95),
+        'cached_ms_median' : 1000 * statistics.median(cached),
+        'all_cameras_ms'   : 1000 * burst,
+        'snapshots_per_sec': len(images) / burst,
+        'inline_all_ms'    : 1000 * inline
+    }
+
+# Match motion notifications to videos with CameraMonitor.matchMotionVideos
+# for simulated cameras that each have events notifications waiting and the
+# videos for them in the media library.
+def motion_matching_benchmark(cameras: int, events: int) -> dict:
+    arlo = SimulatedArlo(cameras)
+    now = time.time()
+    spacing = (CameraMonitor.MOTION_EXPIRATION - 60) / events
+    with tempfile.TemporaryDirectory() as directory:
+        # Not started; provides the monitors.
+        core = ArloCore(arlo=arlo, index=scratch_index(directory))
+        monitors = []
+        for camera in arlo.cameras:
+            monitor = core.monitors[core.sites[0], camera.device_id]
+            for i in reversed(range(events)): # oldest first, as recorded
+                when = now - i * spacing
+                monitor.motion_notices.add(when, Notification(None,
+                                           "Motion detected.",
+                                           f"Motion detected at "
+                                           f"{camera.name}."))
+                arlo.addVideo(camera, when + 1.0)
+            monitors.append(monitor)
+        arlo.ml.update()
+        started = time.perf_counter()
+        for monitor in monitors:
+            monitor.matchMotionVideos()
+        elapsed = time.perf_counter() - started
+        core.download_engine.close()
+        core.retention.close()
+    matched = sum(events - len(monitor.motion_notices)
+                  for monitor in monitors)
+    return {
+        'notifications'  : cameras * events,
+        'matched'        : matched,
+        'ms_per_camera'  : 1000 * elapsed / cameras,
+        'matches_per_sec': matched / elapsed
+    }
+
+#
+# HTTP server that serves size bytes for every request; stands in for the
+# Arlo video servers.
+#
+class VideoServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, size: int):
+        self.data = os.urandom(size)
+        super().__init__(('127.0.0.1', 0), VideoHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/video.mp4'
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+class VideoHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(len(self.server.data)))
+        self.end_headers()
+        try:
+            self.wfile.write(self.server.data)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+# Download the videos of a simulated camera from a local server with the
+# download engine into a temporary directory.
+def download_benchmark(videos: int, size: int) -> dict:
+    server = VideoServer(size)
+    arlo = SimulatedArlo(1, video_url=server.url)
+    camera = arlo.cameras[0]
+    now = time.time()
+    for i in reversed(range(videos)):
+        arlo.addVideo(camera, now - 60 * i)
+    arlo.ml.update()
+    engine = DownloadEngine()
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        for i, video in enumerate(camera.last_n_videos(videos)):
+            engine.queue(video.video_url, os.path.join(directory, f'{i}.mp4'))
+        while True:
+            stats = engine.stats()
+            if stats['done'] + stats['failed'] >= videos:
+                break
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+    engine.close()
+    server.close()
+    return {
+        'videos'    : videos,
+        'failed'    : stats['failed'],
+        'mb'        : stats['bytes'] / 2**20,
+        'mb_per_sec': stats['bytes'] / 2**20 / elapsed,
+        'workers'   : DownloadEngine.WORKERS
+    }
+
+# Index distinct synthetic clips with one indexer process, then with one per
+# core, then once more, which finds nothing to do, and make a timelapse of
+# them; reports videos indexed per second, the speedup, and the times of the
+# rerun and the timelapse.
+def indexer_benchmark(videos: int) -> dict:
+    workers = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as directory:
+        index = VideoIndex(os.path.join(directory, 'index.sqlite'), directory)
+        now = int(1000 * time.time())
+        for i in range(videos):
+            path = os.path.join(directory, f'{i}.mp4')
+            shutil.move(synthetic_clip(10.0, (640, 360), shade=i), path)
+            index.add('Benchmark', now - 60000 * i, path, 10)
+            index.setState(path, VideoIndex.DONE, os.path.getsize(path))
+        rates = []
+        for run, processes in enumerate([1, workers]):
+            indexer = ArchiveIndexer(index, os.path.join(directory,
+                                                         f'index{run}'),
+                                     processes)
+            index.db.execute('DELETE FROM thumbnails')
+            started = time.perf_counter()
+            indexer.update()
+            indexer.wait()
+            rates.append(videos / (time.perf_counter() - started))
+            if run == 0:
+                indexer.close()
+        started = time.perf_counter()
+        indexer.update()
+        indexer.wait()
+        rerun = time.perf_counter() - started
+        started = time.perf_counter()
+        indexer.timelapse('Benchmark', datetime.date.fromtimestamp(now / 1000))
+        timelapse = time.perf_counter() - started
+        indexer.close()
+        index.db.close()
+    return {
+        'videos'              : videos,
+        'workers'             : workers,
+        'videos_per_sec_1'    : rates[0],
+        'videos_per_sec'      : rates[1],
+        'speedup'             : rates[1] / rates[0],
+        'rerun_ms'            : 1000 * rerun,
+        'timelapse_ms'        : 1000 * timelapse
+    }
+
+# Record days of 15-minute polls of cameras in a health history; batteries
+# drain about 1% a day and are charged every 60 days, and signal strengths
+# change every few hours. Reports the time to record a poll of all cameras,
+# the size of a year of history, and the times to read a camera's last week
+# and to estimate its battery drain.
+def health_benchmark(cameras: int, days: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        health = HealthHistory(directory)
+        started = time.time() - days * 86400
+        polls = days * 86400 // CameraMonitor.BATTERY_UPDATE_INTERVAL
+        recording = time.perf_counter()
+        for poll in range(polls):
+            now = started + poll * CameraMonitor.BATTERY_UPDATE_INTERVAL
+            for camera in range(cameras):
+                day = (now - started) / 86400
+                health.add(f'SIMULATED{camera:04}', now,
+                           100 - int(day % 60 * (0.8 + 0.01 * camera)),
+                           3 + (poll // 16 + camera) % 2,
+                           HealthHistory.AVAILABLE)
+        recording = time.perf_counter() - recording
+        size = sum(entry.stat().st_size for entry in os.scandir(directory))
+        reads, drains = [], []
+        for camera in range(cameras):
+            device_id = f'SIMULATED{camera:04}'
+            read = time.perf_counter()
+            health.records(device_id, now - 7 * 86400)
+            drain = time.perf_counter()
+            health.drain(device_id, CameraMonitor.LOW_BATTERY_THRESHOLD, now)
+            reads.append(drain - read)
+            drains.append(time.perf_counter() - drain)
+    return {
+        'cameras'      : cameras,
+        'days'         : days,
+        'poll_us'      : 1e6 * recording / polls,
+        'mb_per_year'  : size * 365 / days / 1e6,
+        'week_read_ms' : 1000 * statistics.median(reads),
+        'drain_ms'     : 1000 * statistics.median(drains)
+    }
+
+# Start a headless ArloCore on simulated cameras, then replay a motion storm
+# as fast as possible and wait until the core has handled every motion event.
+def core_benchmark(cameras: int, rate: float, seconds: float) -> dict:
+    arlo = SimulatedArlo(cameras)
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        core = ArloCore(arlo=arlo, index=scratch_index(directory))
+        core.start()
+        startup = time.perf_counter() - started
+        events = storm_events(cameras, rate, seconds)
+        motions = sum(event.event == 'motion' and event.value == 'on'
+                      for event in events)
+        before = notifications().stats()
+        started = time.perf_counter()
+        arlo.replay(events, speed=0).join()
+        replayed = time.perf_counter() - started
+        scheduler = core.sites[0].media_scheduler
+        while scheduler.motion_events < motions and \
+              time.perf_counter() - started < 60:
+            time.sleep(0.001)
+        handled = time.perf_counter() - started
+        handled_events = scheduler.motion_events
+        stats = notifications().stats()
+        core.close()
+    return {
+        'startup_ms'    : 1000 * startup,
+        'motion_events' : handled_events,
+        'replay_ms'     : 1000 * replayed,
+        'events_per_sec': handled_events / handled,
+        'notifications' : stats['posted'] - stats['coalesced'] -
+                          before['posted'] + before['coalesced'],
+        'dropped'       : stats['dropped'] - before['dropped']
+    }
+
+# Replay an event script against a headless ArloCore on simulated cameras and
+# report the motion events, notifications, and cloud calls that resulted.
+# Waits for one media library refresh after the script so that videos are
+# matched to their notifications. The events are recorded in the event journal
+# at journal_path if given, for arlo.py --replay.
+def replay_benchmark(script: str, cameras: int, speed: float,
+                     journal_path: str = None) -> bool:
+    with open(script) as f:
+        try:
+            events = parse_events(f)
+        except ValueError as e:
+            print(f"{script}: {e}.")
+            return False
+    notifications(NullNotificationBackend)
+    arlo = SimulatedArlo(cameras)
+    with tempfile.TemporaryDirectory() as directory:
+        core = ArloCore(arlo=arlo, journal=journal_path,
+                        index=scratch_index(directory))
+        core.start()
+        started = time.monotonic()
+        arlo.replay(events, speed).join()
+        replayed = time.monotonic() - started
+        scheduler = core.sites[0].media_scheduler
+        refreshes = scheduler.refreshes
+        if scheduler.motion_events:
+            while scheduler.refreshes == refreshes and scheduler.waiting:
+                time.sleep(0.1)
+        scheduler = scheduler.stats()
+        stats = notifications().stats()
+        core.close()
+    print(f"{script}: {arlo.played} events on {cameras} cameras replayed in "
+          f"{replayed:.1f} seconds")
+    print(f"  {scheduler['motion_events']} motion events, "
+          f"{stats['posted'] - stats['coalesced']} notifications, "
+          f"{stats['coalesced']} coalesced, {stats['dropped']} dropped")
+    print(f"  cloud calls: " + ', '.join(f'{call} {count}' for call, count
+                                         in sorted(arlo.calls.items())))
+    return True
+
+# Resident memory of a new interpreter that runs one core for sites simulated
+# accounts with cameras each, with OpenCV loaded as for live streams; headless
+# and without archive indexing.
+def sites_memory(sites: int, cameras: int) -> int:
+    script = ('import sys, time\n'
+              'import arlo, benchmark\n'
+              'from simulated_arlo import SimulatedArlo\n'
+              'arlo.opencv()\n'
+              'arlo.notifications(arlo.NullNotificationBackend)\n'
+              'sites, cameras = int(sys.argv[1]), int(sys.argv[2])\n'
+              'core = arlo.ArloCore(arlo=[\n'
+              '    SimulatedArlo(cameras, first_camera=i * cameras)\n'
+              '    for i in range(sites)],\n'
+              '    index=benchmark.scratch_index(sys.argv[3]))\n'
+              'core.start()\n'
+              'time.sleep(1.0)\n'
+              'print("RSS", benchmark.resident_memory())\n'
+              'core.close()\n')
+    with tempfile.TemporaryDirectory() as directory:
+        output = subprocess.run([sys.executable, '-c', script, str(sites),
+                                 str(cameras), directory],
+                                cwd=os.path.dirname(ARLO_PY),
+                                capture_output=True, text=True,
+                                check=True).stdout
+    return int(next(line.split()[1] for line in output.split('\n')
+                    if line.startswith('RSS ')))
+
+# Memory of one process that hosts several accounts against that of a process
+# per account; reports the memory of a process with one site, of one process
+# with all sites, of separate processes, and what each further site adds.
+def sites_benchmark(sites: int, cameras: int) -> dict:
+    single = sites_memory(1, cameras)
+    combined = sites_memory(sites, cameras)
+    return {
+        'sites'      : sites,
+        'cameras'    : cameras,
+        'one_site_mb': single / 2**20,
+        'combined_mb': combined / 2**20,
+        'separate_mb': sites * single / 2**20,
+        'per_site_mb': (combined - single) / max(1, sites - 1) / 2**20
+    }
+
+# CPU time and resident memory of a new interpreter that runs a headless core
+# for simulated cameras, as arlo.py --headless does, while nothing happens:
+# measured for seconds after the core has settled for a second.
+def idle_benchmark(cameras: int, seconds: float) -> dict:
+    script = ('import sys, time\n'
+              'import arlo, benchmark\n'
+              'from simulated_arlo import SimulatedArlo\n'
+              'arlo.notifications(arlo.NullNotificationBackend)\n'
+              'cameras, seconds = int(sys.argv[1]), float(sys.argv[2])\n'
+              'core = arlo.ArloCore(arlo=SimulatedArlo(cameras),\n'
+              '    index=benchmark.scratch_index(sys.argv[3]),\n'
+              '    maintain_archive=True)\n'
+              'core.start()\n'
+              'time.sleep(1.0)\n'
+              'cpu, started = time.process_time(), time.monotonic()\n'
+              'time.sleep(seconds)\n'
+              'print("IDLE", time.process_time() - cpu,\n'
+              '      time.monotonic() - started, benchmark.resident_memory())\n'
+              'core.close()\n')
+    with tempfile.TemporaryDirectory() as directory:
+        output = subprocess.run([sys.executable, '-c', script, str(cameras),
+                                 str(seconds), directory],
+                                cwd=os.path.dirname(ARLO_PY),
+                                capture_output=True, text=True,
+                                check=True).stdout
+    cpu, elapsed, memory = next(line.split()[1:] for line
+                                in output.split('\n')
+                                if line.startswith('IDLE '))
+    return {
+        'cameras'        : cameras,
+        'cpu_percent'    : 100 * float(cpu) / float(elapsed),
+        'cpu_ms_per_hour': 1000 * float(cpu) * 3600 / float(elapsed),
+        'rss_mb'         : int(memory) / 2**20
+    }
+
+# Median time to import arlo.py in a new interpreter and the modules it should
+# only import on demand that were imported anyway.
+def import_benchmark(runs: int = 5) -> dict:
+    script = ('import sys, time\n'
+              'started = time.perf_counter()\n'
+              'import arlo\n'
+              'print(time.perf_counter() - started)\n'
+              'print(",".join(module for module in ("cv2", "pyaarlo", "dbus") '
+              'if module in sys.modules))\n')
+    times = []
+    for run in range(runs):
+        output = subprocess.run([sys.executable, '-c', script],
+                                cwd=os.path.dirname(ARLO_PY),
+                                capture_output=True, text=True,
+                                check=True).stdout.split('\n')
+        times.append(float(output[0]))
+    return {
+        'import_ms'    : 1000 * statistics.median(times),
+        'heavy_modules': output[1]
+    }
+
+# Commit of this tree as given by git describe, None outside a git checkout.
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Run all benchmarks that need no display and no Arlo account, print their
+# results and write them to json_path as JSON, '-' for standard output.
+# Returns False if a benchmark failed.
+def suite_benchmark(clip: str, cameras: int, events: int,
+                    json_path: str) -> bool:
+    notifications(NullNotificationBackend)
+    synthetic = clip is None
+    if synthetic:
+        clip = synthetic_clip()
+    benchmarks = [
+        ('stream_decode', lambda: stream_decode_benchmark(clip)),
+        ('snapshot_decode', lambda: snapshot_decode_benchmark(cameras)),
+        ('motion_matching', lambda: motion_matching_benchmark(cameras,
+                                                              events)),
+        ('downloads', lambda: download_benchmark(16, 8 * 2**20)),
+        ('indexer', lambda: indexer_benchmark(
+            max(8, 4 * (os.cpu_count() or 1)))),
+        ('health', lambda: health_benchmark(30, 90)),
+        ('sites', lambda: sites_benchmark(4, 4)),
+        ('idle', lambda: idle_benchmark(cameras, 30)),
+        ('core', lambda: core_benchmark(cameras, 200, 10)), # closes notifications
+        ('import', import_benchmark)
+    ]
+    results = {}
+    ok = True
+    out = sys.stderr if json_path == '-' else sys.stdout
+    for name, benchmark in benchmarks:
+        try:
+            results[name] = benchmark()
+        except Exception as e: # record failure, run the other benchmarks
+            results[name] = { 'error': str(e) }
+            print(f"{name}: failed: {e}.", file=out)
+            ok = False
+            continue
+        print(f"{name}:", file=out)
+        for metric, value in results[name].items():
+            print(f"  {metric}: {value:.4g}" if isinstance(value, float)
+                  else f"  {metric}: {value}", file=out)
+    if synthetic:
+        os.remove(clip)
+    document = {
+        'commit'   : git_commit(),
+        'date'     : datetime.datetime.now().isoformat(timespec='seconds'),
+        'platform' : platform.platform(),
+        'python'   : platform.python_version(),
+        'opencv'   : cv2.__version__,
+        'cpus'     : os.cpu_count(),
+        'clip'     : None if synthetic else clip,
+        'results'  : results
+    }
+    if json_path == '-':
+        json.dump(document, sys.stdout, indent=2)
+        print()
+    elif json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(document, f, indent=2)
+    return ok
+
+# Print the metrics of two suite results side by side with their change.
+def compare_results(old_path: str, new_path: str) -> bool:
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for name, metrics in new['results'].items():
+        old_metrics = old['results'].get(name, {})
+        for metric, value in metrics.items():
+            old_value = old_metrics.get(metric)
+            if not isinstance(value, (int, float)) or \
+               not isinstance(old_value, (int, float)):
+                continue
+            change = f"{100 * (value - old_value) / old_value:+.1f}%" \
+                     if old_value else 'n/a'
+            print(f"{name}.{metric}: {old_value:.4g} -> {value:.4g} "
+                  f"({change})")
+    return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    motion_parser = subparsers.add_parser('motion',
+                        help='Local motion detection on recorded clips; '
+                        'fails if a clip cannot be processed in real time.')
+    motion_parser.add_argument('clips', nargs='+', metavar='CLIP',
+                               help='Video file or RTSP url.')
+    stream_parser = subparsers.add_parser('stream',
+                        help='Live stream reconnects against a local server '
+                        'that cuts connections on purpose.')
+    stream_parser.add_argument('clip', metavar='CLIP', help='Video file.')
+    stream_parser.add_argument('--seconds', type=float, default=30.0,
+                               help='Duration of the benchmark; default 30.')
+    stream_parser.add_argument('--drop-after', type=float, default=4.0,
+                               metavar='SECONDS', help='Cut connections '
+                               'after SECONDS; default 4.')
+    stream_parser.add_argument('--read-timeout', type=float, default=2.0,
+                               metavar='SECONDS', help='Stream read timeout; '
+                               'default 2.')
+    grid_parser = subparsers.add_parser('grid',
+                        help='Startup, repaint, and memory of the camera grid '
+                        'with simulated cameras; needs a display.')
+    grid_parser.add_argument('--cameras', type=int, default=64,
+                             help='Number of simulated cameras; default 64.')
+    grid_parser.add_argument('--page-size', type=int, metavar='CAMERAS',
+                             default=ArloWindow.PAGE_SIZE,
+                             help='Cameras shown at once; default '
+                             f'{ArloWindow.PAGE_SIZE}.')
+    startup_parser = subparsers.add_parser('startup',
+                        help='Time from starting arlo.py to its first painted '
+                        'page without and with cached camera images; needs a '
+                        'display.')
+    startup_parser.add_argument('--cameras', type=int, default=16,
+                                help='Number of simulated cameras; default '
+                                '16.')
+    startup_parser.add_argument('--runs', type=int, default=3,
+                                help='Starts with and without cache; default '
+                                '3.')
+    suite_parser = subparsers.add_parser('suite',
+                        help='Stream decoding, snapshot decoding, motion '
+                        'video matching, downloads, archive indexing, camera '
+                        'health history, memory per account, core startup and '
+                        'event handling with simulated cameras, and import '
+                        'time; results can be saved as JSON.')
+    suite_parser.add_argument('--clip', metavar='CLIP', help='Video file '
+                              'for stream decoding; default a generated '
+                              '720p clip.')
+    suite_parser.add_argument('--cameras', type=int, default=16,
+                              help='Number of simulated cameras; default 16.')
+    suite_parser.add_argument('--events', type=int, default=1000,
+                              help='Motion notifications per camera waiting '
+                              'for videos; default 1000.')
+    suite_parser.add_argument('--json', metavar='FILE', help="Write results "
+                              "as JSON to FILE, '-' for standard output.")
+    compare_parser = subparsers.add_parser('compare',
+                        help='Compare results of two suite runs saved with '
+                        '--json.')
+    compare_parser.add_argument('old', metavar='OLD', help='Earlier results.')
+    compare_parser.add_argument('new', metavar='NEW', help='Later results.')
+    replay_parser = subparsers.add_parser('replay',
+                        help='Replay an event script against simulated '
+                        'cameras.')
+    replay_parser.add_argument('script', metavar='SCRIPT', help='Event '
+                               "script; lines of seconds, camera number or "
+                               "'*', event, and value.")
+    replay_parser.add_argument('--cameras', type=int, default=4,
+                               help='Number of simulated cameras; default 4.')
+    replay_parser.add_argument('--speed', type=float, default=1.0,
+                               help='Replay speed, 0 for as fast as possible;'
+                               ' default 1.')
+    replay_parser.add_argument('--journal', metavar='FILE', help='Record '
+                               'the events in event journal FILE.')
+    args = parser.parse_args()
+
+    if args.benchmark == 'motion':
+        sys.exit(0 if motion_benchmark(args.clips) else 1)
+    elif args.benchmark == 'grid':
+        ArloWindow.PAGE_SIZE = max(1, args.page_size)
+        sys.exit(0 if grid_benchmark(args.cameras) else 1)
+    elif args.benchmark == 'startup':
+        sys.exit(0 if startup_benchmark(max(1, args.cameras),
+                                        max(1, args.runs)) else 1)
+    elif args.benchmark == 'suite':
+        sys.exit(0 if suite_benchmark(args.clip, max(1, args.cameras),
+                                      max(1, args.events), args.json) else 1)
+    elif args.benchmark == 'replay':
+        sys.exit(0 if replay_benchmark(args.script, max(1, args.cameras),
+                                       max(0.0, args.speed), args.journal)
+                 else 1)
+    elif args.benchmark == 'compare':
+        sys.exit(0 if compare_results(args.old, args.new) else 1)
+    elif args.benchmark == 'stream':
+        StreamSession.READ_TIMEOUT = args.read_timeout
+        StreamSession.configure()
+        sys.exit(0 if stream_benchmark(args.clip, args.seconds,
+                                       args.drop_after) else 1)
@@ -0,0 +1,244 @@
+#
+# Simulated Arlo cloud for benchmarks; runs in-process without an Arlo
+# account. SimulatedArlo stands in for pyaarlo.PyArlo and can be passed to
+# ArloCore and ArloWindow as arlo=SimulatedArlo(...). Its cameras have
+# snapshots, a media library, and live streams played from a local video file
+# or RTSP url, and they call the callbacks registered with add_attr_callback()
+# from a thread of their own, as pyaarlo does. Scripts of timed events replay
+# motion, videos, snapshots, and battery changes, e.g. event storms.
+#
+import collections, io, random, threading, time
+from dataclasses import dataclass
+
+import numpy # installed along with opencv-python
+from PIL import Image # install with "pip install Pillow"
+
+from pyaarlo.constant import (BATTERY_KEY, LAST_IMAGE_DATA_KEY,
+                              MOTION_DETECTED_KEY)
+
+# Events of event scripts and the values they take.
+EVENTS = {
+    'motion'  : ('on', 'off'), # motion starts or ends
+    'video'   : (),            # video of the latest motion is recorded
+    'snapshot': (),            # new snapshot arrives
+    'battery' : None           # battery level changes to given percentage
+}
+
+@dataclass
+class SimulatedEvent:
+    time: float  # seconds after start of replay
+    camera: int  # camera number starting at 0, None for all cameras
+    event: str   # one of EVENTS
+    value: str = None
+
+# Parse event script. Each line holds a time in seconds, a camera number
+# starting at 1 or '*' for all cameras, an event, and its value if it has one,
+# e.g. '2.5 3 motion on' or '60 * battery 12'; '#' starts a comment. Raises
+# ValueError for invalid lines.
+def parse_events(lines) -> list:
+    events = []
+    for line_number, line in enumerate(lines, 1):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        try:
+            if len(fields) not in (3, 4):
+                raise ValueError('expected time, camera, event, and value')
+            seconds, camera, event = float(fields[0]), fields[1], fields[2]
+            value = fields[3] if len(fields) == 4 else None
+            if event not in EVENTS:
+                raise ValueError(f"unknown event '{event}'")
+            values = EVENTS[event]
+            if values is None:
+                if value is None or not value.isdigit():
+                    raise ValueError(f"event '{event}' needs a number")
+            elif (value not in values) if values else (value is not None):
+                raise ValueError(f"invalid value for event '{event}'")
+            camera = None if camera == '*' else int(camera) - 1
+        except ValueError as e:
+            raise ValueError(f"line {line_number}: {e}") from None
+        events.append(SimulatedEvent(seconds, camera, event, value))
+    events.sort(key=lambda event: event.time)
+    return events
+
+# Events of a motion storm: motion starts on random cameras at rate events
+# per second for the given number of seconds, ends after motion_duration, and
+# its video appears video_delay seconds after motion starts.
+def storm_events(cameras: int, rate: float, seconds: float,
+                 motion_duration: float = 2.0, video_delay: float = 10.0,
+                 seed: int = 0) -> list:
+    rng = random.Random(seed)
+    events = []
+    for i in range(int(rate * seconds)):
+        start = i / rate
+        camera = rng.randrange(cameras)
+        events += [SimulatedEvent(start, camera, 'motion', 'on'),
+                   SimulatedEvent(start + motion_duration, camera, 'motion',
+                                  'off'),
+                   SimulatedEvent(start + video_delay, camera, 'video')]
+    events.sort(key=lambda event: event.time)
+    return events
+
+@dataclass
+class SimulatedVideo:
+    camera: object
+    created_at: int # milliseconds since the epoch
+    media_duration_seconds: int
+    video_url: str = None
+    thumbnail_url: str = None
+
+#
+# Simulated camera; provides the parts of pyaarlo's ArloCamera that arlo.py
+# uses. Requested snapshots arrive after SNAPSHOT_DELAY seconds.
+#
+class SimulatedCamera:
+
+    IMAGE_SIZE     = (1920, 1080) # snapshot resolution
+    SNAPSHOT_DELAY =          0.5 # seconds from request to snapshot
+    VIDEO_DURATION =           20 # seconds; duration of recorded videos
+
+    def __init__(self, arlo, number: int):
+        self.arlo = arlo
+        self.number = number
+        self.name = f'Camera {number + 1}'
+        self.device_id = f'SIMULATED{number:04}'
+        self.model_id = 'SIMULATED'
+        self.battery_level = 50 + number % 50
+        self.motion_detected = False
+        self.motion_started = None # time.time() when latest motion started
+        self.snapshots = 0
+        self.last_image_from_cache = self.snapshot()
+        self.callbacks = collections.defaultdict(list) # attr -> callbacks
+        self.videos = [] # media library, newest video first
+        self.lock = threading.Lock()
+
+    # JPEG image with a gradient and noise; camera number and snapshot count
+    # set the colors.
+    def snapshot(self) -> bytes:
+        width, height = self.IMAGE_SIZE
+        rng = numpy.random.default_rng((self.number, self.snapshots))
+        gradient = numpy.linspace(0, 160, width, dtype=numpy.float32)
+        image = numpy.empty((height, width, 3), numpy.uint8)
+        for channel, weight in enumerate(rng.uniform(0.3, 1.0, 3)):
+            image[:, :, channel] = weight * gradient
+        image += rng.integers(0, 32, image.shape, dtype=numpy.uint8)
+        with io.BytesIO() as file:
+            Image.fromarray(image).save(file, 'JPEG', quality=85)
+            return file.getvalue()
+
+    def add_attr_callback(self, attr, callback):
+        with self.lock:
+            self.callbacks[attr].append(callback)
+
+    # Change attribute and call its callbacks; pyaarlo calls them with
+    # device, attribute, and value.
+    def setAttr(self, attr: str, value) -> None:
+        if attr == MOTION_DETECTED_KEY:
+            self.motion_detected = value
+        elif attr == BATTERY_KEY:
+            self.battery_level = value
+        elif attr == LAST_IMAGE_DATA_KEY:
+            self.last_image_from_cache = value
+        with self.lock:
+            callbacks = self.callbacks[attr] + self.callbacks['*']
+        for callback in callbacks:
+            callback(self, attr, value)
+
+    # Apply event from an event script.
+    def play(self, event: SimulatedEvent) -> None:
+        if event.event == 'motion':
+            if event.value == 'on':
+                self.motion_started = time.time()
+            self.setAttr(MOTION_DETECTED_KEY, event.value == 'on')
+        elif event.event == 'video':
+            self.arlo.addVideo(self, self.motion_started or time.time())
+        elif event.event == 'snapshot':
+            self.snapshots += 1
+            self.setAttr(LAST_IMAGE_DATA_KEY, self.snapshot())
+        elif event.event == 'battery':
+            self.setAttr(BATTERY_KEY, int(event.value))
+
+    # Videos in the media library as of the latest ml.update().
+    def last_n_videos(self, count):
+        self.arlo.calls['last_n_videos'] += 1
+        with self.lock:
+            return self.videos[:count]
+
+    # pyaarlo reads its media library here; the simulated library is
+    # updated by ml.update() directly.
+    def update_media(self, wait=True):
+        pass
+
+    def request_snapshot(self):
+        self.arlo.calls['request_snapshot'] += 1
+        threading.Timer(self.SNAPSHOT_DELAY, self.play,
+                        [SimulatedEvent(0, self.number, 'snapshot')]).start()
+
+    def start_stream(self, stream_format=None):
+        self.arlo.calls['start_stream'] += 1
+        return self.arlo.stream_url
+
+    def stop_stream(self):
+        pass
+
+#
+# Simulated PyArlo with given number of cameras, numbered from first_camera
+# so that several simulated accounts have distinct device ids. Live streams of
+# all cameras play stream_url; videos are downloaded from video_url, if given.
+# Videos recorded by 'video' events enter the media library at the next
+# ml.update(). Counts the calls that would go to the Arlo cloud.
+#
+class SimulatedArlo:
+
+    def __init__(self, cameras: int = 4, stream_url: str = None,
+                 video_url: str = None, first_camera: int = 0):
+        self.is_connected = True
+        self.last_error = None
+        self.stream_url = stream_url
+        self.video_url = video_url
+        self.calls = collections.Counter() # cloud call -> count
+        self.lock = threading.Lock()
+        self.new_videos = [] # recorded, not yet in media library
+        self.played = 0      # events replayed
+        self.cameras = [SimulatedCamera(self, first_camera + i)
+                        for i in range(cameras)]
+        self.ml = self
+
+    # Record video of camera for motion at time when.
+    def addVideo(self, camera: SimulatedCamera, when: float) -> SimulatedVideo:
+        video = SimulatedVideo(camera, int(1000 * when),
+                               camera.VIDEO_DURATION, self.video_url)
+        with self.lock:
+            self.new_videos.append(video)
+        return video
+
+    # Media library update; ml.update() in pyaarlo.
+    def update(self):
+        self.calls['ml.update'] += 1
+        with self.lock:
+            new_videos, self.new_videos = self.new_videos, []
+        for video in new_videos:
+            with video.camera.lock:
+                video.camera.videos.insert(0, video)
+
+    # Replay events in a background thread; speed 0 replays them as fast as
+    # possible. Returns the thread.
+    def replay(self, events: list, speed: float = 1.0) -> threading.Thread:
+        thread = threading.Thread(target=self.play, args=[events, speed],
+                                  name='simulated-events', daemon=True)
+        thread.start()
+        return thread
+
+    def play(self, events: list, speed: float) -> None:
+        started = time.monotonic()
+        for event in events:
+            if speed > 0:
+                delay = started + event.time / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if event.camera is None:
+                for camera in self.cameras:
+                    camera.play(event)
+            elif event.camera < len(self.cameras):
+                self.cameras[event.camera].play(event)
+            self.played += 1
@@ -0,0 +1,52 @@
+#
+# Tests of reading the accounts file of --accounts.
+#
+import os, unittest
+
+import arlo
+
+class ReadAccountsTest(unittest.TestCase):
+
+    def test_accounts(self):
+        accounts = arlo.read_accounts([
+            '# home and cabin\n',
+            'home@example.com   "my password"  sms  # comment\n',
+            '\n',
+            "cabin@example.com  secret\n"])
+        self.assertEqual([(account['username'], account['password'],
+                           account['tfa_type']) for account in accounts],
+                         [('home@example.com', 'my password', 'SMS'),
+                          ('cabin@example.com', 'secret', 'EMAIL')])
+
+    # Accounts keep their pyaarlo sessions apart.
+    def test_storage_directories(self):
+        home, cabin = arlo.read_accounts(['home@example.com a',
+                                          'cabin@example.com b'])
+        self.assertNotEqual(home['storage_dir'], cabin['storage_dir'])
+        self.assertEqual(os.path.dirname(home['storage_dir']),
+                         os.path.join(arlo.BASE_DIRECTORY, 'accounts'))
+        self.assertEqual(home['storage_dir'],
+                         arlo.account_directory('home@example.com'))
+
+    def test_site_names(self):
+        self.assertEqual(arlo.site_names(['home@example.com',
+                                          'cabin@example.com', 'shed']),
+                         ['home', 'cabin', 'shed'])
+        self.assertEqual(arlo.site_names(['jo@example.com', 'jo@example.org',
+                                          'al@example.com']),
+                         ['jo@example.com', 'jo@example.org', 'al'])
+        self.assertEqual(arlo.site_names(['jo@example.com', 'jo@example.com']),
+                         ['jo@example.com 1', 'jo@example.com 2'])
+
+    def test_errors(self):
+        for lines, message in ((['home@example.com'], 'line 1: expected'),
+                               (['# x', 'a b c d'], 'line 2: expected'),
+                               (['a b PHONE'], "line 1: unknown two-factor"),
+                               (['a "b'], 'line 1:')):
+            with self.assertRaises(ValueError) as context:
+                arlo.read_accounts(lines)
+            self.assertTrue(str(context.exception).startswith(message),
+                            str(context.exception))
+
+if __name__ == '__main__':
+    unittest.main()
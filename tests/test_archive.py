@@ -0,0 +1,235 @@
+#
+# Tests of the video archive: file names, the index, retention, and
+# timelapses.
+#
+import concurrent.futures, datetime, os, tempfile, time, unittest
+from unittest import mock
+
+import arlo
+
+class VideoFileNameTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        when = datetime.datetime(2024, 5, 6, 7, 8, 9)
+        name = arlo.format_video_file_name('Front Door', 'SN123', when)
+        self.assertEqual(arlo.parse_video_file_name(name),
+                         ('Front Door', int(1000 * when.timestamp())))
+
+    def test_epoch_seconds_and_device_id(self):
+        with mock.patch.object(arlo, 'VIDEO_FILENAME_FORMAT', '${SN}_${s}'):
+            name = arlo.format_video_file_name('Front', 'SN123',
+                       datetime.datetime.fromtimestamp(1700000000))
+            self.assertEqual(name, 'SN123_1700000000.mp4')
+            self.assertEqual(arlo.parse_video_file_name(name),
+                             ('SN123', 1700000000000))
+
+    def test_other_names(self):
+        self.assertIsNone(arlo.parse_video_file_name('holiday.mp4'))
+        self.assertIsNone(arlo.parse_video_file_name(
+                              '2024-13-45 07:08:09 Front.mp4'))
+
+class VideoIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp.name, 'Videos')
+        os.makedirs(self.directory)
+        self.index = arlo.VideoIndex(os.path.join(self.temp.name,
+                                                  'index.sqlite'),
+                                     self.directory)
+
+    def tearDown(self):
+        self.index.db.close()
+        self.temp.cleanup()
+
+    # Create a video file named for camera at when; returns its path.
+    def video(self, camera, when, size=10):
+        path = os.path.join(self.directory, arlo.format_video_file_name(
+                   camera, 'SN', datetime.datetime.fromtimestamp(when)))
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+        return path
+
+    def test_created_at_in_whole_seconds(self):
+        path = os.path.join(self.directory, 'a.mp4')
+        self.assertEqual(self.index.add('Front', 1700000000123, path),
+                         arlo.VideoIndex.QUEUED)
+        self.index.setState(path, arlo.VideoIndex.DONE, 10)
+        self.assertEqual(self.index.add('Front', 1700000000999, path),
+                         arlo.VideoIndex.DONE)
+        self.assertEqual(self.index.video(path), ('Front', 1700000000000, 10))
+
+    def test_reconcile_adds_and_removes_external_files(self):
+        path = self.video('Front', 1700000000, 20)
+        other = os.path.join(self.directory, 'holiday.mp4')
+        with open(other, 'wb') as f:
+            f.write(b'\0' * 5)
+        self.index.reconcile()
+        self.assertEqual(self.index.state(path), arlo.VideoIndex.EXTERNAL)
+        self.assertEqual(self.index.video(path), ('Front', 1700000000000, 20))
+        self.assertEqual(self.index.video(other)[0], '')
+        os.remove(path)
+        self.index.reconcile()
+        self.assertIsNone(self.index.state(path))
+        self.assertEqual(self.index.state(other), arlo.VideoIndex.EXTERNAL)
+
+    def test_reconcile_finishes_interrupted_downloads(self):
+        path = self.video('Front', 1700000000, 20)
+        self.index.add('Front', 1700000000000, path)
+        self.index.reconcile()
+        self.assertEqual(self.index.state(path), arlo.VideoIndex.DONE)
+        self.assertTrue(self.index.isArchived(path))
+
+    def test_reconcile_keeps_videos_of_the_same_second(self):
+        queued = os.path.join(self.directory, 'queued.mp4')
+        self.index.add('Front', 1700000000000, queued)
+        path = self.video('Front', 1700000000, 20)
+        with mock.patch('builtins.print') as printed:
+            self.index.reconcile()
+        self.assertIn(path, printed.call_args.args[0])
+        self.assertEqual(self.index.state(queued), arlo.VideoIndex.QUEUED)
+        self.assertEqual(self.index.state(path), arlo.VideoIndex.EXTERNAL)
+        self.assertEqual(self.index.video(path),
+                         ('', os.stat(path).st_mtime_ns // 10**6, 20))
+
+    def test_own_changes_are_not_rescanned(self):
+        self.index.reconcile()
+        path = self.video('Front', 1700000000)
+        self.index.add('Front', 1700000000000, path)
+        self.index.setState(path, arlo.VideoIndex.DONE, 10)
+        with mock.patch.object(self.index, 'rescan') as rescan:
+            self.index.reconcile()
+        rescan.assert_not_called()
+
+    # A change within the tick of the last listing may keep the directory's
+    # modification time; reconcile lists the directory again to find it.
+    def test_change_within_tick_is_found(self):
+        self.index.reconcile()
+        mtime = os.stat(self.directory).st_mtime_ns
+        path = self.video('Front', 1700000000)
+        os.utime(self.directory, ns=(mtime, mtime))
+        self.index.reconcile()
+        self.assertEqual(self.index.state(path), arlo.VideoIndex.EXTERNAL)
+
+class RetentionPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.index = arlo.VideoIndex(os.path.join(self.temp.name,
+                                                  'index.sqlite'),
+                                     self.temp.name)
+        self.now = time.time()
+
+    def tearDown(self):
+        self.index.db.close()
+        self.temp.cleanup()
+
+    # Archive a video of camera created age seconds ago; returns its path.
+    def video(self, camera, age, size):
+        created_at = int(1000 * (self.now - age))
+        path = os.path.join(self.temp.name, f'{camera}-{created_at}.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+        self.index.add(camera, created_at, path)
+        self.index.setState(path, arlo.VideoIndex.DONE, size)
+        return path
+
+    # Run an expiry pass over the archive; returns the policy's stats.
+    def expire(self, **limits):
+        policy = arlo.RetentionPolicy(self.index, **limits)
+        try:
+            policy.load()
+            with policy.cond:
+                policy.expire()
+            return policy.stats()
+        finally:
+            policy.close()
+
+    def test_disabled_without_limits(self):
+        policy = arlo.RetentionPolicy(self.index)
+        policy.close()
+        self.assertFalse(policy.enabled)
+
+    def test_max_age(self):
+        old = self.video('Front', 3 * 86400, 10)
+        new = self.video('Front', 3600, 10)
+        stats = self.expire(max_age=86400)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertIsNone(self.index.state(old))
+        self.assertEqual((stats['files'], stats['bytes']), (1, 10))
+
+    def test_max_bytes_deletes_oldest_of_all_cameras(self):
+        oldest = self.video('Front', 300, 10)
+        older = self.video('Back', 200, 10)
+        newest = self.video('Front', 100, 10)
+        stats = self.expire(max_bytes=15)
+        self.assertFalse(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(older))
+        self.assertTrue(os.path.exists(newest))
+        self.assertEqual(stats['reclaimed_bytes'], 20)
+
+    def test_camera_quota(self):
+        front = [self.video('Front', age, 10) for age in (300, 200, 100)]
+        back = self.video('Back', 400, 10)
+        self.expire(camera_quota=20)
+        self.assertEqual([os.path.exists(path) for path in front],
+                         [False, True, True])
+        self.assertTrue(os.path.exists(back))
+
+class ArchiveIndexerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.index = arlo.VideoIndex(os.path.join(self.temp.name,
+                                                  'index.sqlite'),
+                                     self.temp.name)
+        self.indexer = arlo.ArchiveIndexer(self.index,
+                                           os.path.join(self.temp.name,
+                                                        'Thumbnails'))
+        self.day = datetime.date(2024, 5, 6)
+        self.paths = []
+        for hour in (7, 8):
+            created_at = int(1000 * datetime.datetime(2024, 5, 6, hour)
+                                    .timestamp())
+            path = os.path.join(self.temp.name, f'{hour}.mp4')
+            self.index.add('Front', created_at, path)
+            self.index.setState(path, arlo.VideoIndex.DONE, 10)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.indexer.close()
+        self.index.db.close()
+        self.temp.cleanup()
+
+    # Make timelapse with videos indexed to the given digests, or failing
+    # with the given exceptions; returns its result and the videos in it.
+    def timelapse(self, results):
+        def add(path, size):
+            future = concurrent.futures.Future()
+            result = results[self.paths.index(path)]
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+            return future
+        with mock.patch.object(self.indexer, 'add', add), \
+             mock.patch.object(self.indexer, 'writeTimelapse') as write:
+            paths = self.indexer.timelapse('Front', self.day)
+        return paths, write.call_args.args[1] if write.called else None
+
+    def test_failed_video_is_left_out(self):
+        os.makedirs(self.indexer.directory)
+        paths, videos = self.timelapse([FileNotFoundError('gone'), 'a' * 40])
+        self.assertEqual(videos, [self.paths[1]])
+        self.assertTrue(os.path.exists(paths[1]))
+
+    def test_no_indexed_videos(self):
+        paths, videos = self.timelapse([
+                            concurrent.futures.process.BrokenProcessPool(),
+                            None])
+        self.assertIsNone(paths)
+        self.assertIsNone(videos)
+
+if __name__ == '__main__':
+    unittest.main()
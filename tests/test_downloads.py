@@ -0,0 +1,189 @@
+#
+# Tests of the download engine against a local HTTP server.
+#
+import http.client, http.server, os, re, tempfile, threading, unittest
+from unittest import mock
+
+import arlo
+
+VIDEO = bytes(range(256)) * 400
+
+#
+# Serves VIDEO at any path. Range requests get the rest of the video from the
+# requested offset, or 416 beyond its end. The Range headers received are
+# recorded in ranges.
+#
+class VideoHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.ranges.append(self.headers.get('Range'))
+        offset = 0
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match is not None and not server.ignore_range:
+            offset = int(match[1])
+            if offset >= len(VIDEO):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(VIDEO)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {offset}-{len(VIDEO) - 1}/{len(VIDEO)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(VIDEO) - offset))
+        self.end_headers()
+        data = VIDEO[offset:]
+        if server.truncate is not None: # connection lost
+            data = data[:server.truncate]
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+#
+# Clock that advances when slept on.
+#
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+class DownloadEngineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     VideoHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/video'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.ranges = []
+        self.server.ignore_range = False
+        self.server.truncate = None
+        self.temp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp.name, 'video.mp4')
+        self.engine = arlo.DownloadEngine(workers=1)
+
+    def tearDown(self):
+        self.engine.close()
+        self.temp.cleanup()
+
+    # Write data to the partial download of self.path.
+    def part(self, data):
+        with open(self.path + '.part', 'wb') as f:
+            f.write(data)
+
+    def assertDownloaded(self):
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), VIDEO)
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+    def test_download(self):
+        self.engine.download(self.url, self.path)
+        self.assertDownloaded()
+        self.assertEqual(self.server.ranges, [None])
+
+    def test_resume_from_part(self):
+        self.part(VIDEO[:40000])
+        self.engine.download(self.url, self.path)
+        self.assertDownloaded()
+        self.assertEqual(self.server.ranges, ['bytes=40000-'])
+
+    def test_server_ignores_range(self):
+        self.server.ignore_range = True
+        self.part(b'x' * 40000)
+        self.engine.download(self.url, self.path)
+        self.assertDownloaded()
+
+    # A part of the full length is complete; the server answers 416.
+    def test_complete_part(self):
+        self.part(VIDEO)
+        self.engine.download(self.url, self.path)
+        self.assertDownloaded()
+        self.assertEqual(self.server.ranges, [f'bytes={len(VIDEO)}-'])
+
+    # A longer part is stale; it is deleted and the download starts over.
+    def test_stale_part(self):
+        self.part(VIDEO + b'stale')
+        self.engine.download(self.url, self.path)
+        self.assertDownloaded()
+        self.assertEqual(self.server.ranges,
+                         [f'bytes={len(VIDEO) + 5}-', None])
+
+    # An interrupted download leaves only the part, which is resumed.
+    def test_interrupted_download(self):
+        self.server.truncate = 30000
+        with self.assertRaises(http.client.IncompleteRead):
+            self.engine.download(self.url, self.path)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(os.path.getsize(self.path + '.part'), 30000)
+        self.server.truncate = None
+        self.engine.download(self.url, self.path)
+        self.assertDownloaded()
+        self.assertEqual(self.server.ranges, [None, 'bytes=30000-'])
+
+    def test_queue(self):
+        downloaded = threading.Event()
+        engine = arlo.DownloadEngine(workers=1,
+                                     on_downloaded=lambda path:
+                                                   downloaded.set())
+        try:
+            self.assertTrue(engine.queue(self.url, self.path))
+            self.assertTrue(downloaded.wait(10))
+        finally:
+            engine.close()
+        self.assertDownloaded()
+        self.assertFalse(engine.queue(self.url, self.path))
+        stats = engine.stats()
+        self.assertEqual((stats['done'], stats['failed'], stats['bytes']),
+                         (1, 0, len(VIDEO)))
+
+    def test_downloads_are_rate_limited(self):
+        with mock.patch.object(self.engine.limiter, 'consume') as consume:
+            self.engine.download(self.url, self.path)
+        self.assertEqual(sum(call.args[0] for call in consume.call_args_list),
+                         len(VIDEO))
+
+class BandwidthLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(arlo, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rate(self):
+        limiter = arlo.BandwidthLimiter(1000)
+        for _ in range(50):
+            limiter.consume(100)
+        # The first second's worth of bytes passes at once.
+        self.assertAlmostEqual(self.clock.now - 1000.0, 4.0)
+
+    def test_idle_time_is_credited_up_to_one_second(self):
+        limiter = arlo.BandwidthLimiter(1000)
+        self.clock.now += 60
+        limiter.consume(3000)
+        self.assertAlmostEqual(self.clock.now - 1060.0, 2.0)
+
+    def test_unlimited(self):
+        limiter = arlo.BandwidthLimiter(None)
+        limiter.consume(10**9)
+        self.assertEqual(self.clock.now, 1000.0)
+
+if __name__ == '__main__':
+    unittest.main()
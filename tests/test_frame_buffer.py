@@ -0,0 +1,71 @@
+#
+# Tests of the live stream frame buffer.
+#
+import unittest
+
+import numpy
+
+import arlo
+
+SHAPE = (4, 6, 3)
+
+class FrameBufferTest(unittest.TestCase):
+
+    # Put a frame filled with value into buffer; returns the frame.
+    def put(self, buffer, value, captured=None):
+        frame = buffer.acquire(SHAPE)
+        frame.fill(value)
+        buffer.put(frame, captured)
+        return frame
+
+    def test_latest_frame_replaces_older(self):
+        buffer = arlo.FrameBuffer()
+        for value in (1, 2, 3):
+            self.put(buffer, value, captured=float(value))
+        captured, frame = buffer.get_latest()
+        self.assertEqual(captured, 3.0)
+        self.assertEqual(frame[0, 0, 0], 3)
+        self.assertIsNone(buffer.get_latest())
+        stats = buffer.stats()
+        self.assertEqual(stats['frames'], 3)
+        self.assertEqual(stats['dropped'], 2)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['high_water'], 1)
+
+    def test_get_latest_drops_queued_frames(self):
+        buffer = arlo.FrameBuffer(slots=3)
+        for value in (1, 2, 3):
+            self.put(buffer, value)
+        self.assertEqual(buffer.stats()['queued'], 3)
+        self.assertEqual(buffer.get_latest()[1][0, 0, 0], 3)
+        self.assertEqual(buffer.stats()['dropped'], 2)
+        self.assertAlmostEqual(buffer.stats()['drop_rate'], 2 / 3)
+
+    def test_arrays_are_recycled(self):
+        buffer = arlo.FrameBuffer()
+        first = self.put(buffer, 1)
+        second = self.put(buffer, 2) # drops first
+        self.assertIs(buffer.acquire(SHAPE), first)
+        _, frame = buffer.get_latest()
+        self.assertIs(frame, second)
+        buffer.release(frame)
+        self.assertIs(buffer.acquire(SHAPE), second)
+        self.assertIsNot(buffer.acquire(SHAPE), second)
+
+    def test_other_shape_is_allocated(self):
+        buffer = arlo.FrameBuffer()
+        buffer.release(numpy.empty(SHAPE, dtype=numpy.uint8))
+        frame = buffer.acquire((2, 2, 3))
+        self.assertEqual(frame.shape, (2, 2, 3))
+        self.assertEqual(frame.dtype, numpy.uint8)
+
+    def test_reset_recycles_queued_frames(self):
+        buffer = arlo.FrameBuffer(slots=2)
+        frame = self.put(buffer, 1)
+        buffer.reset()
+        self.assertIsNone(buffer.get_latest())
+        self.assertEqual(buffer.stats()['frames'], 0)
+        self.assertIs(buffer.acquire(SHAPE), frame)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#
+# Tests of the battery and signal history of cameras.
+#
+import datetime, os, tempfile, types, unittest
+
+import arlo
+
+class HealthHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.history = arlo.HealthHistory(self.temp.name)
+        self.start = 1700000000
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def test_records_changes_and_heartbeats(self):
+        history, start = self.history, self.start
+        flags = arlo.HealthHistory.AVAILABLE
+        self.assertTrue(history.add('A', start, 90, 4, flags))
+        self.assertFalse(history.add('A', start + 900, 90, 4, flags))
+        self.assertTrue(history.add('A', start + 1800, 89, 4, flags))
+        self.assertTrue(history.add('A', start + 1800 +
+                                    arlo.HealthHistory.HEARTBEAT, 89, 4,
+                                    flags))
+        self.assertTrue(history.add('A', start + 9000, None, None, 0))
+        self.assertEqual(history.records('A'), [
+            (start, 90, 4, flags), (start + 1800, 89, 4, flags),
+            (start + 5400, 89, 4, flags), (start + 9000, None, None, 0)])
+        self.assertEqual(history.records('A', start + 1801),
+                         history.records('A')[2:])
+        self.assertEqual(history.records('B'), [])
+
+    # A record cut short by a crash is dropped, so later records stay aligned.
+    def test_truncated_record(self):
+        self.history.add('A', self.start, 90, 4, 0)
+        with open(self.history.path('A'), 'ab') as f:
+            f.write(b'\1\2\3')
+        history = arlo.HealthHistory(self.temp.name)
+        self.assertTrue(history.add('A', self.start + 60, 89, 4, 0))
+        self.assertEqual([record[1] for record in history.records('A')],
+                         [90, 89])
+
+    def test_drain(self):
+        # 1% per 6 hours, 4% per day, from 60% on.
+        for hour in range(0, 49, 6):
+            self.history.add('A', self.start + 3600 * hour, 60 - hour // 6,
+                             4, arlo.HealthHistory.AVAILABLE)
+        now = self.start + 48 * 3600
+        drain, low_at = self.history.drain('A', 15, now)
+        self.assertAlmostEqual(drain, 4.0)
+        self.assertAlmostEqual((low_at - now) / 86400, (52 - 15) / 4)
+
+    def test_no_drain_after_charge(self):
+        self.history.add('A', self.start, 40, 4, 0)
+        self.history.add('A', self.start + 3600, 38, 4, 0)
+        self.history.add('A', self.start + 7200, 39, 4,
+                         arlo.HealthHistory.CHARGING)
+        self.history.add('A', self.start + 10800, 80, 4, 0)
+        self.assertIsNone(self.history.drain('A', 15, self.start + 10800))
+
+    def test_no_drain_on_short_history(self):
+        self.history.add('A', self.start, 40, 4, 0)
+        self.history.add('A', self.start + 3600, 39, 4, 0)
+        self.assertIsNone(self.history.drain('A', 15, self.start + 3600))
+
+class PollHealthTest(unittest.TestCase):
+
+    # A camera shared by two accounts is seen by both sites, whose views may
+    # differ; it is recorded once per poll.
+    def test_shared_camera_recorded_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            camera = lambda level: types.SimpleNamespace(device_id='SN1',
+                                                         battery_level=level)
+            core = types.SimpleNamespace(
+                       now=lambda: datetime.datetime.fromtimestamp(1700000000),
+                       health=arlo.HealthHistory(directory),
+                       monitors={
+                           ('home', 'SN1'): types.SimpleNamespace(
+                                                camera=camera(80)),
+                           ('cabin', 'SN1'): types.SimpleNamespace(
+                                                 camera=camera(79))})
+            readings = arlo.ArloCore.pollHealth(core)
+            self.assertEqual([level for _, level, _, _ in readings], [80, 79])
+            self.assertEqual(core.health.records('SN1'), [
+                (1700000000, 80, None, arlo.HealthHistory.AVAILABLE)])
+
+if __name__ == '__main__':
+    unittest.main()
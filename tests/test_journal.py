@@ -0,0 +1,137 @@
+#
+# Tests of the event journal and its replay.
+#
+import os, sys, tempfile, threading, unittest
+
+import arlo
+
+# Camera with the parts of pyaarlo's ArloCamera that EventJournal uses.
+class Camera:
+
+    def __init__(self, device_id, name):
+        self.device_id = device_id
+        self.name = name
+        self.model_id = 'VMC4041P'
+        self.battery_level = 80
+        self.last_image_from_cache = b'jpeg'
+
+    def add_attr_callback(self, attr, callback):
+        pass
+
+class Video:
+
+    def __init__(self, created_at, duration):
+        self.created_at = created_at
+        self.media_duration_seconds = duration
+
+class EventJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp.name, 'events.journal')
+        self.cameras = [Camera('A', 'Front'), Camera('B', 'Back')]
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def test_round_trip(self):
+        journal = arlo.EventJournal(self.path, self.cameras)
+        journal.attributeChanged(self.cameras[1], arlo.MOTION_DETECTED_KEY,
+                                 True)
+        journal.attributeChanged(self.cameras[0], arlo.BATTERY_KEY, 42)
+        journal.media(self.cameras[1], [Video(2000, 10), Video(1000, 5)], 25)
+        journal.close()
+        records = [(kind, device_id, data) for _, kind, device_id, data
+                   in arlo.EventJournal.records(self.path)]
+        self.assertEqual(records, [
+            (arlo.EventJournal.SESSION, None, None),
+            (arlo.EventJournal.CAMERA, 'A', ('Front', 'VMC4041P')),
+            (arlo.EventJournal.ATTRIBUTE, 'A', (arlo.BATTERY_KEY, 80)),
+            (arlo.EventJournal.ATTRIBUTE, 'A',
+             (arlo.LAST_IMAGE_DATA_KEY, b'jpeg')),
+            (arlo.EventJournal.CAMERA, 'B', ('Back', 'VMC4041P')),
+            (arlo.EventJournal.ATTRIBUTE, 'B', (arlo.BATTERY_KEY, 80)),
+            (arlo.EventJournal.ATTRIBUTE, 'B',
+             (arlo.LAST_IMAGE_DATA_KEY, b'jpeg')),
+            (arlo.EventJournal.ATTRIBUTE, 'B',
+             (arlo.MOTION_DETECTED_KEY, True)),
+            (arlo.EventJournal.ATTRIBUTE, 'A', (arlo.BATTERY_KEY, 42)),
+            (arlo.EventJournal.MEDIA, 'B', [(2000, 10), (1000, 5)])])
+
+    def test_truncated_record_ends_records(self):
+        journal = arlo.EventJournal(self.path, self.cameras)
+        journal.close()
+        count = len(list(arlo.EventJournal.records(self.path)))
+        with open(self.path, 'ab') as f:
+            f.write(arlo.EventJournal.RECORD.pack(0, 2, 0, 100) + b'x')
+        self.assertEqual(len(list(arlo.EventJournal.records(self.path))),
+                         count)
+
+    def test_not_a_journal(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'something else')
+        with self.assertRaises(ValueError):
+            arlo.EventJournal(self.path, self.cameras)
+
+    # Lists that a replay gets by slicing the last recorded list are skipped.
+    def test_media_recorded_when_changed(self):
+        videos = [Video(1000 * i, 5) for i in range(40, 0, -1)]
+        journal = arlo.EventJournal(self.path, self.cameras)
+        for _ in range(3):
+            journal.media(self.cameras[0], videos, sys.maxsize)
+            journal.media(self.cameras[0], videos[:25], 25)
+        videos.insert(0, Video(50000, 5))
+        journal.media(self.cameras[0], videos[:25], 25)
+        journal.media(self.cameras[0], videos, sys.maxsize)
+        journal.close()
+        self.assertEqual([len(data) for _, kind, _, data
+                          in arlo.EventJournal.records(self.path)
+                          if kind == arlo.EventJournal.MEDIA], [40, 25, 41])
+
+    def test_replay(self):
+        journal = arlo.EventJournal(self.path, self.cameras)
+        journal.attributeChanged(self.cameras[0], arlo.MOTION_DETECTED_KEY,
+                                 True)
+        journal.media(self.cameras[0], [Video(2000, 10)], 25)
+        journal.attributeChanged(self.cameras[1], arlo.BATTERY_KEY, 12)
+        journal.close()
+        replay = arlo.JournalArlo(self.path, speed=0)
+        self.assertTrue(replay.is_connected)
+        self.assertEqual([(camera.device_id, camera.name, camera.battery_level)
+                          for camera in replay.cameras],
+                         [('A', 'Front', 80), ('B', 'Back', 80)])
+        events = []
+        for camera in replay.cameras:
+            camera.add_attr_callback('*', lambda camera, attr, value:
+                                     events.append((camera.device_id, attr,
+                                                    value)))
+        finished = threading.Event()
+        replay.start(lambda played, seconds: finished.set())
+        self.assertTrue(finished.wait(10))
+        self.assertIn(('A', arlo.MOTION_DETECTED_KEY, True), events)
+        self.assertEqual(events[-1], ('B', arlo.BATTERY_KEY, 12))
+        self.assertEqual(replay.cameras[1].battery_level, 12)
+        videos = replay.cameras[0].last_n_videos(25)
+        self.assertEqual([(video.created_at, video.media_duration_seconds)
+                          for video in videos], [(2000, 10)])
+
+    def test_replay_of_missing_journal(self):
+        replay = arlo.JournalArlo(os.path.join(self.temp.name, 'missing'))
+        self.assertFalse(replay.is_connected)
+
+    def test_core_without_connected_sites(self):
+        missing = os.path.join(self.temp.name, 'missing')
+        videos = os.path.join(self.temp.name, 'Videos')
+        os.makedirs(videos)
+        index = arlo.VideoIndex(os.path.join(self.temp.name, 'index.sqlite'),
+                                videos)
+        core = arlo.ArloCore(arlo=[arlo.JournalArlo(missing),
+                                   arlo.JournalArlo(missing)], index=index)
+        core.shutdown()
+        self.assertFalse(core.is_connected)
+        self.assertEqual(len(core.errors), 2)
+        self.assertTrue(core.errors[0].startswith('site 1: '))
+        self.assertTrue(core.errors[1].startswith('site 2: '))
+
+if __name__ == '__main__':
+    unittest.main()
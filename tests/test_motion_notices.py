@@ -0,0 +1,41 @@
+#
+# Tests of matching motion notifications to videos.
+#
+import unittest
+
+import arlo
+
+class MotionNoticesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.notices = arlo.MotionNotices()
+        self.notifications = {}
+        for when in (300.0, 100.0, 200.0): # out of order
+            self.notifications[when] = arlo.Notification(None, 'Motion',
+                                                         f'at {when}')
+            self.notices.add(when, self.notifications[when])
+
+    def test_match_closest(self):
+        self.assertIs(self.notices.match(204.0, 10.0),
+                      self.notifications[200.0])
+        self.assertEqual(len(self.notices), 2)
+        self.assertIs(self.notices.match(195.0, 200.0),
+                      self.notifications[100.0])
+        self.assertIs(self.notices.match(0.0, 1000.0),
+                      self.notifications[300.0])
+        self.assertEqual(len(self.notices), 0)
+
+    def test_no_match_outside_window(self):
+        self.assertIsNone(self.notices.match(250.0, 10.0))
+        self.assertIsNone(self.notices.match(310.0, 10.0))
+        self.assertEqual(len(self.notices), 3)
+
+    def test_expire(self):
+        self.notices.expire(200.0)
+        self.assertEqual(self.notices.times, [200.0, 300.0])
+        self.assertIsNone(self.notices.match(100.0, 10.0))
+        self.notices.expire(1000.0)
+        self.assertEqual(len(self.notices), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#
+# Tests of the notification dispatcher with a fake clock.
+#
+import threading, time, unittest
+from unittest import mock
+
+import arlo
+
+#
+# Clock of the dispatcher; advanced by the tests.
+#
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+#
+# Backend that blocks in show until released.
+#
+class BlockingBackend(arlo.NullNotificationBackend):
+
+    entered = threading.Event()
+    release = threading.Event()
+
+    def show(self, notification):
+        self.entered.set()
+        self.release.wait(10)
+        return super().show(notification)
+
+class NotificationDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(arlo, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dispatcher = None
+
+    def tearDown(self):
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+
+    def start(self, backend=arlo.NullNotificationBackend):
+        self.dispatcher = arlo.NotificationDispatcher(backend)
+        return self.dispatcher
+
+    # Wait until the dispatcher has shown count notifications; returns its
+    # stats.
+    def wait_shown(self, count):
+        deadline = time.monotonic() + 10
+        while self.dispatcher.stats()['shown'] < count and \
+              time.monotonic() < deadline:
+            time.sleep(0.001)
+        return self.dispatcher.stats()
+
+    def test_coalesced(self):
+        dispatcher = self.start()
+        first = dispatcher.notify('Motion', 'Front Door', 'front')
+        self.wait_shown(1)
+        self.clock.now += 10
+        self.assertIs(dispatcher.notify('Motion', 'Front Door', 'front'),
+                      first)
+        self.assertEqual(first.title(), 'Motion (2 events)')
+        self.assertIsNot(dispatcher.notify('Motion', 'Back Door', 'back'),
+                         first)
+        self.wait_shown(3)
+        self.clock.now += arlo.NotificationDispatcher.COALESCE_WINDOW
+        self.assertIsNot(dispatcher.notify('Motion', 'Front Door', 'front'),
+                         first)
+        stats = self.wait_shown(4)
+        self.assertEqual((stats['posted'], stats['coalesced'],
+                          stats['shown'], stats['dropped']), (4, 1, 4, 0))
+        self.assertEqual(dispatcher.backend.shown, 4)
+
+    # A key is shown at most once every MIN_INTERVAL seconds; events in
+    # between are shown together once the interval has passed.
+    def test_rate_limited(self):
+        dispatcher = self.start()
+        first = dispatcher.notify('Motion', 'Front Door', 'front')
+        self.wait_shown(1)
+        self.clock.now += 1
+        dispatcher.notify('Motion', 'Front Door', 'front')
+        dispatcher.notify('Motion', 'Front Door', 'front')
+        time.sleep(0.2)
+        stats = dispatcher.stats()
+        self.assertEqual((stats['shown'], stats['pending']), (1, 1))
+        self.clock.now += arlo.NotificationDispatcher.MIN_INTERVAL
+        dispatcher.notify('Battery', 'Back Door') # wakes the dispatcher
+        stats = self.wait_shown(3)
+        self.assertEqual((stats['posted'], stats['coalesced'],
+                          stats['shown'], stats['pending']), (4, 2, 3, 0))
+        self.assertEqual(first.count, 3)
+
+    # Notifications are dropped, not waited for, when the queue is full.
+    def test_dropped_when_queue_full(self):
+        BlockingBackend.entered.clear()
+        BlockingBackend.release.clear()
+        dispatcher = self.start(BlockingBackend)
+        dispatcher.notify('Motion', 'camera 0')
+        self.assertTrue(BlockingBackend.entered.wait(10))
+        for camera in range(1, arlo.NotificationDispatcher.QUEUE_SIZE + 3):
+            dispatcher.notify('Motion', f'camera {camera}')
+        stats = dispatcher.stats()
+        self.assertEqual((stats['posted'], stats['dropped']),
+                         (arlo.NotificationDispatcher.QUEUE_SIZE + 3, 2))
+        BlockingBackend.release.set()
+        stats = self.wait_shown(arlo.NotificationDispatcher.QUEUE_SIZE + 1)
+        self.assertEqual((stats['shown'], stats['pending']),
+                         (arlo.NotificationDispatcher.QUEUE_SIZE + 1, 0))
+
+if __name__ == '__main__':
+    unittest.main()
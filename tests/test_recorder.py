@@ -0,0 +1,85 @@
+#
+# Tests of the pre-roll buffer and recordings of live streams.
+#
+import os, tempfile, time, unittest
+
+import numpy
+
+import arlo
+
+# Wait until the encoder of pre_roll has kept or discarded the frame taken
+# last; it hands back the frame's array when done with it.
+def wait_for_encoder(pre_roll):
+    deadline = time.monotonic() + 10
+    while (pre_roll.pending is not None or pre_roll.spare is None) and \
+          time.monotonic() < deadline:
+        time.sleep(0.001)
+
+class PreRollBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        arlo.opencv()
+        self.frame = numpy.zeros((48, 64, 3), numpy.uint8)
+
+    def test_frames_kept_at_max_fps(self):
+        pre_roll = arlo.PreRollBuffer(seconds=10)
+        for i in range(40): # 16 frames per second
+            pre_roll.add(self.frame, 100 + i / 16)
+            wait_for_encoder(pre_roll)
+        self.assertEqual(pre_roll.stats()['frames'], 10)
+        frames = pre_roll.drain()
+        self.assertEqual([timestamp for timestamp, _ in frames],
+                         [100 + i / 4 for i in range(10)])
+        self.assertEqual(pre_roll.stats()['frames'], 0)
+
+    def test_oldest_frames_dropped(self):
+        pre_roll = arlo.PreRollBuffer(seconds=1)
+        for i in range(10):
+            pre_roll.add(self.frame, 100 + i / 2)
+            wait_for_encoder(pre_roll)
+        self.assertEqual([timestamp for timestamp, _ in pre_roll.drain()],
+                         [103.5, 104.0, 104.5])
+
+    # A frame offered while the encoder is busy is skipped, not waited for.
+    def test_busy_encoder(self):
+        pre_roll = arlo.PreRollBuffer(seconds=10)
+        with pre_roll.cond: # encoder cannot take the first frame
+            pre_roll.add(self.frame, 100)
+            pre_roll.add(self.frame, 101)
+        wait_for_encoder(pre_roll)
+        stats = pre_roll.stats()
+        self.assertEqual((stats['frames'], stats['skipped']), (1, 1))
+
+class StreamRecorderTest(unittest.TestCase):
+
+    def test_recording_starts_with_pre_roll(self):
+        cv2 = arlo.opencv()
+        frame = numpy.zeros((48, 64, 3), numpy.uint8)
+        pre_roll = arlo.PreRollBuffer(seconds=10)
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = arlo.StreamRecorder('Front', 'SN1', pre_roll,
+                                           os.path.join(directory, 'Local'))
+            for i in range(8): # 2 seconds of pre-roll at 4 frames per second
+                recorder.update(frame, 8, 100 + i / 4)
+                wait_for_encoder(pre_roll)
+            recorder.trigger(102)
+            for i in range(8): # 1 second of recording
+                recorder.update(frame, 8, 102 + i / 8)
+            recorder.stop()
+            self.assertEqual(os.path.dirname(recorder.path),
+                             os.path.join(directory, 'Local'))
+            # The writer thread finishes the file in the background.
+            deadline = time.monotonic() + 10
+            while True:
+                capture = cv2.VideoCapture(recorder.path)
+                count = 0
+                while capture.read()[0]:
+                    count += 1
+                capture.release()
+                if count >= 24 or time.monotonic() > deadline:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(count, 24) # pre-roll frames written twice
+
+if __name__ == '__main__':
+    unittest.main()
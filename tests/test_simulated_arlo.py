@@ -0,0 +1,39 @@
+#
+# Tests of the event scripts of the simulated Arlo cloud.
+#
+import unittest
+
+from simulated_arlo import SimulatedEvent, parse_events
+
+class ParseEventsTest(unittest.TestCase):
+
+    def test_events(self):
+        events = parse_events(['# storm\n',
+                               '2.5 3 motion on\n',
+                               '1 1 video  # recorded late\n',
+                               '\n',
+                               '60 * battery 12\n',
+                               '0 2 snapshot\n'])
+        self.assertEqual(events, [SimulatedEvent(0.0, 1, 'snapshot'),
+                                  SimulatedEvent(1.0, 0, 'video'),
+                                  SimulatedEvent(2.5, 2, 'motion', 'on'),
+                                  SimulatedEvent(60.0, None, 'battery',
+                                                 '12')])
+
+    def test_errors(self):
+        for line, message in (('1 1', 'expected'),
+                              ('1 1 fire', "unknown event 'fire'"),
+                              ('1 1 motion maybe', 'invalid value'),
+                              ('1 1 video now', 'invalid value'),
+                              ('1 1 battery', 'needs a number'),
+                              ('1 1 battery low', 'needs a number'),
+                              ('soon 1 video', 'could not convert'),
+                              ('1 first video', 'invalid literal')):
+            with self.assertRaises(ValueError) as context:
+                parse_events(['0 1 motion on', line])
+            self.assertTrue(str(context.exception).startswith('line 2: '),
+                            str(context.exception))
+            self.assertIn(message, str(context.exception))
+
+if __name__ == '__main__':
+    unittest.main()
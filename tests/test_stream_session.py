@@ -0,0 +1,131 @@
+#
+# Tests of stream sessions with a fake start_stream and fake captures, so
+# reconnects and times to first frame follow a script.
+#
+import unittest
+from unittest import mock
+
+import numpy
+
+import arlo
+
+#
+# Clock of the session; advanced by the captures.
+#
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+#
+# Capture that opens if script is not None; script lists the seconds before
+# each frame, after which reads fail.
+#
+class FakeCapture:
+
+    def __init__(self, clock, script):
+        self.clock = clock
+        self.script = list(script) if script is not None else None
+        self.released = False
+
+    def isOpened(self):
+        return self.script is not None
+
+    def read(self, frame=None):
+        if not self.script:
+            return False, None
+        self.clock.now += self.script.pop(0)
+        return True, numpy.zeros((2, 2, 3), numpy.uint8)
+
+    def release(self):
+        self.released = True
+
+class StreamSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for patcher in (mock.patch.object(arlo, 'time', self.clock),
+                        mock.patch.object(arlo.StreamSession, 'MIN_BACKOFF',
+                                          0.001),
+                        mock.patch.object(arlo.StreamSession, 'MAX_BACKOFF',
+                                          0.001)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.urls = []    # returned by start_stream
+        self.opened = []  # urls opened, in order
+        self.scripts = [] # of the captures, in order
+
+    def startStream(self):
+        url = f'rtsp://camera/{len(self.urls)}'
+        self.urls.append(url)
+        return url
+
+    def openCapture(self, url):
+        self.opened.append(url)
+        return FakeCapture(self.clock, self.scripts.pop(0))
+
+    def session(self, start_stream=None, **kwargs):
+        session = arlo.StreamSession(start_stream or self.startStream,
+                                     **kwargs)
+        patcher = mock.patch.object(session, 'openCapture', self.openCapture)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return session
+
+    def read(self, session, count):
+        for _ in range(count):
+            retval, frame = session.read()
+            self.assertTrue(retval)
+            self.assertEqual(frame.shape, (2, 2, 3))
+
+    def test_reconnects(self):
+        # fails to open, stalls after two frames, then reconnects
+        self.scripts = [None, [1.0, 0.0], [0.25]]
+        session = self.session()
+        self.read(session, 3)
+        self.assertEqual(session.stats(), {'first_ttff': 1.0, 'ttff': 0.25,
+                                           'stalls': 1, 'reconnects': 2})
+        # a url that failed to open is replaced; one that sent frames is
+        # reused after a stall
+        self.assertEqual(self.urls, ['rtsp://camera/0', 'rtsp://camera/1'])
+        self.assertEqual(self.opened, ['rtsp://camera/0', 'rtsp://camera/1',
+                                       'rtsp://camera/1'])
+
+    def test_new_url_when_nothing_sent(self):
+        self.scripts = [[], [0.5]]
+        session = self.session()
+        self.read(session, 1)
+        self.assertEqual(self.opened, ['rtsp://camera/0', 'rtsp://camera/1'])
+        self.assertEqual(session.stats(), {'first_ttff': 0.5, 'ttff': 0.5,
+                                           'stalls': 0, 'reconnects': 1})
+
+    def test_stale_url_replaced(self):
+        self.scripts = [[0.0], [0.0]]
+        session = self.session(url='rtsp://camera/given')
+        self.read(session, 1)
+        self.clock.now += arlo.StreamSession.URL_LIFETIME + 1
+        self.read(session, 1)
+        self.assertEqual(self.opened, ['rtsp://camera/given',
+                                       'rtsp://camera/0'])
+
+    def test_gives_up(self):
+        reconnecting = []
+        session = self.session(start_stream=lambda: None,
+                               on_reconnect=lambda: reconnecting.append(1))
+        self.assertEqual(session.read(), (False, None))
+        self.assertEqual(session.failures,
+                         arlo.StreamSession.MAX_FAILURES + 1)
+        self.assertEqual(session.stats()['reconnects'],
+                         arlo.StreamSession.MAX_FAILURES)
+        self.assertEqual(len(reconnecting), arlo.StreamSession.MAX_FAILURES)
+        self.assertIsNone(session.stats()['first_ttff'])
+
+    def test_closed(self):
+        self.scripts = [[0.0, 0.0]]
+        session = self.session()
+        self.read(session, 1)
+        session.close()
+        self.assertEqual(session.read(), (False, None))